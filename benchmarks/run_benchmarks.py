@@ -0,0 +1,200 @@
+#run_benchmarks.py
+'''
+Benchmarks of the functions of aggregation.py and system_model.py on
+synthetic EXIOBASE shaped tables (see synthetic.py) for a range of region
+counts and matrix formats. For every function the wall and cpu time, the
+peak python memory (tracemalloc), the peak resident memory and the
+throughput (non zero entries of the input tables per second) are recorded
+with mojo_logger.StageProfiler.
+
+The results are compared with a stored baseline (baseline.json) and
+functions that are slower than the baseline by more than the tolerance are
+reported. Run from the repository root, e.g.
+    python benchmarks/run_benchmarks.py -r 5 10 25 50 100 200 -f dense csr
+    python benchmarks/run_benchmarks.py --save-baseline
+Dense tables larger than --max-dense-gb are skipped.
+'''
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'mojo'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import mojo_logger
+import sparse_utils
+import aggregation as agg
+import load_exiobase
+import system_model as sm
+from synthetic import make_synthetic, write_synthetic
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+
+def table_nnz(*tables):
+    return int(sum(t.nnz if hasattr(t, 'nnz') else np.count_nonzero(t)
+                   for t in tables))
+
+
+def run_case(N_reg, matrix_format, logger, options):
+    """Runs all benchmarked functions for one region count and format and
+    returns the profile records."""
+    data = make_synthetic(N_reg, options.products, options.activities,
+                          options.density, options.secondary_density,
+                          options.byproducts, options.seed)
+    V = sparse_utils.as_format(data.pop('V'), matrix_format)
+    U = sparse_utils.as_format(data.pop('U'), matrix_format)
+    work_dir = tempfile.mkdtemp(prefix='mojo_benchmark_')
+    profiler = mojo_logger.StageProfiler(work_dir, trace_memory=
+                                         not options.no_tracemalloc)
+    def timed(name, func, *args, n_entries=None):
+        with profiler.stage(name) as record:
+            outputs = func(*args)
+            profiler.add_outputs(record, outputs)
+        record['throughput'] = None if n_entries is None else\
+                               n_entries/max(record['wall_time'], 1e-9)
+        return outputs
+    try:
+        agg_file, cal_file, names_file = write_synthetic(data, work_dir)
+        #without the report, which is timed on its own
+        aggregation_matrix, N_reg, N_prod, N_sec = timed(
+                'get_aggregation_matrix', agg.get_aggregation_matrix,
+                work_dir, agg_file, cal_file, '', '', logger)
+        timed('aggregation_report', agg.aggregation_report,
+              data['aggregation'], aggregation_matrix, ['Manufacure of Gas'],
+              data['regions'], work_dir, 'report.csv', N_reg, N_prod, N_sec,
+              logger)
+        iot_names, country_dic, prod_dic, country_list =\
+                load_exiobase.get_aggregated_product_names(work_dir,
+                                                           names_file, logger)
+        labels = sm.LabelIndex(iot_names)
+        vagg, uagg = timed('aggregate', agg.aggregate, V, U,
+                           aggregation_matrix, logger,
+                           n_entries=table_nnz(V, U))
+        del V, U
+        n_agg = table_nnz(vagg, uagg)
+        all_excl_byprods = iot_names.values[timed('get_exclusive_byproducts',
+                                   sm.get_exclusive_byproducts, vagg, logger,
+                                   n_entries=n_agg)]
+        excl_byproducts, market_names, grid_electricity, elec_markets =\
+                timed('create_market_and_product_names',
+                      sm.create_market_and_product_names, all_excl_byprods,
+                      N_reg, country_list, logger)
+        timed('create_model_labels', sm.create_model_labels, iot_names,
+              grid_electricity, elec_markets, excl_byproducts, market_names)
+        grids = timed('create_electricity_grids', sm.create_electricity_grids,
+                      vagg, uagg, N_reg, N_sec, labels, logger,
+                      n_entries=n_agg)
+        markets = timed('create_excl_byprod_markets',
+                        sm.create_excl_byprod_markets, grids[0], grids[1],
+                        excl_byproducts, all_excl_byprods, N_sec, labels,
+                        logger, n_entries=n_agg)
+        V_model, U_model = timed('assemble_SUT', sm.assemble_SUT, markets[0],
+                                 markets[1], grids[2], grids[3], grids[4],
+                                 grids[5], markets[2], markets[3], markets[4],
+                                 markets[5], logger)
+        Z_model, A_model = timed('make_IOT', sm.make_IOT, U_model, V_model,
+                                 logger, n_entries=n_agg)
+        timed('update_electricity_mix_IOT', sm.update_electricity_mix_IOT,
+              Z_model, A_model, V_model, grids[3]*1.1, logger)
+    finally:
+        shutil.rmtree(work_dir)
+    return profiler.records
+
+
+def compare(results, baseline, tolerance):
+    """Prints the wall times relative to the baseline and returns the
+    (case, function, ratio) of the regressions."""
+    regressions = []
+    print('{:<14} {:<34} {:>10} {:>10} {:>8} {:>12}'.format('case',
+          'function', 'wall [s]', 'base [s]', 'ratio', 'peak [MB]'))
+    for case, records in results.items():
+        for record in records:
+            base = baseline.get(case, {}).get(record['stage'])
+            ratio = record['wall_time']/base if base else None
+            print('{:<14} {:<34} {:>10.4f} {:>10} {:>8} {:>12}'.format(case,
+                  record['stage'], record['wall_time'],
+                  '' if base is None else '{:.4f}'.format(base),
+                  '' if ratio is None else '{:.2f}'.format(ratio),
+                  '' if record.get('traced_peak_mb') is None else
+                  '{:.1f}'.format(record['traced_peak_mb'])))
+            if ratio is not None and ratio > tolerance:
+                regressions.append((case, record['stage'], ratio))
+    return regressions
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--regions", type=int, nargs='+',
+                        default=[5, 10, 25], help='numbers of regions')
+    parser.add_argument("-f", "--formats", nargs='+', default=['dense', 'csr'],
+                        choices=sparse_utils.MATRIX_FORMATS,
+                        help='matrix formats')
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--activities", type=int, default=164)
+    parser.add_argument("--density", type=float, default=0.01,
+                        help='fraction of non zeros of the use table')
+    parser.add_argument("--secondary-density", type=float, default=0.001,
+                        help='fraction of secondary production in the supply'
+                        ' table')
+    parser.add_argument("--byproducts", type=int, default=3,
+                        help='number of exclusive byproducts')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-dense-gb", type=float, default=4,
+                        help='skip dense cases with larger tables')
+    parser.add_argument("--no-tracemalloc", action='store_true',
+                        help='do not trace the memory allocations (faster)')
+    parser.add_argument("-o", "--output", type=str,
+                        default='benchmark_results.json')
+    parser.add_argument("--baseline", type=str, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action='store_true',
+                        help='store the wall times as new baseline')
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help='report functions slower than tolerance times '
+                        'the baseline')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    logger = logging.getLogger('mojo_benchmark')
+    logger.setLevel(logging.WARNING)
+    results = {}
+    for N_reg in args.regions:
+        for matrix_format in args.formats:
+            table_gb = (N_reg*args.products)*(N_reg*args.activities)*8/1e9
+            case = '{}-{}'.format(matrix_format, N_reg)
+            if matrix_format == 'dense' and table_gb > args.max_dense_gb:
+                print('Skipping {}: dense tables of {:.1f} GB'.format(case,
+                                                                   table_gb))
+                continue
+            start = time.time()
+            results[case] = run_case(N_reg, matrix_format, logger, args)
+            print('{} done in {:.1f} s'.format(case, time.time()-start))
+    with open(args.output, 'w') as f:
+        json.dump({'options': vars(args), 'results': results}, f, indent=1)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for case, function, ratio in regressions:
+        print('REGRESSION {} {}: {:.2f} x baseline'.format(case, function,
+                                                          ratio))
+    if args.save_baseline:
+        baseline.update({case: {r['stage']: r['wall_time'] for r in records}
+                         for case, records in results.items()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
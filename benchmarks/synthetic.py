@@ -0,0 +1,166 @@
+#synthetic.py
+'''
+Generator of synthetic supply and use tables with the structure of the
+EXIOBASE hybrid SUTs used by mojo: N_reg regions with N_prod products and
+N_sec activities each, the aggregation matrix and calorific values read by
+aggregation.get_aggregation_matrix and the aggregated product names read by
+load_exiobase.get_aggregated_product_names.
+
+get_aggregation_matrix uses fixed positions (products 141-145 are aggregated
+with calorific values into activity 109), so N_prod >= 146, N_sec >= 110 and
+N_prod - N_sec >= 36 (200 products and 164 activities in EXIOBASE). The
+electricity products (Product code 1 'p40.11.*') are the aggregated products
+95-106 as in EXIOBASE.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+GAS_ROWS = np.arange(141, 146) #products aggregated with calorific values
+GAS_SECTOR = 109
+ELEC_SECTORS = np.arange(95, 107)
+ELEC_LETTERS = 'abcdefghijkl'
+NATURAL_GAS = 20 #product with code 'C_GASE'
+
+
+def sector_of_products(N_prod, N_sec):
+    """Returns the activity (aggregated product) of every product."""
+    if N_prod < 146 or N_sec < 110 or N_prod - N_sec < 36:
+        raise ValueError('Need N_prod >= 146, N_sec >= 110 and N_prod - N_sec'
+                         ' >= 36, got {} and {}'.format(N_prod, N_sec))
+    before = np.arange(GAS_ROWS[0])*GAS_SECTOR//GAS_ROWS[0]
+    n_after = N_prod - GAS_ROWS[-1] - 1
+    after = GAS_SECTOR + 1 + np.arange(n_after)*(N_sec - GAS_SECTOR - 1)//\
+            n_after
+    return np.concatenate([before, np.full(len(GAS_ROWS), GAS_SECTOR), after])
+
+
+def sector_codes(N_sec):
+    """Returns Product code 1, Product code 2, product name and activity code
+    2 of the activities."""
+    code1 = np.array(['p{:03d}'.format(s) for s in range(N_sec)], dtype=object)
+    code2 = np.array(['C_S{:03d}'.format(s) for s in range(N_sec)],
+                     dtype=object)
+    names = np.array(['Product {}'.format(s) for s in range(N_sec)],
+                     dtype=object)
+    for s, letter in zip(ELEC_SECTORS, ELEC_LETTERS):
+        code1[s] = 'p40.11.{}'.format(letter)
+        code2[s] = 'C_POW{}'.format(letter.upper())
+        names[s] = 'Electricity {}'.format(letter)
+    code1[GAS_SECTOR] = 'p40.2'
+    code2[GAS_SECTOR] = 'C_MGAS'
+    names[GAS_SECTOR] = 'Manufactured gas'
+    activity_code2 = np.array([c.replace('C_', 'A_') for c in code2])
+    return code1, code2, names, activity_code2
+
+
+def make_synthetic(N_reg=5, N_prod=200, N_sec=164, density=0.01,
+                   secondary_density=0.001, n_byproducts=3, seed=0):
+    """Returns a dictionary with a synthetic EXIOBASE shaped data set:
+    V, U            csr supply and use tables (N_reg*N_prod x N_reg*N_sec)
+    aggregation     aggregation matrix DataFrame (N_prod x N_sec)
+    calvals         calorific values DataFrame (N_prod x N_reg)
+    names           aggregated product names DataFrame (N_reg*N_sec rows)
+    regions         list of region codes
+    excl_byproducts rows of the aggregated tables that are exclusive
+                    byproducts
+    Input:
+    density             fraction of non zero entries of U
+    secondary_density   fraction of non zero secondary production in V
+    n_byproducts        number of aggregated products that are an exclusive
+                        byproduct (in half of the regions); the first one is
+                        electricity
+    """
+    rng = np.random.default_rng(seed)
+    sector_of = sector_of_products(N_prod, N_sec)
+    code1, code2, names, activity_code2 = sector_codes(N_sec)
+    regions = ['R{:03d}'.format(r) for r in range(N_reg)]
+    n_rows, n_cols = N_reg*N_prod, N_reg*N_sec
+    #exclusive byproducts: the activity does not exist in half of the regions
+    #and its product is made by the next activity instead
+    others = np.setdiff1d(np.arange(N_sec), np.concatenate([ELEC_SECTORS,
+                                                [GAS_SECTOR]]))
+    byproduct_sectors = np.concatenate([ELEC_SECTORS[:1], rng.choice(others,
+                                       max(n_byproducts-1, 0), replace=False)])
+    byproduct_regions = np.sort(rng.choice(N_reg, max(N_reg//2, 1),
+                                           replace=False))
+    producer = np.arange(N_sec)
+    for s in byproduct_sectors:
+        p = (s + 1) % N_sec
+        while p in byproduct_sectors:
+            p = (p + 1) % N_sec
+        producer[s] = p
+    #principal production
+    row_regions = np.repeat(np.arange(N_reg), N_prod)
+    row_products = np.tile(np.arange(N_prod), N_reg)
+    v_rows = np.arange(n_rows)
+    v_sectors = sector_of[row_products]
+    is_byproduct = np.isin(v_sectors, byproduct_sectors) &\
+                   np.isin(row_regions, byproduct_regions)
+    v_sectors[is_byproduct] = producer[v_sectors[is_byproduct]]
+    v_cols = row_regions*N_sec + v_sectors
+    v_data = rng.random(n_rows) + 1
+    #secondary production within the region, not by the missing activities
+    n_secondary = int(secondary_density*n_rows*N_sec)
+    secondary_rows = rng.integers(0, n_rows, n_secondary)
+    secondary_sectors = rng.integers(0, N_sec, n_secondary)
+    keep = ~(np.isin(secondary_sectors, byproduct_sectors) &
+             np.isin(row_regions[secondary_rows], byproduct_regions))
+    V = sp.coo_matrix((np.concatenate([v_data,
+                       rng.random(keep.sum())*0.1]),
+                       (np.concatenate([v_rows, secondary_rows[keep]]),
+                        np.concatenate([v_cols, row_regions[
+                        secondary_rows[keep]]*N_sec +
+                        secondary_sectors[keep]]))),
+                      shape=(n_rows, n_cols)).tocsr()
+    V.sum_duplicates()
+    excl_byproducts = (byproduct_regions[:,None]*N_sec +
+                       byproduct_sectors[None,:]).ravel()
+    n_use = int(density*n_rows*n_cols)
+    U = sp.coo_matrix((rng.random(n_use), (rng.integers(0, n_rows, n_use),
+                       rng.integers(0, n_cols, n_use))),
+                      shape=(n_rows, n_cols)).tocsr()
+    U.sum_duplicates()
+
+    product_code2 = ['C_P{:03d}'.format(p) for p in range(N_prod)]
+    product_code2[NATURAL_GAS] = 'C_GASE'
+    product_index = pd.MultiIndex.from_arrays([np.arange(1, N_prod+1),
+                        ['Raw product {}'.format(p) for p in range(N_prod)],
+                        ['{}.{}'.format(code1[s], p) for p, s in
+                         enumerate(sector_of)], product_code2])
+    aggregation_values = np.zeros((N_prod, N_sec))
+    aggregation_values[np.arange(N_prod), sector_of] = 1
+    aggregation = pd.DataFrame(aggregation_values, index=product_index,
+                               columns=pd.MultiIndex.from_arrays([
+                               ['Activity {}'.format(s) for s in range(N_sec)],
+                               [c.replace('p', 'i', 1) for c in code1],
+                               activity_code2]))
+    calvals = pd.DataFrame(np.full((N_prod, N_reg), np.nan),
+                           index=product_index, columns=regions)
+    calvals.iloc[GAS_ROWS,:] = rng.random((len(GAS_ROWS), N_reg))*0.05
+    calvals.iloc[NATURAL_GAS,:] = 0.04
+    agg_names = pd.DataFrame({'Country code': np.repeat(regions, N_sec),
+                              'Product name': np.tile(names, N_reg),
+                              'Product code 1': np.tile(code1, N_reg),
+                              'Product code 2': np.tile(code2, N_reg),
+                              'Unit': 'TJ'})
+    return {'V': V, 'U': U, 'aggregation': aggregation, 'calvals': calvals,
+            'names': agg_names, 'regions': regions,
+            'excl_byproducts': np.sort(excl_byproducts)}
+
+
+def write_synthetic(data, path_name, agg_file='aggregation_matrix.csv',
+                    cal_file='Calorific_values.csv',
+                    names_file='IOTnames.csv'):
+    """Writes the aggregation matrix, calorific values and names of a
+    synthetic data set in the csv layout of the EXIOBASE files."""
+    os.makedirs(path_name, exist_ok=True)
+    data['aggregation'].to_csv(os.path.join(path_name, agg_file))
+    with open(os.path.join(path_name, cal_file), 'w') as f:
+        for i in range(4): #the real file has 4 lines of meta data
+            f.write('synthetic calorific values\n')
+        data['calvals'].to_csv(f, header=True, index=True)
+    data['names'].to_csv(os.path.join(path_name, names_file), index=False)
+    return agg_file, cal_file, names_file
@@ -1,10 +1,134 @@
 #aggregation.py
 import os
+import gzip
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from mojo_logger import LogMessage
+import sparse_utils
 import sys
 
+class BlockAggregationMatrix(object):
+    """Block diagonal aggregation matrix of a multi regional table.
+
+    The full (N_reg*N_prod x N_reg*N_sec) aggregation matrix has the same
+    (N_prod x N_sec) block on the diagonal for every region. Only this shared
+    block is stored, together with a few entries that differ per region (e.g.
+    the relative calorific values). The full matrix is never created; tables
+    are aggregated region block by region block on a (N_reg, N_prod, columns)
+    view. It can be used for any table with N_reg*N_prod rows ordered by
+    region.
+
+    Input:
+    block           : shared (N_prod x N_sec) aggregation block
+    N_reg           : number of regions
+    override_rows   : row (product) indices within a block of the entries that
+                      differ per region
+    override_cols   : column (sector) indices within a block of those entries
+    override_values : (N_reg x len(override_rows)) array with the region
+                      specific values of those entries
+    """
+
+    def __init__(self, block, N_reg, override_rows=None, override_cols=None,
+                 override_values=None):
+        self.block = np.asarray(block, dtype=float)
+        self.N_reg = N_reg
+        self.N_prod, self.N_sec = self.block.shape
+        if override_rows is None:
+            override_rows, override_cols = [], []
+            override_values = np.zeros((N_reg, 0))
+        self.override_rows = np.asarray(override_rows, dtype=int)
+        self.override_cols = np.asarray(override_cols, dtype=int)
+        self.override_values = np.asarray(override_values, dtype=float
+                                          ).reshape(N_reg, -1)
+        #difference between the region specific and the shared values
+        self._override_delta = self.override_values - self.block[
+                                     self.override_rows, self.override_cols]
+
+    @property
+    def shape(self):
+        return (self.N_reg*self.N_prod, self.N_reg*self.N_sec)
+
+    def region_block(self, region):
+        """Returns the (N_prod x N_sec) aggregation block of one region."""
+        block = self.block.copy()
+        block[self.override_rows, self.override_cols] =\
+                                           self.override_values[region]
+        return block
+
+    def region_values(self, rows, cols):
+        """Returns a (N_reg x len(rows)) array with the values of the entries
+        (rows, cols) of the aggregation block of every region."""
+        rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+        values = np.tile(self.block[rows, cols], (self.N_reg, 1))
+        for k, (row, col) in enumerate(zip(self.override_rows,
+                                           self.override_cols)):
+            values[:, (rows == row) & (cols == col)] =\
+                                          self.override_values[:, k:k+1]
+        return values
+
+    def toarray(self):
+        """Returns the full dense aggregation matrix. Only meant for small
+        tables and debugging."""
+        full = np.zeros(self.shape)
+        for r in range(self.N_reg):
+            full[r*self.N_prod:(r+1)*self.N_prod,
+                 r*self.N_sec:(r+1)*self.N_sec] = self.region_block(r)
+        return full
+
+    def aggregate(self, a):
+        """Aggregates the rows of a, i.e. returns aggregation_matrix.T.dot(a).
+        Input:
+        a       : (N_reg*N_prod x n) numpy array or scipy.sparse matrix
+
+        Output:
+        (N_reg*N_sec x n) array, or sparse matrix in the format of a, with
+        the dtype of a.
+        """
+        if a.shape[0] != self.shape[0]:
+            raise ValueError('Table has {} rows, expected {}'.format(
+                             a.shape[0], self.shape[0]))
+        if sp.issparse(a):
+            return self._aggregate_sparse(a)
+        n_cols = a.shape[1]
+        a3 = np.asarray(a).reshape(self.N_reg, self.N_prod, n_cols)
+        agg3 = np.einsum('ps,rpc->rsc', self.block.astype(a3.dtype,
+                         copy=False), a3, optimize=True)
+        if len(self.override_rows):
+            correction = self._override_delta[:,:,None]*\
+                         a3[:, self.override_rows, :]
+            np.add.at(agg3, (slice(None), self.override_cols), correction)
+        return agg3.reshape(self.N_reg*self.N_sec, n_cols)
+
+    def _aggregate_sparse(self, a):
+        """Sparse version of aggregate. The rows of every region are moved
+        next to each other into a (N_prod x N_reg*n) matrix so the shared
+        block is applied in one sparse product."""
+        matrix_format = sparse_utils.get_format(a)
+        n_cols = a.shape[1]
+        a = a.tocoo()
+        region, prod = np.divmod(a.row, self.N_prod)
+        wide = sp.csr_matrix((a.data, (prod, region*n_cols+a.col)),
+                             shape=(self.N_prod, self.N_reg*n_cols))
+        agg_wide = (sp.csr_matrix(self.block.T, dtype=a.dtype) @ wide
+                    ).tocoo()
+        rows = [agg_wide.row]
+        cols = [agg_wide.col]
+        data = [agg_wide.data]
+        if len(self.override_rows):
+            overrides = wide[self.override_rows, :].tocoo()
+            rows.append(self.override_cols[overrides.row])
+            cols.append(overrides.col)
+            data.append(overrides.data*self._override_delta[
+                        overrides.col//n_cols, overrides.row])
+        rows, cols, data = map(np.concatenate, (rows, cols, data))
+        region, col = np.divmod(cols, n_cols)
+        return sp.csr_matrix((data.astype(a.dtype, copy=False),
+                             (region*self.N_sec+rows, col)),
+                             shape=(self.N_reg*self.N_sec, n_cols)
+                             ).asformat(matrix_format)
+
+
 def aggregate(v,u,aggregation_matrix, logger):
     """Aggreagte supply and use tables through multiplication with
     aggregation matrix. All of the tables are considered to be of the format
@@ -12,7 +136,11 @@ def aggregate(v,u,aggregation_matrix, logger):
     Input:
     v       : supply table (products x industries)
     u       : use table (products x industries)
-    aggregation_matrix : aggregation matrix (products x industries)
+    aggregation_matrix : aggregation matrix (products x industries), either a
+                         BlockAggregationMatrix or a plain array
+
+    If v and u are scipy.sparse matrices the aggregation is done sparse as
+    well and the aggregated tables are returned in the same sparse format.
 
     Ouput:
     vagg    : aggregated supply table (products x industries)
@@ -20,40 +148,31 @@ def aggregate(v,u,aggregation_matrix, logger):
     """
     logger.info(LogMessage(aggregate.__name__,
                 'Aggregating supply and use tables...'))
-    vagg = aggregation_matrix.T.dot(v)
-    uagg = aggregation_matrix.T.dot(v)
+    matrix_format = sparse_utils.get_format(v)
+    if isinstance(aggregation_matrix, BlockAggregationMatrix):
+        vagg = aggregation_matrix.aggregate(v)
+        uagg = aggregation_matrix.aggregate(u)
+    elif matrix_format == 'dense':
+        vagg = aggregation_matrix.T.dot(v)
+        uagg = aggregation_matrix.T.dot(u)
+    else:
+        aggregation_matrix_T = sp.csr_matrix(aggregation_matrix.T)
+        vagg = (aggregation_matrix_T @ v).asformat(matrix_format)
+        uagg = (aggregation_matrix_T @ u).asformat(matrix_format)
     logger.info(LogMessage(aggregate.__name__,
                 'Succesfully aggregated supply and use tables.'))
     return vagg, uagg
 
 
 
-def get_aggregation_matrix(path_name, agg_file, cal_file,
-                           agg_report_path, agg_report_file,logger):
-    """Returns a numpy array which can be used for aggregation
-    For now it aggregates by 'priciple coproducts' so that each industry has
-    one princple product. The products that are aggregated are written out
-    to an aggregation report with filename specified by user.
-    
-    Input:
-    path_name:      Path to directory containing the aggregation matrix
-                    and matrix with the caloric values.
-    agg_file        File name of aggregation matrx
-    cal_file        File name of file with calorific values
-    agg_report_path Path to direcotry where the aggregation report is written
-    agg_report_file File name for aggregation report
-    
+def read_aggregation_files(path_name, agg_file, cal_file, logger):
+    """Reads the aggregation matrix and the calorific values.
     Output:
-    new_aggregation_matrix
-                    Aggregation matrix with the relative caloric values for
-                    the to be aggregated values
-    
-
-    Note: For now only aggregates the 'Manufacture of gas;', 'i40.2.a', 'A_MGWG'
-    using the caloric values relative to natural gas, so that it can later
-    later subsitute natural gas.
+    aggregation_matrix  DataFrame (N_prod x N_sec) with the product and
+                        industry labels
+    calval              DataFrame with the calorific values of every region
     """
-    _name = get_aggregation_matrix.__name__ #function name for logging purposes
+    _name = read_aggregation_files.__name__ #function name for logging purposes
     
     a_p2f = os.path.join(path_name, agg_file) #path2file
     if not os.path.exists(a_p2f):
@@ -75,6 +194,38 @@ def get_aggregation_matrix(path_name, agg_file, cal_file,
                                                                         c_p2f)))
     calval = pd.read_csv(c_p2f, header=[4], index_col=[0,1,2,3])
     calval.fillna(1, inplace=True) #fill all empty places with a 1
+    return aggregation_matrix, calval
+
+
+def get_aggregation_matrix(path_name, agg_file, cal_file,
+                           agg_report_path, agg_report_file,logger):
+    """Returns a numpy array which can be used for aggregation
+    For now it aggregates by 'priciple coproducts' so that each industry has
+    one princple product. The products that are aggregated are written out
+    to an aggregation report with filename specified by user, unless
+    agg_report_file is empty (see write_aggregation_report).
+    
+    Input:
+    path_name:      Path to directory containing the aggregation matrix
+                    and matrix with the caloric values.
+    agg_file        File name of aggregation matrx
+    cal_file        File name of file with calorific values
+    agg_report_path Path to direcotry where the aggregation report is written
+    agg_report_file File name for aggregation report
+    
+    Output:
+    new_aggregation_matrix
+                    BlockAggregationMatrix with the relative caloric values
+                    for the to be aggregated values
+    
+
+    Note: For now only aggregates the 'Manufacture of gas;', 'i40.2.a', 'A_MGWG'
+    using the caloric values relative to natural gas, so that it can later
+    later subsitute natural gas.
+    """
+    _name = get_aggregation_matrix.__name__ #function name for logging purposes
+    aggregation_matrix, calval = read_aggregation_files(path_name, agg_file,
+                                                        cal_file, logger)
     
     Natural_gas_calval = calval.loc[calval.index.get_level_values(3)
                                                     == 'C_GASE'].values[0]
@@ -96,33 +247,54 @@ def get_aggregation_matrix(path_name, agg_file, cal_file,
                                                                  format(N_sec)))
     
     #insert relative caloric values for in Manufacturing of Gas section
-    new_aggregation_matrix = np.zeros((N_reg*N_prod,N_reg*N_sec))
-    for i in range(N_reg):
-        new_aggregation_matrix[i*N_prod:i*N_prod+N_prod,
-                               i*N_sec:i*N_sec+N_sec] = aggregation_matrix
     logger.info(LogMessage(_name, 'Inserting calorific values for {}'.format(
                                    aggregation_matrix.columns[109][0])))
-    for i in range(N_reg):
-        #print(calval.iloc[141:146,i]/Natural_gas_calval[i])
-        new_aggregation_matrix[i*N_prod+141:i*N_prod+146,i*N_sec+109] =\
-                                    calval.iloc[141:146,i]/Natural_gas_calval[i]
+    gas_rows = np.arange(141,146)
+    relative_calval = (calval.iloc[141:146,:N_reg].values/
+                       Natural_gas_calval[:N_reg]).T
+    new_aggregation_matrix = BlockAggregationMatrix(aggregation_matrix.values,
+                                 N_reg, override_rows=gas_rows,
+                                 override_cols=np.full(len(gas_rows), 109),
+                                 override_values=relative_calval)
 
     #write aggregation report
+    if agg_report_file:
+        _write_report(aggregation_matrix, calval, new_aggregation_matrix,
+                      agg_report_path, agg_report_file, logger)
+    
+    return new_aggregation_matrix, N_reg, N_prod, N_sec
+
+
+def write_aggregation_report(path_name, agg_file, cal_file,
+                             new_aggregation_matrix, agg_report_path,
+                             agg_report_file, logger):
+    """Writes the aggregation report of the aggregation matrix made by
+    get_aggregation_matrix (e.g. loaded from the stage cache) from the
+    same files, see aggregation_report."""
+    aggregation_matrix, calval = read_aggregation_files(path_name, agg_file,
+                                                        cal_file, logger)
+    _write_report(aggregation_matrix, calval, new_aggregation_matrix,
+                  agg_report_path, agg_report_file, logger)
+
+
+def _write_report(aggregation_matrix, calval, new_aggregation_matrix,
+                  agg_report_path, agg_report_file, logger):
+    N_prod, N_sec = aggregation_matrix.shape
     country_list = list(calval.columns)
     aggregation_report(aggregation_matrix, new_aggregation_matrix,
                             ['Manufacure of Gas'], country_list,
                             agg_report_path, agg_report_file,
-                            N_reg, N_prod, N_sec, logger)
-    logger.info(LogMessage(_name, 'Aggregation report written to {}'.format(
-                               os.path.join(agg_report_path, agg_report_file))))
-    
-    return new_aggregation_matrix, N_reg, N_prod, N_sec
+                            new_aggregation_matrix.N_reg, N_prod, N_sec,
+                            logger)
+    logger.info(LogMessage(write_aggregation_report.__name__,
+                           'Aggregation report written to {}'.format(
+                           os.path.join(agg_report_path, agg_report_file))))
 
 
 
 def aggregation_report(aggregation_matrix, new_aggregation_matrix,
                        industry_list, country_list, out_dir, out_file,
-                       N_reg, N_prod, N_sec, logger):
+                       N_reg, N_prod, N_sec, logger, chunk_size=100000):
     '''
     Writes a csv file with the names of products that are aggregated in
     which industry and with what value (i.e. just summed or weighted sum using
@@ -130,51 +302,75 @@ def aggregation_report(aggregation_matrix, new_aggregation_matrix,
     Input:
     aggregation_matrix          The original aggregation matrix as a pandas DF
     new_aggregation_matrix      The N_reg*N_prod x N_reg*Nsec aggregation matrix
-                                containing the relative caloric values.
+                                (BlockAggregationMatrix) containing the
+                                relative caloric values.
     industry_list               List containing industries that have been
                                 aggregated using caloric values.
     country_list                A list of the countries
     out_dir                     Output directory name
-    out_file                    Ouput file name
+    out_file                    Ouput file name. The format follows from the
+                                extension: '|' separated text (default), gzip
+                                compressed text ('.gz'), a numpy archive with
+                                one array per column ('.npz') or parquet
+                                ('.parquet', needs pyarrow or fastparquet)
+    chunk_size                  Number of rows written at once to text files
     '''
-
-
-    nr_of_products = []
+    _name = aggregation_report.__name__
+    table = aggregation_report_table(aggregation_matrix,
+                                     new_aggregation_matrix, country_list,
+                                     N_reg)
     p2f = os.path.join(out_dir, out_file)
-    with open(p2f, 'w') as f:
+    logger.info(LogMessage(_name, 'Writing {} aggregated products of {} '
+                                  'regions'.format(len(table), N_reg)))
+    if p2f.endswith('.npz'):
+        np.savez_compressed(p2f, **{column: table[column].to_numpy()
+                            if pd.api.types.is_numeric_dtype(table[column])
+                            else table[column].to_numpy(dtype=str)
+                            for column in table.columns})
+        return
+    if p2f.endswith('.parquet'):
+        table.to_parquet(p2f, index=False)
+        return
+    opener = gzip.open if p2f.endswith('.gz') else open
+    with opener(p2f, 'wt') as f:
         f.write('# Agrgegation report \n')
         f.write('# The Following industries were aggregated using'+
                 'caloric values: \n')
         for industry in industry_list:
             f.write('# {} \n'.format(industry))
-        f.write('|'.join(['Country code','Industry name','Industry code 1',
-                  'Industry code 2', 'Number of products to be aggregated',
-                  'Product name', 'Product code 1','Product code 2',
-                  'Aggregation Value', '\n']))
-        for c in range(N_reg):
-            for i in range(aggregation_matrix.shape[1]):
-                n_prods = aggregation_matrix.iloc[:,i].sum()
-                if n_prods > 1:
-                    prod_inds = np.where(aggregation_matrix.iloc[:,i]==1)[0]
-                    #print(prod_inds)
-                    aggregated_prods = [aggregation_matrix.index[x] for
-                                                                 x in prod_inds]
-                    aggregation_values = new_aggregation_matrix[
-                                                  prod_inds+c*N_prod, i+c*N_sec]
-                    #print(aggregation_values)
-                    nr_of_products.append(n_prods)
-                    #print(*aggregation_matrix.columns[i], n_prods)
-                    for j,prod in enumerate(aggregated_prods):
-                        #if j == 0:
-                        #    print(prod[1:])
-                            f.write('|'.join([country_list[c],'|'.join(
-                                    aggregation_matrix.columns[i]),
-                                    '{}'.format(n_prods), '|'.join(prod[1:]),
-                                    '{}'.format(aggregation_values[j]), '\n']))
-                        #else:
-                        #    f.write('|'.join(['','','','','', '|'.join(
-                        #            prod[1:]), '{}'.format(
-                        #            aggregation_values[j]), '\n']))
+        #the empty last column gives the closing '|' of every line
+        table[''] = ''
+        table.to_csv(f, sep='|', index=False, chunksize=chunk_size)
     return
 
 
+def aggregation_report_table(aggregation_matrix, new_aggregation_matrix,
+                             country_list, N_reg):
+    '''
+    Returns the rows of the aggregation report as pandas DataFrame: for every
+    region the products of all industries that aggregate more than one
+    product, with their aggregation value in that region. The industries and
+    products are looked up once and repeated for the regions, only the values
+    differ per region.
+    '''
+    structure = aggregation_matrix.values
+    n_prods = structure.sum(axis=0)
+    #(industry, product) pairs ordered by industry, then product
+    industries, products = np.nonzero((structure == 1).T &
+                                      (n_prods > 1)[:,None])
+    values = new_aggregation_matrix.region_values(products, industries)
+    n_pairs = len(industries)
+    table = {'Country code': np.repeat(np.asarray(country_list)[:N_reg],
+                                       n_pairs)}
+    for level, column in enumerate(['Industry name', 'Industry code 1',
+                                    'Industry code 2']):
+        table[column] = np.tile(aggregation_matrix.columns.get_level_values(
+                                level).values[industries], N_reg)
+    table['Number of products to be aggregated'] = np.tile(
+                                                n_prods[industries], N_reg)
+    for level, column in enumerate(['Product name', 'Product code 1',
+                                    'Product code 2'], 1):
+        table[column] = np.tile(aggregation_matrix.index.get_level_values(
+                                level).values[products], N_reg)
+    table['Aggregation Value'] = values.ravel()
+    return pd.DataFrame(table)
@@ -0,0 +1,241 @@
+#batch.py
+'''
+Runs the system model for several scenarios (e.g. ENTSO-E years or other
+config variants) in one batch. The stages that are the same for all
+scenarios (loading and aggregating EXIOBASE, ...) are run once. Their outputs
+are written to memory mapped files that the scenario processes share, so the
+base tables are neither recomputed nor copied per scenario. The scenario
+stages are run by a pool of processes. Every scenario writes its results to
+its own directory of the output directory, the timings of all scenarios are
+collected in batch_timing.csv.
+
+Scenarios are defined in an ini file with one section per scenario; every
+key is a section.option of the main config file to override, e.g.
+    [entsoe_2017]
+    entsoe_data.update_grid_mix : True
+    entsoe_data.ddir : /path/to/entsoe-beebee-2017/
+'''
+
+import argparse
+import configparser
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import mojo_logger
+from mojo_logger import LogMessage
+from pipeline import Pipeline
+import system_model
+
+TARGETS = ('iot', 'model_labels', 'aggregation_report')
+MIN_SHARED_BYTES = 65536 #arrays smaller than this are pickled
+
+
+class _SharedPickler(pickle.Pickler):
+    """Pickler that writes large numpy arrays to .npy files in share_dir
+    instead of into the pickle."""
+
+    def __init__(self, f, share_dir):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.share_dir = share_dir
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype != object and\
+           obj.nbytes >= MIN_SHARED_BYTES:
+            file_name = 'array_{}.npy'.format(self.n_arrays)
+            self.n_arrays += 1
+            np.save(os.path.join(self.share_dir, file_name), obj)
+            return file_name
+        return None
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    """Unpickler that reads the arrays written by _SharedPickler as read
+    only memory maps."""
+
+    def __init__(self, f, share_dir):
+        super().__init__(f)
+        self.share_dir = share_dir
+
+    def persistent_load(self, file_name):
+        return np.load(os.path.join(self.share_dir, file_name), mmap_mode='r')
+
+
+def write_shared(obj, share_dir):
+    """Writes obj to share_dir, large arrays as separate .npy files."""
+    os.makedirs(share_dir, exist_ok=True)
+    with open(os.path.join(share_dir, 'objects.pkl'), 'wb') as f:
+        _SharedPickler(f, share_dir).dump(obj)
+
+
+def read_shared(share_dir):
+    """Reads an object written by write_shared, with the large arrays as
+    read only memory maps shared by all processes reading them."""
+    with open(os.path.join(share_dir, 'objects.pkl'), 'rb') as f:
+        return _SharedUnpickler(f, share_dir).load()
+
+
+def config_to_dict(config):
+    return {s: {k: config.get(s, k, raw=True) for k in config[s]}
+            for s in config.sections()}
+
+
+def scenario_config(config, overrides):
+    """Returns a copy of config with the overrides {section.option: value}
+    applied."""
+    new_config = configparser.ConfigParser()
+    new_config.read_dict(config_to_dict(config))
+    for key, value in overrides.items():
+        section, option = key.split('.', 1)
+        if not new_config.has_section(section):
+            new_config.add_section(section)
+        new_config.set(section, option, value)
+    return new_config
+
+
+def read_scenarios(p2f):
+    """Reads the scenarios ini file into a dictionary scenario name ->
+    {section.option: value}."""
+    scenarios = configparser.ConfigParser()
+    scenarios.optionxform = str #keep the case of the options
+    scenarios.read(p2f)
+    return {s: dict(scenarios[s]) for s in scenarios.sections()}
+
+
+def shared_stages(pipelines, targets=TARGETS):
+    """Returns the names of the stages that have the same key in all
+    pipelines and are needed by the other stages or are targets
+    themselves. Running these once is enough for all scenarios."""
+    first = pipelines[0]
+    same = [name for name in first.stages if
+            len(set(p.key(name) for p in pipelines)) == 1]
+    shared = [name for name in same if name in targets]
+    for stage in first.stages.values():
+        if stage.name not in same:
+            shared.extend(i for i in stage.inputs if i in same)
+    return sorted(set(shared))
+
+
+def _run_scenario(args):
+    name, config_dict, share_dir, log_dir, out_dir, logger_name,\
+                                                   targets = args
+    start, cpu_start = time.time(), time.process_time()
+    logger = logging.getLogger(logger_name)
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    pipeline = Pipeline(system_model.model_stages(log_dir), config, logger,
+                        system_model.get_stage_cache(config, logger))
+    pipeline.results.update(read_shared(share_dir))
+    results = {t: pipeline.run(t) for t in targets}
+    scenario_dir = os.path.join(out_dir, name)
+    if os.path.exists(scenario_dir):
+        shutil.rmtree(scenario_dir)
+    write_shared(results, scenario_dir)
+    logger.info(LogMessage(_run_scenario.__name__, 'Finished scenario {} in '
+                           '{:.1f} s'.format(name, time.time()-start)))
+    return {'scenario': name, 'wall_time': time.time()-start,
+            'cpu_time': time.process_time()-cpu_start,
+            'stage_times': json.dumps(pipeline.timings)}
+
+
+def batch_model(config, scenarios, logger, log_dir, out_dir, processes=None,
+                targets=TARGETS):
+    """Runs the system model for all scenarios.
+    Input:
+    config      :   configparser object with the base configuration
+    scenarios   :   dictionary scenario name -> {section.option: value} with
+                    the config overrides of the scenario
+    out_dir     :   directory for the results; the results of a scenario are
+                    read with read_shared(os.path.join(out_dir, scenario))
+    processes   :   number of processes, None for one per cpu
+
+    Output:
+    DataFrame with the wall and cpu time and the stage times per scenario,
+    also written to out_dir/batch_timing.csv. The shared stages are the
+    scenario 'shared'.
+    """
+    _name = batch_model.__name__
+    start = time.time()
+    configs = {name: scenario_config(config, overrides)
+               for name, overrides in scenarios.items()}
+    pipelines = [Pipeline(system_model.model_stages(log_dir), c, logger)
+                 for c in configs.values()]
+    shared = shared_stages(pipelines, targets)
+    logger.info(LogMessage(_name, 'Running shared stages {} once for {} '
+                           'scenarios'.format(', '.join(shared),
+                                              len(scenarios))))
+    base = Pipeline(system_model.model_stages(log_dir),
+                    next(iter(configs.values())), logger,
+                    system_model.get_stage_cache(config, logger))
+    shared_results = {name: base.run(name) for name in shared}
+    timings = [{'scenario': 'shared', 'wall_time': time.time()-start,
+                'cpu_time': np.nan, 'stage_times': json.dumps(base.timings)}]
+    os.makedirs(out_dir, exist_ok=True)
+    share_dir = tempfile.mkdtemp(prefix='mojo_shared_', dir=out_dir)
+    try:
+        write_shared(shared_results, share_dir)
+        del shared_results, base
+        jobs = [(name, config_to_dict(c), share_dir, log_dir, out_dir,
+                 logger.name, targets) for name, c in configs.items()]
+        with ProcessPoolExecutor(processes) as pool:
+            timings.extend(pool.map(_run_scenario, jobs))
+    finally:
+        shutil.rmtree(share_dir)
+    timings = pd.DataFrame(timings).set_index('scenario')
+    timings.to_csv(os.path.join(out_dir, 'batch_timing.csv'))
+    logger.info(LogMessage(_name, 'Finished {} scenarios in {:.1f} s'.format(
+                                  len(scenarios), time.time()-start)))
+    return timings
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    print("Parsing arguments...")
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-c", "--config", type=str, dest='config_file',
+                        default='./ConfigFile.ini', help='path to the'\
+                        'configuration file. Default file script folder.')
+
+    parser.add_argument("-s", "--scenarios", type=str, dest='scenario_file',
+                        default='./Scenarios.ini', help='path to the'\
+                        ' scenario file. Default file script folder.')
+
+    parser.add_argument("-p", "--processes", type=int, dest='processes',
+                        default=None, help='number of processes, default'\
+                        ' one per cpu')
+
+    args = parser.parse_args()
+
+    print("Arguments parsed.")
+    return args
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    if os.path.exists(args.config_file) and\
+       os.path.exists(args.scenario_file):
+        print('Using configuration file: {}'.format(args.config_file))
+        config = configparser.ConfigParser()
+        config.read(args.config_file)
+        projectName = config.get('project_info', 'project_name')
+        if config.get('project_info', 'log_dir'):
+            log_dir = config.get('project_info', 'log_dir')
+        else:
+            log_dir = config.get('project_info', 'project_outdir')
+        logger = mojo_logger.Logger(log_dir, projectName, __file__)
+        batch_model(config, read_scenarios(args.scenario_file), logger,
+                    log_dir, os.path.join(config.get('project_info',
+                    'project_outdir'), 'batch'), args.processes)
+    else:
+        print('Config or scenario file does not exist, please check paths')
+        print('exiting...')
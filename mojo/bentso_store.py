@@ -0,0 +1,191 @@
+#bentso_store.py
+'''
+Columnar store for the ENTSO-E data cached by bentso (data/entsoe/bentso/data),
+which comes as one pickle per kind (capacity, generation, load, trade),
+country and year. convert_bentso packs all pickles of a kind into one
+directory with
+    values.npy      all values, one flat float64 array
+    timestamps.npy  all time stamps (UTC, int64 ns)
+    index.json      per (country, year) the offsets into the arrays, the
+                    columns and the time zone
+The arrays are read as memory maps, so looking up a country and year only
+reads that slice. Trade data is stored with the country 'FROM-TO'.
+'''
+
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from mojo_logger import LogMessage
+
+STORE_VERSION = 1
+KINDS = ('capacity', 'generation', 'load', 'trade')
+
+
+def parse_file_name(file_name):
+    """Returns kind, country and year of a bentso pickle file name
+    kind-country-year.pickle, e.g. trade-AL-GR-2016.pickle -> ('trade',
+    'AL-GR', 2016)."""
+    parts = file_name[:-len('.pickle')].split('-')
+    return parts[0], '-'.join(parts[1:-1]), int(parts[-1])
+
+
+def read_pickle(p2f):
+    """Reads a bentso pickle (DataFrame or Series with a time index) and
+    returns the parts stored for it: values as 2d array, the time stamps as
+    UTC int64, the column names (None for a Series) and the time zone."""
+    with open(p2f, 'rb') as f:
+        data = pickle.load(f)
+    index = pd.DatetimeIndex(data.index)
+    tz = str(index.tz) if index.tz is not None else None
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    timestamps = index.as_unit('ns').asi8
+    if isinstance(data, pd.Series):
+        return data.to_numpy(dtype=float)[:,None], timestamps, None, tz
+    return data.to_numpy(dtype=float), timestamps, [str(c) for c in
+                                                    data.columns], tz
+
+
+def _read_entry(p2f):
+    return os.path.basename(p2f), read_pickle(p2f)
+
+
+def convert_bentso(data_dir, store_dir, logger=None, processes=None):
+    """Converts all bentso pickles in data_dir into the store in store_dir,
+    one directory per kind. The pickles are read by a pool of processes
+    (processes=None uses one per cpu, 1 reads them in this process)."""
+    start = time.time()
+    files = sorted(f for f in os.listdir(data_dir) if f.endswith('.pickle'))
+    paths = [os.path.join(data_dir, f) for f in files]
+    if processes == 1:
+        entries = [_read_entry(p2f) for p2f in paths]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            entries = list(pool.map(_read_entry, paths, chunksize=8))
+    for kind in KINDS:
+        kind_entries = [(parse_file_name(f), e) for f, e in entries
+                        if parse_file_name(f)[0] == kind]
+        if kind_entries:
+            _write_kind(os.path.join(store_dir, kind), kind_entries)
+    if logger is not None:
+        logger.info(LogMessage(convert_bentso.__name__, 'Converted {} bentso '
+                    'files into {} in {:.1f} s'.format(len(files), store_dir,
+                                                       time.time()-start)))
+
+
+def _write_kind(kind_dir, kind_entries):
+    os.makedirs(kind_dir, exist_ok=True)
+    index = {'version': STORE_VERSION, 'entries': {}}
+    value_offset = time_offset = 0
+    for (kind, country, year), (values, timestamps, columns, tz) in\
+                                                             kind_entries:
+        index['entries']['{}-{}'.format(country, year)] = {
+            'country': country, 'year': year, 'columns': columns, 'tz': tz,
+            'value_offset': value_offset, 'time_offset': time_offset,
+            'n_rows': len(timestamps), 'n_cols': values.shape[1]}
+        value_offset += values.size
+        time_offset += len(timestamps)
+    values = np.concatenate([e[1][0].ravel() for e in kind_entries])
+    timestamps = np.concatenate([e[1][1] for e in kind_entries])
+    for name, array in (('values', values), ('timestamps', timestamps)):
+        tmp_p2f = os.path.join(kind_dir, name + '.tmp.npy')
+        np.save(tmp_p2f, array)
+        os.replace(tmp_p2f, os.path.join(kind_dir, name + '.npy'))
+    with open(os.path.join(kind_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+
+class BentsoStore(object):
+    """Reader for a store written by convert_bentso. The index of a kind is
+    read on first use and its arrays are memory mapped."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._kinds = {}
+
+    def _kind(self, kind):
+        if kind not in self._kinds:
+            kind_dir = os.path.join(self.store_dir, kind)
+            with open(os.path.join(kind_dir, 'index.json')) as f:
+                index = json.load(f)
+            if index.get('version') != STORE_VERSION:
+                raise ValueError('Store {} has version {}, expected {}'.format(
+                                 kind_dir, index.get('version'), STORE_VERSION))
+            self._kinds[kind] = (index['entries'],
+                    np.load(os.path.join(kind_dir, 'values.npy'),
+                            mmap_mode='r'),
+                    np.load(os.path.join(kind_dir, 'timestamps.npy'),
+                            mmap_mode='r'))
+        return self._kinds[kind]
+
+    def keys(self, kind):
+        """Returns the (country, year) pairs of a kind."""
+        entries = self._kind(kind)[0]
+        return [(e['country'], e['year']) for e in entries.values()]
+
+    def has(self, kind, country, year):
+        return '{}-{}'.format(country, year) in self._kind(kind)[0]
+
+    def values(self, kind, country, year):
+        """Returns the values (rows x columns, read only), the UTC time stamps
+        (int64 ns) and the entry of the index."""
+        entries, values, timestamps = self._kind(kind)
+        entry = entries['{}-{}'.format(country, year)]
+        n_rows, n_cols = entry['n_rows'], entry['n_cols']
+        start = entry['value_offset']
+        block = values[start:start+n_rows*n_cols].reshape(n_rows, n_cols)
+        stamps = timestamps[entry['time_offset']:entry['time_offset']+n_rows]
+        return block, stamps, entry
+
+    def get(self, kind, country, year):
+        """Returns the data of a kind, country and year as it was in the
+        bentso pickle: a DataFrame (capacity, generation) or Series (load,
+        trade) with a time index in the local time zone."""
+        block, stamps, entry = self.values(kind, country, year)
+        index = pd.DatetimeIndex(np.asarray(stamps).astype('datetime64[ns]'))
+        if entry['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(entry['tz'])
+        if entry['columns'] is None:
+            return pd.Series(np.asarray(block[:,0]), index=index)
+        return pd.DataFrame(np.asarray(block), index=index,
+                            columns=entry['columns'])
+
+    def annual(self, kind, country, year):
+        """Returns the annual totals of a kind, country and year as Series
+        (one value per column): the energy (power times the length of the time
+        steps in hours) for time series, the values for capacity."""
+        block, stamps, entry = self.values(kind, country, year)
+        columns = entry['columns'] if entry['columns'] is not None else\
+                  [kind]
+        if kind == 'capacity' or len(stamps) < 2:
+            return pd.Series(np.asarray(block[0]), index=columns)
+        hours = np.diff(np.asarray(stamps))/3.6e12
+        hours = np.append(hours, hours[-1]) #last step as long as the one
+        #before
+        return pd.Series(np.nan_to_num(block).T @ hours, index=columns)
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_dir", type=str, help='directory with the bentso'
+                        ' pickle files')
+    parser.add_argument("store_dir", type=str, help='directory of the store')
+    parser.add_argument("-p", "--processes", type=int, dest='processes',
+                        default=None, help='number of processes, default one'
+                        ' per cpu')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    start = time.time()
+    convert_bentso(args.data_dir, args.store_dir, processes=args.processes)
+    print('Converted {} in {:.1f} s'.format(args.data_dir, time.time()-start))
@@ -0,0 +1,143 @@
+#block_matrix.py
+'''
+Block structured matrix for the final supply, use and input-output tables.
+The main (aggregated) table, the electricity market blocks and the byproduct
+market blocks are kept as separate dense or sparse blocks, so no
+full_dimension x full_dimension copy is made unless explicitly asked for.
+'''
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import sparse_utils
+
+
+class BlockMatrix(object):
+    """Matrix made up of a grid of blocks. Every block is a numpy array, a
+    scipy.sparse matrix or None for an all zero block. The blocks are not
+    copied.
+
+    Input:
+    blocks      list of lists (row blocks) with the blocks
+    row_sizes   number of rows of every row block
+    col_sizes   number of columns of every column block
+    """
+
+    def __init__(self, blocks, row_sizes, col_sizes):
+        self.blocks = [list(row) for row in blocks]
+        self.row_sizes = list(row_sizes)
+        self.col_sizes = list(col_sizes)
+        self.row_offsets = np.concatenate([[0], np.cumsum(self.row_sizes)])
+        self.col_offsets = np.concatenate([[0], np.cumsum(self.col_sizes)])
+        for i, row in enumerate(self.blocks):
+            for j, b in enumerate(row):
+                if b is not None and b.shape != (self.row_sizes[i],
+                                                 self.col_sizes[j]):
+                    raise ValueError('Block ({},{}) has shape {}, expected {}'
+                                     .format(i, j, b.shape, (self.row_sizes[i],
+                                             self.col_sizes[j])))
+
+    @property
+    def shape(self):
+        return (int(self.row_offsets[-1]), int(self.col_offsets[-1]))
+
+    @property
+    def n_blocks(self):
+        return (len(self.row_sizes), len(self.col_sizes))
+
+    def block(self, i, j):
+        """Returns block (i,j), None if it is all zero."""
+        return self.blocks[i][j]
+
+    def row_slice(self, i):
+        return slice(self.row_offsets[i], self.row_offsets[i+1])
+
+    def col_slice(self, j):
+        return slice(self.col_offsets[j], self.col_offsets[j+1])
+
+    def matvec(self, x):
+        """Returns self @ x for a vector (or a matrix with one column per
+        vector) x."""
+        x = np.asarray(x)
+        y = np.zeros((self.shape[0],) + x.shape[1:])
+        for i, row in enumerate(self.blocks):
+            for j, b in enumerate(row):
+                if b is not None:
+                    y[self.row_slice(i)] += b @ x[self.col_slice(j)]
+        return y
+
+    def rmatvec(self, y):
+        """Returns self.T @ y for a vector (or matrix) y."""
+        y = np.asarray(y)
+        x = np.zeros((self.shape[1],) + y.shape[1:])
+        for i, row in enumerate(self.blocks):
+            for j, b in enumerate(row):
+                if b is not None:
+                    x[self.col_slice(j)] += b.T @ y[self.row_slice(i)]
+        return x
+
+    def __matmul__(self, x):
+        return self.matvec(x)
+
+    def aslinearoperator(self):
+        """Returns a scipy LinearOperator, e.g. for the iterative solvers."""
+        return spla.LinearOperator(self.shape, matvec=self.matvec,
+                                   rmatvec=self.rmatvec,
+                                   matmat=self.matvec, rmatmat=self.rmatvec,
+                                   dtype=float)
+
+    def diagonal(self):
+        """Returns the diagonal. Requires square diagonal blocks."""
+        if self.row_sizes != self.col_sizes:
+            raise ValueError('Diagonal blocks are not square')
+        d = np.zeros(self.shape[0])
+        for i in range(len(self.row_sizes)):
+            b = self.blocks[i][i]
+            if b is not None:
+                d[self.row_slice(i)] = sparse_utils.diagonal(b)
+        return d
+
+    def map_blocks(self, func):
+        """Returns a new BlockMatrix with func(block, i, j) applied to all
+        non zero blocks."""
+        return BlockMatrix([[None if b is None else func(b, i, j)
+                             for j, b in enumerate(row)]
+                            for i, row in enumerate(self.blocks)],
+                           self.row_sizes, self.col_sizes)
+
+    def replace_block(self, i, j, b):
+        """Returns a new BlockMatrix with block (i,j) replaced by b. The other
+        blocks are shared with self."""
+        blocks = [list(row) for row in self.blocks]
+        blocks[i][j] = b
+        return BlockMatrix(blocks, self.row_sizes, self.col_sizes)
+
+    def column_block(self, j, matrix_format='csc'):
+        """Returns the full height column block j as one sparse matrix."""
+        return BlockMatrix([[row[j]] for row in self.blocks], self.row_sizes,
+                           [self.col_sizes[j]]).to_sparse(matrix_format)
+
+    def to_sparse(self, matrix_format='csr'):
+        """Concatenates the blocks into one sparse matrix."""
+        blocks = [[sp.csr_matrix((self.row_sizes[i], self.col_sizes[j]))
+                   if b is None else sp.csr_matrix(b)
+                   for j, b in enumerate(row)]
+                  for i, row in enumerate(self.blocks)]
+        return sp.bmat(blocks, format=matrix_format)
+
+    def toarray(self):
+        """Concatenates the blocks into one dense numpy array."""
+        full = np.zeros(self.shape)
+        for i, row in enumerate(self.blocks):
+            for j, b in enumerate(row):
+                if b is not None:
+                    full[self.row_slice(i), self.col_slice(j)] =\
+                                      sparse_utils.as_format(b, 'dense')
+        return full
+
+    def concatenate(self, matrix_format):
+        """Concatenates the blocks into one matrix of matrix_format ('dense',
+        'csr' or 'csc')."""
+        if matrix_format == 'dense':
+            return self.toarray()
+        return self.to_sparse(matrix_format)
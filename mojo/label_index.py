@@ -0,0 +1,258 @@
+#label_index.py
+'''
+Integer index of the row/column labels of the aggregated multi regional
+tables, so the model stages can find the rows of a region or product without
+scanning arrays of strings, and a column store of integer coded labels for
+the markets and the final model tables.
+'''
+
+import numpy as np
+import pandas as pd
+
+PRODUCT_COLUMNS = ('Region', 'Name', 'code 1', 'code 2', 'unit')
+
+
+class LabelIndex(object):
+    """Index of the labels of an aggregated SUT/IOT, built once from the
+    DataFrame returned by load_exiobase.get_aggregated_product_names.
+
+    The tables are ordered by region and every region has the same products
+    in the same order, so row = region_id*N_prod + product_id. Since the
+    aggregated tables are square, product_id is also the id of the activity
+    with that product as principal product.
+
+    Attributes:
+    regions         array with the region codes in table order
+    code1, code2    arrays with 'Product code 1' and 'Product code 2' of the
+                    N_prod products of a region
+    names           array with the product names
+    units           array with the product units
+    region_ids      region id of every row
+    product_ids     product id of every row
+    """
+
+    def __init__(self, agg_names):
+        self.regions = agg_names['Country code'].unique()
+        self.N_reg = len(self.regions)
+        if len(agg_names) % self.N_reg:
+            raise ValueError('Not all regions have the same number of '
+                             'products')
+        self.N_prod = len(agg_names)//self.N_reg
+        first_region = agg_names.iloc[:self.N_prod]
+        self.code1 = first_region['Product code 1'].values
+        self.code2 = first_region['Product code 2'].values
+        self.names = first_region['Product name'].values
+        self.units = first_region['Unit'].values
+        if not np.array_equal(agg_names['Product code 1'].values,
+                              np.tile(self.code1, self.N_reg)) or\
+           not np.array_equal(agg_names['Country code'].values,
+                              np.repeat(self.regions, self.N_prod)):
+            raise ValueError('Labels are not ordered by region with the same'
+                             ' products for every region')
+        self._region_dic = {c: i for i, c in enumerate(self.regions)}
+        self._product_dic = {}
+        for labels in (self.names, self.code2, self.code1):
+            self._product_dic.update({c: i for i, c in enumerate(labels)})
+        self.region_ids = np.repeat(np.arange(self.N_reg), self.N_prod)
+        self.product_ids = np.tile(np.arange(self.N_prod), self.N_reg)
+
+    def __len__(self):
+        return self.N_reg*self.N_prod
+
+    def region_id(self, region):
+        """Returns the id of a region code (or an array of ids for a list of
+        codes)."""
+        if isinstance(region, str):
+            return self._region_dic[region]
+        return np.array([self._region_dic[r] for r in region], dtype=int)
+
+    def product_id(self, product):
+        """Returns the id of a product, given by name, code 1 or code 2 (or an
+        array of ids for a list of products). Ids are passed through."""
+        if isinstance(product, (int, np.integer)):
+            return product
+        if isinstance(product, str):
+            return self._product_dic[product]
+        return np.array([self._product_dic[p] for p in product], dtype=int)
+
+    def region_rows(self, region):
+        """Returns the slice of rows (or columns) of a region."""
+        r = self.region_id(region)
+        return slice(r*self.N_prod, (r+1)*self.N_prod)
+
+    def product_rows(self, product, regions=None):
+        """Returns the rows of a product in all regions, or in the given
+        regions (codes or ids)."""
+        if regions is None:
+            region_ids = np.arange(self.N_reg)
+        else:
+            region_ids = np.asarray([self.region_id(r) if isinstance(r, str)
+                                     else r for r in regions], dtype=int)
+        return region_ids*self.N_prod + self.product_id(product)
+
+    def rows(self, regions, products):
+        """Returns the rows of pairs of regions and products."""
+        return self.region_id(regions)*self.N_prod + self.product_id(products)
+
+    def product_mask(self, pattern):
+        """Boolean mask over all rows, True for the products of which
+        'Product code 1' contains pattern. The strings are only compared for
+        the products of a single region."""
+        prod_mask = np.array([pattern in c for c in self.code1], dtype=bool)
+        return prod_mask[self.product_ids]
+
+
+class LabelTable(object):
+    """Table of labels stored column by column as integer codes into a list
+    of interned values (categories), like a pandas Categorical per column.
+    Operations on a column (replace, contains, ...) are evaluated once per
+    distinct value instead of once per row.
+
+    Input:
+    codes       dictionary column -> integer codes of the rows
+    categories  dictionary column -> array with the distinct values
+    columns     column names, default PRODUCT_COLUMNS
+    """
+
+    def __init__(self, codes, categories, columns=PRODUCT_COLUMNS):
+        self.columns = tuple(columns)
+        self._codes = {c: np.asarray(codes[c], dtype=np.int32)
+                       for c in self.columns}
+        self._categories = {c: np.asarray(categories[c], dtype=object)
+                            for c in self.columns}
+        self._lookup = {c: None for c in self.columns}
+        self._row_dic = None
+
+    @classmethod
+    def from_array(cls, values, columns=PRODUCT_COLUMNS):
+        """Creates a LabelTable from a 2d array (rows x columns) or a
+        DataFrame with the columns in the order of columns."""
+        values = np.asarray(values, dtype=object)
+        codes, categories = {}, {}
+        for i, c in enumerate(columns):
+            codes[c], categories[c] = pd.factorize(values[:,i])
+        return cls(codes, categories, columns)
+
+    def __len__(self):
+        return len(self._codes[self.columns[0]])
+
+    def __getitem__(self, rows):
+        """Returns the rows (mask, indices or slice) as a new LabelTable. The
+        categories are shared."""
+        return LabelTable({c: self._codes[c][rows] for c in self.columns},
+                          self._categories, self.columns)
+
+    def codes(self, column):
+        """Returns the integer codes of a column."""
+        return self._codes[column]
+
+    def categories(self, column):
+        """Returns the distinct values of a column."""
+        return self._categories[column]
+
+    def column(self, column):
+        """Returns the values of a column as object array."""
+        return self._categories[column][self._codes[column]]
+
+    def label(self, row):
+        """Returns the labels of a row as tuple."""
+        return tuple(self._categories[c][self._codes[c][row]]
+                     for c in self.columns)
+
+    def index(self, label):
+        """Returns the row of a label tuple, a KeyError if it does not
+        exist. The first call builds a dictionary of all rows."""
+        if self._row_dic is None:
+            keys = zip(*(self._codes[c] for c in self.columns))
+            self._row_dic = {}
+            for i, key in enumerate(keys):
+                self._row_dic.setdefault(key, i)
+        key = tuple(self._category_code(c, v) for c, v in zip(self.columns,
+                                                              label))
+        return self._row_dic[key]
+
+    def _category_code(self, column, value):
+        if self._lookup[column] is None:
+            self._lookup[column] = {v: i for i, v in
+                                    enumerate(self._categories[column])}
+        return self._lookup[column][value]
+
+    def to_array(self):
+        """Returns the labels as 2d object array (rows x columns)."""
+        return np.column_stack([self.column(c) for c in self.columns])
+
+    def to_frame(self):
+        """Returns the labels as pandas DataFrame with categorical columns."""
+        return pd.DataFrame({c: pd.Categorical.from_codes(self._codes[c],
+                             pd.Index(self._categories[c]), validate=False)
+                             for c in self.columns})
+
+    def _replace_column(self, column, codes, categories):
+        new_codes = dict(self._codes)
+        new_categories = dict(self._categories)
+        new_codes[column] = codes
+        new_categories[column] = categories
+        return LabelTable(new_codes, new_categories, self.columns)
+
+    def map(self, column, func):
+        """Returns a new LabelTable with func applied to the values of column.
+        func is called once with a pandas Index of the distinct values and
+        should return the new values, e.g. lambda x: x.str.replace('C_','M_')
+        """
+        new_values = np.asarray(func(pd.Index(self._categories[column])),
+                                dtype=object)
+        new_codes, categories = pd.factorize(new_values)
+        return self._replace_column(column, new_codes[self._codes[column]],
+                                    categories)
+
+    def assign(self, column, values, rows=None):
+        """Returns a new LabelTable with the column (or only the rows of the
+        column) set to values, a single value or an array."""
+        new_values = self.column(column)
+        if rows is None:
+            rows = slice(None)
+        new_values[rows] = values
+        codes, categories = pd.factorize(new_values)
+        return self._replace_column(column, codes, categories)
+
+    def contains(self, column, pattern):
+        """Boolean mask of the rows of which column contains pattern."""
+        mask = np.array([pattern in v for v in self._categories[column]],
+                        dtype=bool)
+        return mask[self._codes[column]]
+
+    def equals(self, column, value):
+        """Boolean mask of the rows of which column equals value."""
+        return (self._categories[column] == value)[self._codes[column]]
+
+    def unique(self, column):
+        """Returns the rows with the first occurrence of every distinct value
+        of column, sorted by that value (like np.unique)."""
+        first = np.unique(self.column(column), return_index=True)[-1]
+        return self[first]
+
+    def drop(self, column):
+        """Returns a new LabelTable without column."""
+        columns = [c for c in self.columns if c != column]
+        return LabelTable(self._codes, self._categories, columns)
+
+    def concat(self, *others):
+        """Returns the rows of self followed by the rows of others. Only the
+        categories are merged, the codes of others are remapped."""
+        codes = {}
+        categories = {}
+        for c in self.columns:
+            cats = list(self._categories[c])
+            lookup = {v: i for i, v in enumerate(cats)}
+            col_codes = [self._codes[c]]
+            for other in others:
+                remap = np.empty(len(other._categories[c]), dtype=np.int32)
+                for i, v in enumerate(other._categories[c]):
+                    if v not in lookup:
+                        lookup[v] = len(cats)
+                        cats.append(v)
+                    remap[i] = lookup[v]
+                col_codes.append(remap[other._codes[c]])
+            codes[c] = np.concatenate(col_codes)
+            categories[c] = np.array(cats, dtype=object)
+        return LabelTable(codes, categories, self.columns)
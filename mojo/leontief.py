@@ -0,0 +1,233 @@
+#leontief.py
+'''
+Solving the Leontief system (I - A) x = y for the A matrix from
+system_model.make_IOT. The system is factorized once (sparse LU) and the
+factorization is reused for any number of final demand vectors, which can be
+solved together as the columns of one matrix. The factorization can be saved
+to and loaded from disk.
+'''
+
+import time
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import scipy.linalg
+from mojo_logger import LogMessage
+from block_matrix import BlockMatrix
+import sparse_utils
+
+
+def leontief_matrix(A):
+    """Returns I - A as sparse csc matrix, for dense, sparse and BlockMatrix
+    A."""
+    if isinstance(A, BlockMatrix):
+        A = A.to_sparse('csc')
+    A = sp.csc_matrix(A)
+    return (sp.identity(A.shape[0], format='csc') - A).tocsc()
+
+
+class TriangularLU(object):
+    """LU factorization Pr (I - A) Pc = L U from stored factors, with the same
+    solve method as the scipy SuperLU object. Used for factorizations loaded
+    from disk."""
+
+    def __init__(self, L, U, perm_r, perm_c):
+        self.L = sp.csr_matrix(L)
+        self.U = sp.csr_matrix(U)
+        self.perm_r = np.asarray(perm_r)
+        self.perm_c = np.asarray(perm_c)
+        self.shape = self.L.shape
+
+    def solve(self, b, trans='N'):
+        b = np.asarray(b, dtype=float)
+        if trans == 'N':
+            z = np.empty_like(b)
+            z[self.perm_r] = b
+            y = spla.spsolve_triangular(self.L, z, lower=True,
+                                        unit_diagonal=True)
+            w = spla.spsolve_triangular(self.U, y, lower=False)
+            return w[self.perm_c]
+        z = np.empty_like(b)
+        z[self.perm_c] = b
+        y = spla.spsolve_triangular(self.U.T.tocsr(), z, lower=True)
+        w = spla.spsolve_triangular(self.L.T.tocsr(), y, lower=False,
+                                    unit_diagonal=True)
+        return w[self.perm_r]
+
+
+class LeontiefSolver(object):
+    """Solver for (I - A) x = y and (I - A)^T m = c.
+
+    Input:
+    A           :   coefficient matrix (dense, sparse or BlockMatrix)
+    logger      :   logger instance
+    method      :   'lu' (default) factorizes I - A once with a sparse LU
+                    decomposition, 'iterative' uses GMRES with an incomplete
+                    LU preconditioner for systems too large to factorize.
+    tol         :   relative tolerance of the iterative solver
+    """
+
+    def __init__(self, A, logger, method='lu', tol=1e-10):
+        _name = LeontiefSolver.__name__
+        if method not in ('lu', 'iterative'):
+            raise ValueError('Unknown method {}, use lu or iterative'.format(
+                             method))
+        self.logger = logger
+        self.method = method
+        self.tol = tol
+        self.lu = None
+        self.preconditioner = None
+        self.L = None
+        if A is None: #used by load
+            return
+        self.L = leontief_matrix(A)
+        start = time.time()
+        if method == 'lu':
+            self.lu = spla.splu(self.L)
+            logger.info(LogMessage(_name, 'Factorized I - A ({0}x{0}) in {1:.2f}'
+                                   ' s'.format(self.L.shape[0],
+                                               time.time()-start)))
+        else:
+            ilu = spla.spilu(self.L)
+            self.preconditioner = spla.LinearOperator(self.L.shape,
+                                  matvec=ilu.solve,
+                                  rmatvec=lambda b: ilu.solve(b, 'T'))
+            self._ilu = ilu
+
+    @property
+    def shape(self):
+        return self.lu.shape if self.L is None else self.L.shape
+
+    def solve(self, y, x0=None):
+        """Returns x with (I - A) x = y. y is a vector or a matrix with one
+        final demand vector per column; all columns are solved at once.
+        x0 is an optional starting guess for the iterative method."""
+        return self._solve(y, 'N', x0)
+
+    def solve_transposed(self, c, x0=None):
+        """Returns m with (I - A)^T m = c, e.g. the multipliers (footprint
+        intensities) for the direct intensities c. c can be a matrix with one
+        vector per column."""
+        return self._solve(c, 'T', x0)
+
+    def _solve(self, b, trans, x0=None):
+        b = np.asarray(b, dtype=float)
+        if self.lu is not None:
+            return self.lu.solve(b, trans=trans)
+        return self._solve_iterative(b, trans, x0)
+
+    def _solve_iterative(self, b, trans, x0=None):
+        _name = self._solve_iterative.__name__
+        L = self.L if trans == 'N' else self.L.T.tocsr()
+        M = self.preconditioner if trans == 'N' else\
+            spla.LinearOperator(self.L.shape,
+                                matvec=lambda v: self._ilu.solve(v, 'T'))
+        B = b.reshape(b.shape[0], -1)
+        X0 = None if x0 is None else np.asarray(x0).reshape(B.shape)
+        X = np.zeros_like(B)
+        for k in range(B.shape[1]):
+            X[:,k], info = spla.gmres(L, B[:,k], M=M, rtol=self.tol,
+                                      x0=None if X0 is None else X0[:,k])
+            if info != 0:
+                self.logger.warning(LogMessage(_name, 'GMRES did not converge'
+                                    ' for vector {} (info {})'.format(k, info)))
+        return X.reshape(b.shape)
+
+    def save(self, p2f):
+        """Writes the LU factorization to the .npz file p2f."""
+        if self.lu is None:
+            raise ValueError('Only LU factorizations can be saved')
+        L, U = sp.csr_matrix(self.lu.L), sp.csr_matrix(self.lu.U)
+        np.savez(p2f, L_data=L.data, L_indices=L.indices, L_indptr=L.indptr,
+                 U_data=U.data, U_indices=U.indices, U_indptr=U.indptr,
+                 perm_r=self.lu.perm_r, perm_c=self.lu.perm_c,
+                 shape=np.array(L.shape))
+        self.logger.info(LogMessage(self.save.__name__,
+                         'Saved factorization to {}'.format(p2f)))
+
+    def update_columns(self, columns, A_columns):
+        """Returns a solver for the system in which the columns of A are
+        replaced by A_columns (n x len(columns), dense or sparse), e.g. a
+        new electricity mix. The factorization is not recomputed, the change
+        is applied as a low rank (Woodbury) update, see UpdatedLeontiefSolver.
+        Requires the solver to be made from A (not loaded)."""
+        if self.L is None:
+            raise ValueError('The columns of A are not known for a loaded '
+                             'factorization')
+        columns = np.asarray(columns)
+        old_columns = sp.identity(self.L.shape[0], format='csc')[:,columns] -\
+                      self.L[:,columns]
+        delta = sparse_utils.as_format(A_columns, 'dense') -\
+                old_columns.toarray()
+        return UpdatedLeontiefSolver(self, columns, delta)
+
+    @classmethod
+    def load(cls, p2f, logger):
+        """Returns a LeontiefSolver with the factorization saved in p2f."""
+        solver = cls(None, logger)
+        with np.load(p2f) as f:
+            shape = tuple(f['shape'])
+            L = sp.csr_matrix((f['L_data'], f['L_indices'], f['L_indptr']),
+                              shape=shape)
+            U = sp.csr_matrix((f['U_data'], f['U_indices'], f['U_indptr']),
+                              shape=shape)
+            solver.lu = TriangularLU(L, U, f['perm_r'], f['perm_c'])
+        logger.info(LogMessage(cls.load.__name__,
+                    'Loaded factorization from {}'.format(p2f)))
+        return solver
+
+
+class UpdatedLeontiefSolver(object):
+    """Solver for (I - A - D E^T) x = y, where I - A is factorized by the base
+    LeontiefSolver and D E^T changes the columns of A given by columns by D
+    (n x k). With the Sherman-Morrison-Woodbury formula
+        (M - D E^T)^-1 = M^-1 + M^-1 D (I_k - E^T M^-1 D)^-1 E^T M^-1
+    every solve costs one solve with the base factorization and a few
+    products with n x k matrices. Made by LeontiefSolver.update_columns.
+    """
+
+    def __init__(self, base, columns, delta):
+        self.base = base
+        self.columns = np.asarray(columns)
+        self.delta = np.asarray(delta, dtype=float).reshape(
+                                        base.shape[0], len(self.columns))
+        self.W = base.solve(self.delta) #M^-1 D
+        self.W = self.W.reshape(self.delta.shape)
+        self.S = scipy.linalg.lu_factor(np.identity(len(self.columns)) -
+                                        self.W[self.columns,:])
+        self._Wt = None #M^-T E, computed at the first transposed solve
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    def solve(self, y, x0=None):
+        """Returns x with (I - A_new) x = y, see LeontiefSolver.solve."""
+        x = self.base.solve(y)
+        x_cols = x[self.columns]
+        return x + self.W @ scipy.linalg.lu_solve(self.S, x_cols)
+
+    def solve_transposed(self, c, x0=None):
+        """Returns m with (I - A_new)^T m = c, see
+        LeontiefSolver.solve_transposed."""
+        if self._Wt is None:
+            E = np.zeros(self.delta.shape)
+            E[self.columns, np.arange(len(self.columns))] = 1
+            self._Wt = self.base.solve_transposed(E).reshape(E.shape)
+        m = self.base.solve_transposed(c)
+        return m + self._Wt @ scipy.linalg.lu_solve(self.S, self.delta.T @ m,
+                                                    trans=1)
+
+    def update_columns(self, columns, A_columns):
+        """Returns a solver with the columns of A replaced by A_columns,
+        applied as one update of the base factorization."""
+        all_columns = np.union1d(self.columns, columns)
+        base_L = self.base.L
+        A_new = np.asarray(sp.identity(base_L.shape[0], format='csc')[:,
+                           all_columns].toarray() -
+                           base_L[:,all_columns].toarray())
+        position = np.searchsorted(all_columns, self.columns)
+        A_new[:,position] += self.delta
+        A_new[:,np.searchsorted(all_columns, columns)] =\
+                               sparse_utils.as_format(A_columns, 'dense')
+        return self.base.update_columns(all_columns, A_new)
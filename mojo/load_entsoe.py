@@ -0,0 +1,221 @@
+#load_entsoe.py
+'''
+Reading the ENTSO-E electricity data (entsoe-beebee) and mapping it onto the
+electricity products of the aggregated EXIOBASE tables, to replace the
+electricity mix of the national grids made by
+system_model.create_electricity_grids.
+'''
+
+import json
+import os
+import sys
+import numpy as np
+import scipy.sparse as sp
+from mojo_logger import LogMessage
+from label_index import LabelTable
+from bentso_store import BentsoStore
+import sparse_utils
+
+ENTSOE_COLUMNS = ('Region', 'Technology')
+
+#ENTSO-E production types to EXIOBASE electricity products ('Product code 1').
+#'Grid' is not a production type and is not mapped.
+TECHNOLOGY_CONCORDANCE = {
+    'Biomass':                          'p40.11.g',
+    'Fossil Brown coal/Lignite':        'p40.11.a',
+    'Fossil Coal-derived gas':          'p40.11.a',
+    'Fossil Gas':                       'p40.11.b',
+    'Fossil Hard coal':                 'p40.11.a',
+    'Fossil Oil':                       'p40.11.f',
+    'Fossil Oil shale':                 'p40.11.f',
+    'Fossil Peat':                      'p40.11.a',
+    'Geothermal':                       'p40.11.k',
+    'Hydro Pumped Storage':             'p40.11.d',
+    'Hydro Run-of-river and poundage':  'p40.11.d',
+    'Hydro Water Reservoir':            'p40.11.d',
+    'Marine':                           'p40.11.j',
+    'Nuclear':                          'p40.11.c',
+    'Other':                            'p40.11.l',
+    'Other renewable':                  'p40.11.l',
+    'Solar':                            'p40.11.h',
+    'Waste':                            'p40.11.g',
+    'Wind Offshore':                    'p40.11.e',
+    'Wind Onshore':                     'p40.11.e',
+    }
+
+#ENTSO-E countries that are not an EXIOBASE region, others map to themselves
+COUNTRY_CONCORDANCE = {
+    'BA': 'WE', #Bosnia and Herzegovina, rest of Europe
+    'IS': 'WE', #Iceland
+    'ME': 'WE', #Montenegro
+    'MK': 'WE', #North Macedonia
+    'RS': 'WE', #Serbia
+    'NI': 'GB', #Northern Ireland
+    'GB-NIR': 'GB', #Northern Ireland in the bentso data
+    }
+
+
+def get_entsoe(path_name, supply_name, use_name, products_name,
+               activities_name, logger, mmap_mode='r'):
+    """Read in the ENTSO-E supply and use arrays and their labels.
+    Input:
+    path_name       Directory of data (e.g. entsoe-beebee-2016)
+    supply_name     File name supply array (.npy)
+    use_name        File name use array (.npy)
+    products_name   File name json with the [country, technology] products
+    activities_name File name json with the [country, technology] activities
+    mmap_mode       Memory map mode for numpy.load, by default the arrays are
+                    read only memory maps so nothing is read until it is used.
+                    None reads the full arrays.
+
+    Output:
+    supply      Array (products x activities)
+    use         Array (products x activities)
+    products    LabelTable with the columns Region and Technology
+    activities  LabelTable with the columns Region and Technology
+    """
+    _name = get_entsoe.__name__
+    files = [os.path.join(path_name, f) for f in (supply_name, use_name,
+                                                   products_name,
+                                                   activities_name)]
+    for p2f in files:
+        if not os.path.exists(p2f):
+            logger.error(LogMessage(_name, 'ENTSO-E file {} does not exist.'
+                                           'Exiting!'.format(p2f)))
+            sys.exit("Please check the file paths in the configuration file."
+                     " Exit")
+    logger.info(LogMessage(_name, 'Reading in ENTSO-E data from: {}'.format(
+                                  path_name)))
+    supply = np.load(files[0], mmap_mode=mmap_mode)
+    use = np.load(files[1], mmap_mode=mmap_mode)
+    labels = []
+    for p2f in files[2:]:
+        with open(p2f) as f:
+            labels.append(LabelTable.from_array(json.load(f),
+                                                ENTSOE_COLUMNS))
+    return supply, use, labels[0], labels[1]
+
+
+def get_generation(supply):
+    """Returns the electricity generation of every ENTSO-E activity, the
+    diagonal of the supply array. For a memory map only the pages with the
+    diagonal are read."""
+    return np.asarray(np.diagonal(supply), dtype=float)
+
+
+def get_bentso_generation(store_dir, year, logger):
+    """Returns the annual electricity generation of every country and
+    production type in a bentso store (see bentso_store.py) for year, and
+    their labels. These replace get_generation of the supply array and the
+    activities of get_entsoe. Only the generation of year is read from the
+    memory mapped store.
+
+    Output:
+    generation  Array with the annual generation (MWh)
+    activities  LabelTable with the columns Region and Technology
+    """
+    _name = get_bentso_generation.__name__
+    if not os.path.exists(os.path.join(store_dir, 'generation',
+                                       'index.json')):
+        logger.error(LogMessage(_name, 'No bentso generation store in {}. '
+                                       'Exiting!'.format(store_dir)))
+        sys.exit("Please check the file paths in the configuration file."
+                 " Exit")
+    store = BentsoStore(store_dir)
+    generation, labels = [], []
+    for country, entry_year in store.keys('generation'):
+        if entry_year != int(year):
+            continue
+        annual = store.annual('generation', country, entry_year)
+        generation.append(annual.to_numpy(dtype=float))
+        labels.extend([country, technology] for technology in annual.index)
+    if not labels:
+        logger.error(LogMessage(_name, 'No bentso generation for {} in {}. '
+                                       'Exiting!'.format(year, store_dir)))
+        sys.exit("Please check the year in the configuration file. Exit")
+    logger.info(LogMessage(_name, 'Read the {} generation of {} countries '
+                                  'from {}'.format(year, len(generation),
+                                                   store_dir)))
+    return np.concatenate(generation), LabelTable.from_array(labels,
+                                                             ENTSOE_COLUMNS)
+
+
+def get_concordance(entsoe_labels, labels, logger,
+                    technologies=TECHNOLOGY_CONCORDANCE,
+                    countries=COUNTRY_CONCORDANCE):
+    """Returns the sparse concordance matrices of the ENTSO-E labels to the
+    aggregated EXIOBASE tables. The labels are mapped once per distinct
+    country and technology, not per row.
+    Input:
+    entsoe_labels   LabelTable with the Region and Technology of the ENTSO-E
+                    activities (see get_entsoe)
+    labels          label_index.LabelIndex of the aggregated tables
+
+    Output:
+    product_concordance     csr matrix (N_reg*N_prod x n_entsoe), 1 where the
+                            ENTSO-E activity produces the EXIOBASE product
+    region_concordance      csr matrix (n_entsoe x N_reg), 1 where the
+                            ENTSO-E activity is in the region (national grid)
+    """
+    _name = get_concordance.__name__
+    region_dic = {c: i for i, c in enumerate(labels.regions)}
+    product_dic = {c: i for i, c in enumerate(labels.code1)}
+    region_categories = entsoe_labels.categories('Region')
+    region_ids = np.array([region_dic.get(countries.get(c, c), -1)
+                           for c in region_categories], dtype=int)
+    if (region_ids < 0).any():
+        logger.warning(LogMessage(_name, 'No EXIOBASE region for the ENTSO-E '
+                       'countries {}, skipped'.format(', '.join(
+                       region_categories[region_ids < 0]))))
+    tech_categories = entsoe_labels.categories('Technology')
+    product_ids = np.array([product_dic.get(technologies.get(t), -1)
+                            for t in tech_categories], dtype=int)
+    unmapped = [t for t in tech_categories if t not in technologies]
+    if unmapped:
+        logger.info(LogMessage(_name, 'ENTSO-E technologies without '
+                    'EXIOBASE product: {}'.format(', '.join(unmapped))))
+    row_regions = region_ids[entsoe_labels.codes('Region')]
+    row_products = product_ids[entsoe_labels.codes('Technology')]
+    mapped = np.where((row_regions >= 0) & (row_products >= 0))[0]
+    n_entsoe = len(entsoe_labels)
+    ones = np.ones(len(mapped))
+    product_concordance = sp.csr_matrix((ones, (row_regions[mapped]*
+                                         labels.N_prod + row_products[mapped],
+                                         mapped)),
+                                        shape=(len(labels), n_entsoe))
+    region_concordance = sp.csr_matrix((ones, (mapped, row_regions[mapped])),
+                                       shape=(n_entsoe, labels.N_reg))
+    return product_concordance, region_concordance
+
+
+def get_grid_mix(generation, product_concordance, region_concordance):
+    """Returns the electricity production of every EXIOBASE electricity
+    product for the national grids, a csr matrix (N_reg*N_prod x N_reg) in the
+    layout of U_elecmarkets, as one sparse product."""
+    return (product_concordance @ sp.diags(generation) @
+            region_concordance).tocsr()
+
+
+def update_electricity_mix(U_elecmarkets, grid_mix, logger):
+    """Replaces the electricity mix of the national grids in U_elecmarkets
+    by grid_mix (see get_grid_mix) for all regions with ENTSO-E data. The mix
+    is scaled to the total of the original column, so the total electricity
+    supplied by every grid (V_elecmarkets) does not change. Returns a new
+    matrix in the format of U_elecmarkets."""
+    _name = update_electricity_mix.__name__
+    matrix_format = sparse_utils.get_format(U_elecmarkets)
+    totals = sparse_utils.flat_sum(U_elecmarkets, 0)
+    mix_totals = sparse_utils.flat_sum(grid_mix, 0)
+    has_mix = mix_totals > 0
+    logger.info(LogMessage(_name, 'Using the ENTSO-E electricity mix for {} '
+                                  'regions'.format(has_mix.sum())))
+    scale = np.zeros(len(totals))
+    scale[has_mix] = totals[has_mix]/mix_totals[has_mix]
+    new_mix = grid_mix @ sp.diags(scale)
+    if matrix_format == 'dense':
+        new_U = U_elecmarkets*(~has_mix) + new_mix.toarray()
+    else:
+        new_U = (U_elecmarkets @ sp.diags((~has_mix).astype(float)) +
+                 new_mix).asformat(matrix_format)
+        new_U.eliminate_zeros()
+    return new_U
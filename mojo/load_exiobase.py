@@ -1,38 +1,182 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import os
 from mojo_logger import LogMessage
+import sparse_utils
+import sut_cache
+import rdf_import
 import sys
 
-def get_sut(path_name, v_name, u_name, logger):
+def read_sut_csv(p2f):
+    """Reads a supply or use table csv file into a pandas DataFrame."""
+    return pd.read_csv(p2f, header=[0,1,2,3], index_col=[0,1,2,3,4])
+
+def get_sut(path_name, v_name, u_name, logger, matrix_format='dense',
+            cache_dir=None, rebuild_cache=False):
     """Read in the supply and use tables from csv file.
     Input:
-    path_name   Directory of data
-    v_name      File name supply table
-    u_name      File name use table
+    path_name       Directory of data
+    v_name          File name supply table
+    u_name          File name use table
+    matrix_format   Storage format of the returned tables: 'dense' (default),
+                    'csr' or 'csc'
+    cache_dir       If given, the tables are read from a binary cache in this
+                    directory, which is (re)build when missing or outdated.
+                    Dense tables from the cache are read only memory maps.
+    rebuild_cache   Force rebuilding the cache
     
     Output:
-    exio_v      Numpy array with the supply table
-    exio_u      Numpy array with the use table
+    exio_v      Numpy array (or sparse matrix) with the supply table
+    exio_u      Numpy array (or sparse matrix) with the use table
     """
-    _name = get_sut.__name__#record function name for logging
-    u_p2f = os.path.join(path_name, u_name)
-    v_p2f = os.path.join(path_name, v_name)
-    if not os.path.exists(u_p2f):
-        logger.error(LogMessage(_name,'Use table file {} does not exist.'
-                                       'Exiting!'.format(u_p2f)))
-        sys.exit("Please check the file paths in the configuration file. Exit")
-    elif not os.path.exists(v_p2f):
-        logger.error(LogMessage(_name,'Supply table file {} does not exist.'
-                                       'Exiting!'.format(v_p2f)))
+    exio_v = get_table(path_name, v_name, 'Supply', logger, matrix_format,
+                       cache_dir, rebuild_cache)
+    exio_u = get_table(path_name, u_name, 'Use', logger, matrix_format,
+                       cache_dir, rebuild_cache)
+    return exio_v, exio_u
+
+
+def get_table(path_name, file_name, table_name, logger, matrix_format='dense',
+              cache_dir=None, rebuild_cache=False):
+    """Read in a single supply or use table from csv file, see get_sut.
+    table_name is only used for logging."""
+    _name = get_table.__name__#record function name for logging
+    p2f = os.path.join(path_name, file_name)
+    if not os.path.exists(p2f):
+        logger.error(LogMessage(_name,'{} table file {} does not exist.'
+                                      'Exiting!'.format(table_name, p2f)))
         sys.exit("Please check the file paths in the configuration file. Exit")
-    else:
-        logger.info(LogMessage(_name, 'Reading in V from: {}'.format(v_p2f)))
-        exio_v = pd.read_csv(v_p2f, header=[0,1,2,3], index_col=[0,1,2,3,4])
-        logger.info(LogMessage(_name, 'Reading in U from: {}'.format(u_p2f)))
-        exio_u = pd.read_csv(u_p2f, header=[0,1,2,3], index_col=[0,1,2,3,4])
-    
-    return exio_v.values, exio_u.values
+    logger.info(LogMessage(_name, 'Reading in {} table from: {}'.format(
+                                                         table_name, p2f)))
+    if cache_dir:
+        return sut_cache.cached_table(p2f, cache_dir, read_sut_csv, logger,
+                                      matrix_format, rebuild_cache)
+    table = read_sut_csv(p2f)
+    if matrix_format != 'dense':
+        logger.info(LogMessage(_name, 'Converting {} table to {} format'.
+                                      format(table_name, matrix_format)))
+    return sparse_utils.as_format(table.values, matrix_format)
+
+
+def get_long_supply(path_name, supply_file, prod_name_file, agg_file, logger,
+                    matrix_format='csr', chunk_size=500000):
+    """Read the supply table from the long format text file, in which every
+    line is a "product code","activity code","country code",value record,
+    e.g. "C_PARI","C_PARIx","AU",614790.55.
+    The file is read in chunks and the codes are mapped to indices with
+    pandas indexers, so the table is assembled directly as sparse matrix in
+    the same layout as the wide supply table from get_sut (regions x products
+    by regions x activities). Records with unknown codes are skipped.
+
+    Input:
+    path_name       Directory of data
+    supply_file     File name of the long format supply table
+    prod_name_file  File name of the aggregated product classification, used
+                    for the countries and their order
+    agg_file        File name of the aggregation matrix, used for the
+                    (unaggregated) products and the activities and their order
+    matrix_format   'csr' (default), 'csc' or 'dense'
+    chunk_size      Number of lines read per chunk
+
+    Output:
+    exio_v      Sparse matrix (or numpy array) with the supply table
+    """
+    _name = get_long_supply.__name__
+    for file_name in (supply_file, prod_name_file, agg_file):
+        p2f = os.path.join(path_name, file_name)
+        if not os.path.exists(p2f):
+            logger.error(LogMessage(_name,'File path {} does not exist. '
+                                          'Exiting!'.format(p2f)))
+            sys.exit("Please check the file paths in the configuration file."
+                     " Exit")
+    countries = pd.read_csv(os.path.join(path_name, prod_name_file),
+                            usecols=['Country code'])['Country code'].unique()
+    aggregation_matrix = pd.read_csv(os.path.join(path_name, agg_file),
+                                     header=[0,1,2], index_col=[0,1,2,3])
+    products = aggregation_matrix.index.get_level_values(3)
+    #activities are coded by their principal product, i.e. A_PARI -> C_PARIx
+    activities = ['C_{}x'.format(a[2:]) for a in
+                   aggregation_matrix.columns.get_level_values(2)]
+    N_reg, N_prod, N_act = len(countries), len(products), len(activities)
+    country_index = pd.Index(countries)
+    product_index = pd.Index(products)
+    activity_index = pd.Index(activities)
+
+    p2f = os.path.join(path_name, supply_file)
+    logger.info(LogMessage(_name, 'Reading in V from: {}'.format(p2f)))
+    rows, cols, data = [], [], []
+    n_skipped = 0
+    reader = pd.read_csv(p2f, header=None, names=['product', 'activity',
+                         'country', 'value'], dtype={'product': str,
+                         'activity': str, 'country': str, 'value': float},
+                         chunksize=chunk_size)
+    for chunk in reader:
+        c = country_index.get_indexer(chunk['country'])
+        p = product_index.get_indexer(chunk['product'])
+        a = activity_index.get_indexer(chunk['activity'])
+        known = (c >= 0) & (p >= 0) & (a >= 0)
+        n_skipped += np.count_nonzero(~known)
+        c, p, a = c[known], p[known], a[known]
+        rows.append(c*N_prod + p)
+        cols.append(c*N_act + a)
+        data.append(chunk['value'].values[known])
+    if n_skipped:
+        logger.warning(LogMessage(_name, 'Skipped {} records with codes not in'
+                                         ' the classification'.format(
+                                         n_skipped)))
+    exio_v = sp.coo_matrix((np.concatenate(data), (np.concatenate(rows),
+                            np.concatenate(cols))),
+                           shape=(N_reg*N_prod, N_reg*N_act)).tocsr()
+    exio_v.sum_duplicates()
+    return sparse_utils.as_format(exio_v, matrix_format)
+
+
+def get_rdf_sut(path_name, dump, prod_name_file, agg_file, logger,
+                matrix_format='csr', options=None, buffer_size=1000000):
+    """Read the supply and use tables from a local RDF dump (N-Triples or
+    Turtle files, see rdf_import). The dump is read as a stream and the flows
+    are assembled directly as sparse matrices in the layout of the tables
+    from get_sut (regions x products by regions x activities), without
+    loading an RDF graph. Flows with unknown codes are skipped.
+
+    Input:
+    path_name       Directory of data
+    dump            File name of the dump, or of a directory with its files
+    prod_name_file  File name of the aggregated product classification, used
+                    for the countries and their order
+    agg_file        File name of the aggregation matrix, used for the
+                    (unaggregated) products and the activities and their order
+    matrix_format   'csr' (default), 'csc' or 'dense'
+    options         Vocabulary of the dump, see rdf_export.VOCABULARY
+    buffer_size     Number of flows collected before they are added to the
+                    tables
+
+    Output:
+    exio_v      Sparse matrix (or numpy array) with the supply table
+    exio_u      Sparse matrix (or numpy array) with the use table
+    """
+    _name = get_rdf_sut.__name__
+    for file_name in (dump, prod_name_file, agg_file):
+        p2f = os.path.join(path_name, file_name)
+        if not os.path.exists(p2f):
+            logger.error(LogMessage(_name,'File path {} does not exist. '
+                                          'Exiting!'.format(p2f)))
+            sys.exit("Please check the file paths in the configuration file."
+                     " Exit")
+    countries = pd.read_csv(os.path.join(path_name, prod_name_file),
+                            usecols=['Country code'])['Country code'].unique()
+    aggregation_matrix = pd.read_csv(os.path.join(path_name, agg_file),
+                                     header=[0,1,2], index_col=[0,1,2,3])
+    products = aggregation_matrix.index.get_level_values(3)
+    activities = aggregation_matrix.columns.get_level_values(2)
+    p2f = os.path.join(path_name, dump)
+    logger.info(LogMessage(_name, 'Reading in V and U from RDF dump: {}'.
+                                  format(p2f)))
+    exio_v, exio_u = rdf_import.read_sut(p2f, countries, products, activities,
+                                         logger, options, buffer_size)
+    return sparse_utils.as_format(exio_v, matrix_format),\
+           sparse_utils.as_format(exio_u, matrix_format)
 
 
 def get_aggregated_product_names(path_name, prod_name_file, logger):
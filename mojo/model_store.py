@@ -0,0 +1,287 @@
+#model_store.py
+'''
+On disk store of the model tables (Z, A and the model supply and use table V
+and U) chunked in region x region blocks, for reading parts of the model
+without loading it. The rows and columns are grouped by the Region of their
+labels (the markets of a region are in its group, the global byproduct
+markets in the group GLO). A store is a directory with
+    index.json      the labels, the regions, the rows and columns of every
+                    region and the offset, size and number of non zeros of
+                    every block of every table
+    <table>.bin     the non zero blocks of a table, every block as csr
+                    arrays (indptr, indices, data), optionally compressed
+                    with zlib
+The blocks are written column region by column region, so also memory mapped
+tables (see streaming.py) are written without reading them at once. The
+ModelStore reader memory maps the tables and reads only the requested
+blocks, so reading the column block of one region costs the size of that
+block, not of the model, e.g.
+    store = ModelStore(path)
+    a_nl = store.block('A', col_regions=['NL'])
+'''
+
+import json
+import os
+import zlib
+import numpy as np
+import scipy.sparse as sp
+from mojo_logger import LogMessage
+from block_matrix import BlockMatrix
+from label_index import LabelTable
+
+STORE_FORMAT = 'mojo-model-store'
+STORE_VERSION = 1
+COMPRESSIONS = ('none', 'zlib')
+ALIGNMENT = 8 #bytes, the arrays of uncompressed blocks start aligned
+
+
+def region_groups(row_labels, col_labels):
+    """Returns the regions (in order of first appearance in the row and then
+    the column labels) and, for every region, the rows and the columns with
+    that Region."""
+    row_regions = row_labels.column('Region')
+    col_regions = col_labels.column('Region')
+    regions = list(dict.fromkeys(list(row_regions) + list(col_regions)))
+    rows = [np.where(row_regions == r)[0] for r in regions]
+    cols = [np.where(col_regions == r)[0] for r in regions]
+    return regions, rows, cols
+
+
+def table_columns(table, cols):
+    """Returns the columns cols (sorted) of a BlockMatrix, numpy array, memory
+    map or sparse matrix as csr matrix. Only these columns are read from the
+    blocks."""
+    if not isinstance(table, BlockMatrix):
+        return sp.csr_matrix(table[:, cols])
+    parts = []
+    for j in range(table.n_blocks[1]):
+        start, stop = table.col_offsets[j], table.col_offsets[j+1]
+        local = cols[(cols >= start) & (cols < stop)] - start
+        if not len(local):
+            continue
+        parts.append(sp.vstack([sp.csr_matrix((table.row_sizes[i],
+                     len(local))) if table.block(i,j) is None else
+                     sp.csr_matrix(table.block(i,j)[:, local]) for i in
+                     range(table.n_blocks[0])], format='csr'))
+    return sp.hstack(parts, format='csr')
+
+
+def table_dtype(table):
+    """Returns the storage dtype of a table, for a BlockMatrix the dtype of
+    its main block (0,0)."""
+    if isinstance(table, BlockMatrix):
+        table = table.block(0,0)
+    return np.dtype(getattr(table, 'dtype', float))
+
+
+def _pad(n_bytes):
+    return -n_bytes % ALIGNMENT
+
+
+def _encode_block(block, dtype, compression):
+    """Returns the bytes of a csr block: indptr (int64), indices (int32) and
+    data (dtype), every array padded to ALIGNMENT bytes."""
+    parts = []
+    for a in (block.indptr.astype(np.int64), block.indices.astype(np.int32),
+              block.data.astype(dtype)):
+        parts.append(a.tobytes())
+        parts.append(b'\0'*_pad(a.nbytes))
+    data = b''.join(parts)
+    return zlib.compress(data) if compression == 'zlib' else data
+
+
+def _decode_block(buffer, shape, nnz, dtype):
+    """Returns the csr block of the bytes of _encode_block (uncompressed).
+    The arrays are views of buffer, a memory map is not read further than
+    the block."""
+    n_indptr = (shape[0] + 1)*8
+    n_indices = nnz*4
+    indptr = np.frombuffer(buffer, np.int64, shape[0] + 1, 0)
+    indices = np.frombuffer(buffer, np.int32, nnz, n_indptr + _pad(n_indptr))
+    data = np.frombuffer(buffer, dtype, nnz, n_indptr + _pad(n_indptr) +
+                         n_indices + _pad(n_indices))
+    return sp.csr_matrix((data, indices, indptr), shape=shape)
+
+
+def _labels_to_dict(labels):
+    return {'columns': list(labels.columns),
+            'codes': {c: labels.codes(c).tolist() for c in labels.columns},
+            'categories': {c: labels.categories(c).tolist()
+                           for c in labels.columns}}
+
+
+def _labels_from_dict(d):
+    return LabelTable(d['codes'], d['categories'], d['columns'])
+
+
+def write_model(out_dir, tables, row_labels, col_labels, logger,
+                compression='none'):
+    """Writes the tables to a model store.
+    Input:
+    out_dir     :   directory of the store, existing tables are overwritten
+    tables      :   dictionary name -> table (BlockMatrix, numpy array, memory
+                    map or sparse matrix), all with the rows of row_labels and
+                    the columns of col_labels, e.g. {'Z': Z, 'A': A}
+    row_labels  :   LabelTable of the rows
+    col_labels  :   LabelTable of the columns
+    compression :   'none' or 'zlib'
+
+    Output:
+    path of index.json
+    """
+    _name = write_model.__name__
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression {}, use {}'.format(compression,
+                         ' or '.join(COMPRESSIONS)))
+    os.makedirs(out_dir, exist_ok=True)
+    regions, rows, cols = region_groups(row_labels, col_labels)
+    index = {'format': STORE_FORMAT, 'version': STORE_VERSION,
+             'compression': compression, 'regions': regions,
+             'rows': [r.tolist() for r in rows],
+             'cols': [c.tolist() for c in cols],
+             'row_labels': _labels_to_dict(row_labels),
+             'col_labels': _labels_to_dict(col_labels), 'tables': {}}
+    for name, table in tables.items():
+        if table.shape != (len(row_labels), len(col_labels)):
+            raise ValueError('Table {} has shape {}, expected {}'.format(name,
+                             table.shape, (len(row_labels), len(col_labels))))
+        dtype = table_dtype(table)
+        blocks = [[None]*len(regions) for r in regions]
+        offset = 0
+        tmp_p2f = os.path.join(out_dir, name + '.bin.tmp')
+        with open(tmp_p2f, 'wb') as f:
+            for j, col_index in enumerate(cols):
+                if not len(col_index):
+                    continue
+                slab = table_columns(table, col_index)
+                for i, row_index in enumerate(rows):
+                    block = slab[row_index]
+                    block.eliminate_zeros()
+                    if block.nnz == 0:
+                        continue
+                    data = _encode_block(block, dtype, compression)
+                    f.write(data)
+                    blocks[i][j] = [offset, len(data), int(block.nnz)]
+                    offset += len(data)
+        os.replace(tmp_p2f, os.path.join(out_dir, name + '.bin'))
+        index['tables'][name] = {'dtype': dtype.str, 'blocks': blocks}
+        logger.info(LogMessage(_name, 'Wrote {} ({:.1f} MB) to {}'.format(
+                                      name, offset/1e6, out_dir)))
+    p2f = os.path.join(out_dir, 'index.json')
+    with open(p2f + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(p2f + '.tmp', p2f)
+    return p2f
+
+
+class ModelStore(object):
+    """Reader of a store made by write_model. Only index.json is read when
+    it is opened, the tables are memory mapped when first used."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        if index.get('format') != STORE_FORMAT or\
+           index.get('version') != STORE_VERSION:
+            raise ValueError('{} is not a model store of version {}'.format(
+                             path, STORE_VERSION))
+        self.path = path
+        self.compression = index['compression']
+        self.regions = index['regions']
+        self._region_dic = {r: i for i, r in enumerate(self.regions)}
+        self._rows = [np.asarray(r, dtype=int) for r in index['rows']]
+        self._cols = [np.asarray(c, dtype=int) for c in index['cols']]
+        self.row_labels = _labels_from_dict(index['row_labels'])
+        self.col_labels = _labels_from_dict(index['col_labels'])
+        self._tables = index['tables']
+        self._files = {}
+
+    @property
+    def tables(self):
+        return list(self._tables)
+
+    @property
+    def shape(self):
+        return (len(self.row_labels), len(self.col_labels))
+
+    def _region_ids(self, regions):
+        if regions is None:
+            return list(range(len(self.regions)))
+        if isinstance(regions, str):
+            regions = [regions]
+        return [self._region_dic[r] for r in regions]
+
+    def row_index(self, regions=None):
+        """Returns the rows (of the full table) of the regions, in the order
+        of the rows of block. All rows (None) are in their original order."""
+        if regions is None:
+            return np.arange(self.shape[0])
+        return np.concatenate([self._rows[i] for i in
+                               self._region_ids(regions)])
+
+    def col_index(self, regions=None):
+        """Returns the columns of the regions, in the order of the columns of
+        block. All columns (None) are in their original order."""
+        if regions is None:
+            return np.arange(self.shape[1])
+        return np.concatenate([self._cols[i] for i in
+                               self._region_ids(regions)])
+
+    def _read(self, name, i, j):
+        """Returns block (i,j) of table name as csr matrix."""
+        shape = (len(self._rows[i]), len(self._cols[j]))
+        entry = self._tables[name]['blocks'][i][j]
+        dtype = np.dtype(self._tables[name]['dtype'])
+        if entry is None:
+            return sp.csr_matrix(shape, dtype=dtype)
+        offset, n_bytes, nnz = entry
+        p2f = os.path.join(self.path, name + '.bin')
+        if self.compression == 'none':
+            if name not in self._files:
+                self._files[name] = np.memmap(p2f, dtype=np.uint8, mode='r')
+            buffer = self._files[name][offset:offset + n_bytes]
+        else:
+            with open(p2f, 'rb') as f:
+                f.seek(offset)
+                buffer = zlib.decompress(f.read(n_bytes))
+        return _decode_block(buffer, shape, nnz, dtype)
+
+    def block(self, name, row_regions=None, col_regions=None,
+              matrix_format='csr'):
+        """Returns the rows of row_regions and the columns of col_regions
+        (region names, None for all) of table name as one matrix. Only
+        these blocks are read. The rows and columns are ordered by region,
+        see row_index and col_index for their position in the full table
+        and row_labels[row_index(...)] for their labels; all rows or columns
+        (None) are in their original order."""
+        row_ids = self._region_ids(row_regions)
+        col_ids = self._region_ids(col_regions)
+        matrix = sp.bmat([[self._read(name, i, j) for j in col_ids]
+                          for i in row_ids], format='csr')
+        if row_regions is None:
+            matrix = matrix[np.argsort(np.concatenate(self._rows))]
+        if col_regions is None:
+            matrix = matrix[:, np.argsort(np.concatenate(self._cols))]
+        return matrix.asformat(matrix_format).astype(np.dtype(
+                               self._tables[name]['dtype']), copy=False)
+
+    def column_block(self, name, region, matrix_format='csc'):
+        """Returns all rows of the columns of one region, e.g. the inputs of
+        all activities of a country."""
+        return self.block(name, None, region, matrix_format)
+
+    def row_block(self, name, region, matrix_format='csr'):
+        """Returns all columns of the rows of one region."""
+        return self.block(name, region, None, matrix_format)
+
+    def toarray(self, name):
+        """Returns the full table as dense array with the rows and columns
+        in their original order."""
+        dtype = np.dtype(self._tables[name]['dtype'])
+        full = np.zeros(self.shape, dtype=dtype)
+        for i in range(len(self.regions)):
+            for j in range(len(self.regions)):
+                if self._tables[name]['blocks'][i][j] is not None:
+                    full[np.ix_(self._rows[i], self._cols[j])] =\
+                                       self._read(name, i, j).toarray()
+        return full
@@ -3,6 +3,18 @@ import logging
 import os
 import getpass
 import shutil
+import threading
+import time
+import json
+import csv
+import cProfile
+import tracemalloc
+import numpy as np
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError: #not available on windows
+    resource = None
 
 def Logger(log_dir, project_name, caller_path, copy_script=False,
                                   copy_config=False, config_file=None):
@@ -83,3 +95,196 @@ def LogMessage(name, message):
     """add the the (function-) name to the message"""
     new_message = '{} - {}'.format(name, message)
     return new_message
+
+
+def log_file_dir(logger, default):
+    """Returns the directory of the log file of a logger made by Logger, or
+    default if it has no file handler."""
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(handler.baseFilename)
+    return default
+
+
+def _rss_mb():
+    """Returns the current resident set size of the process and the peak
+    over its lifetime (ru_maxrss) in MB (None if unknown)."""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #bytes on macOS, KiB elsewhere
+        peak = peak/1e6 if os.uname().sysname == 'Darwin' else peak*1024/1e6
+    return current, peak
+
+
+class _RssSampler(threading.Thread):
+    """Thread that samples the resident set size every interval seconds
+    while a stage runs, for the peak of that stage. The process peak
+    (ru_maxrss) only gives the peak of the largest stage so far."""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss_mb()[0]
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = _rss_mb()[0]
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+    def stop(self):
+        """Stops sampling and returns the peak in MB (None if unknown)."""
+        self._done.set()
+        self.join()
+        self._sample()
+        return self.peak
+
+
+def describe(obj):
+    """Returns a list with the type, shape, dtype and number of non zeros of
+    the arrays (numpy, sparse, BlockMatrix, ...) in obj, which can be a
+    (nested) tuple, list or dict."""
+    if isinstance(obj, (tuple, list)):
+        return [d for o in obj for d in describe(o)]
+    if isinstance(obj, dict):
+        return [d for o in obj.values() for d in describe(o)]
+    shape = getattr(obj, 'shape', None)
+    if shape is None:
+        if hasattr(obj, '__len__') and not isinstance(obj, str): #LabelTable
+            return [{'type': type(obj).__name__, 'length': len(obj)}]
+        return []
+    description = {'type': type(obj).__name__,
+                   'shape': [int(s) for s in shape]}
+    if getattr(obj, 'dtype', None) is not None:
+        description['dtype'] = str(obj.dtype)
+    nnz = getattr(obj, 'nnz', None)
+    if nnz is None and getattr(obj, 'blocks', None) is not None: #BlockMatrix
+        nnz = sum(b.nnz if hasattr(b, 'nnz') else np.count_nonzero(b)
+                  for row in obj.blocks for b in row if b is not None)
+    if nnz is not None:
+        description['nnz'] = int(nnz)
+    nbytes = getattr(obj, 'nbytes', None)
+    if nbytes is not None:
+        description['nbytes'] = int(nbytes)
+    return [description]
+
+
+class StageProfiler(object):
+    """Records the wall time, cpu time, resident memory, python memory
+    allocations (tracemalloc) and outputs of the stages of a run.
+
+    profile_dir     directory for the run profile and cProfile dumps
+    trace_memory    record the allocations with tracemalloc (slows down the
+                    run)
+    cprofile        dump a cProfile of every stage to
+                    profile_dir/profile_<stage>.prof
+    sample_interval interval in seconds at which the resident memory is
+                    sampled for the peak of every stage (peak_rss_mb), 0
+                    to not sample
+    """
+
+    def __init__(self, profile_dir, logger=None, trace_memory=True,
+                 cprofile=False, sample_interval=0.01):
+        self.profile_dir = profile_dir
+        self.logger = logger
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        self.sample_interval = sample_interval
+        self.records = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that profiles the code run in it as stage name.
+        Yields the record (dictionary), outputs can be added to it with
+        add_outputs."""
+        record = {'stage': name}
+        rss_start, maxrss_start = _rss_mb()
+        sampler = None
+        if rss_start is not None and self.sample_interval:
+            sampler = _RssSampler(self.sample_interval)
+            sampler.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if self.cprofile else None
+        wall_start, cpu_start = time.time(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.profile_dir,
+                                   'profile_{}.prof'.format(name)))
+            record['wall_time'] = time.time() - wall_start
+            record['cpu_time'] = time.process_time() - cpu_start
+            rss_end, maxrss_end = _rss_mb()
+            record['rss_mb'] = rss_end
+            record['rss_delta_mb'] = None if rss_start is None else\
+                                     rss_end - rss_start
+            record['peak_rss_mb'] = None if sampler is None else\
+                                    sampler.stop()
+            #how much the stage raised the peak of the process
+            record['maxrss_growth_mb'] = None if maxrss_start is None else\
+                                         max(0, maxrss_end - maxrss_start)
+            if self.trace_memory:
+                traced_end, traced_peak = tracemalloc.get_traced_memory()
+                record['traced_delta_mb'] = (traced_end - traced_start)/1e6
+                record['traced_peak_mb'] = (traced_peak - traced_start)/1e6
+            self.records.append(record)
+            if self.logger is not None:
+                self.logger.info(LogMessage(name, 'wall {:.2f} s, cpu {:.2f} '
+                                 's, rss {} MB, peak rss {} MB'.format(
+                                 record['wall_time'], record['cpu_time'],
+                                 None if rss_end is None else round(rss_end),
+                                 None if record['peak_rss_mb'] is None else
+                                 round(record['peak_rss_mb']))))
+
+    def add_outputs(self, record, outputs):
+        """Adds the description of the arrays in outputs to a record."""
+        record['outputs'] = describe(outputs)
+
+    def profile(self, name):
+        """Decorator that profiles every call of a function as stage name,
+        including its outputs."""
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                with self.stage(name) as record:
+                    outputs = func(*args, **kwargs)
+                    self.add_outputs(record, outputs)
+                return outputs
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+        return decorator
+
+    def write(self, name='run_profile'):
+        """Writes the records to profile_dir/name.json (all fields) and
+        profile_dir/name.csv (one row per stage, outputs as json)."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, name)
+        with open(base + '.json', 'w') as f:
+            json.dump({'stages': self.records}, f, indent=1)
+        fields = []
+        for record in self.records:
+            fields.extend(k for k in record if k not in fields)
+        with open(base + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow({k: json.dumps(v) if isinstance(v, list)
+                                 else v for k, v in record.items()})
+        return base + '.json', base + '.csv'
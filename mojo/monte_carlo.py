@@ -0,0 +1,556 @@
+#monte_carlo.py
+'''
+Monte Carlo propagation of the uncertainty of the relative calorific values,
+the ENTSO-E grid mixes and the entries of the supply and use tables to the
+multipliers m = (I - A)^-T f of direct intensities f and the footprints
+m^T y of final demands y.
+
+Every sample perturbs the selected inputs and only reruns the stages of
+system_model downstream of them (Pipeline.downstream):
+-   calvals: the relative calorific values of the aggregation matrix are
+    multiplied by lognormal factors. The aggregation is linear, so only the
+    aggregated rows they go into are corrected, from the raw rows of the
+    supply and use table, instead of aggregating the tables again.
+-   sut: the entries of the aggregated supply and use tables are multiplied
+    by lognormal factors with mean 1.
+-   entsoe: the ENTSO-E mix of every national grid is drawn from a Dirichlet
+    distribution with the ENTSO-E shares as mean.
+If only the grid mixes are perturbed no stage is rerun: the electricity
+market columns of A are replaced (update_electricity_mix_IOT) and solved as
+a low rank update of the base factorization. Otherwise the perturbed system
+is solved with GMRES, preconditioned with the base factorization and started
+from the base multipliers, which takes a few iterations.
+
+The samples are run in chunks by a pool of processes that read the base
+stage outputs from memory maps (see batch.write_shared) and factorize the
+base system once per process. Every chunk has its own seed derived from the
+seed in the config, so the result does not depend on the number of
+processes. The samples are not kept: the mean, standard deviation, minimum,
+maximum and quantiles (P2 algorithm) are updated online, e.g.
+    python monte_carlo.py -c ConfigFile.ini -f intensities.npy -y demand.npy
+'''
+
+import argparse
+import configparser
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import mojo_logger
+from mojo_logger import LogMessage
+from pipeline import Pipeline
+from leontief import LeontiefSolver, leontief_matrix
+from batch import write_shared, read_shared, config_to_dict
+from structural_paths import total_requirements
+import load_entsoe
+import system_model
+import sparse_utils
+
+#stage of system_model of which the output is perturbed, per input
+PERTURBED_STAGES = {'calvals': 'aggregate', 'sut': 'aggregate',
+                    'entsoe': 'entsoe_mix'}
+
+
+def get_options(config):
+    """Returns the options of the monte_carlo section of the config as
+    dictionary."""
+    section = 'monte_carlo'
+    perturb = [p.strip() for p in config.get(section, 'perturb',
+               fallback='calvals, entsoe, sut').split(',') if p.strip()]
+    for p in perturb:
+        if p not in PERTURBED_STAGES:
+            raise ValueError('Unknown perturbation {}, use {}'.format(p,
+                             ', '.join(PERTURBED_STAGES)))
+    processes = config.get(section, 'processes', fallback='')
+    return {'perturb': perturb,
+            'calvals_sigma': config.getfloat(section, 'calvals_sigma',
+                                             fallback=0.05),
+            'sut_sigma': config.getfloat(section, 'sut_sigma', fallback=0.1),
+            'entsoe_concentration': config.getfloat(section,
+                                    'entsoe_concentration', fallback=100),
+            'n_samples': config.getint(section, 'n_samples', fallback=1000),
+            'seed': config.getint(section, 'seed', fallback=0),
+            'quantiles': [float(q) for q in config.get(section, 'quantiles',
+                          fallback='0.05, 0.5, 0.95').split(',')],
+            'chunk_size': config.getint(section, 'chunk_size', fallback=10),
+            'processes': int(processes) if processes else None,
+            'tol': config.getfloat(section, 'tol', fallback=1e-8)}
+
+
+def lognormal_factors(rng, sigma, size):
+    """Returns lognormal factors with mean 1 and standard deviation sigma of
+    their log."""
+    return rng.lognormal(-sigma**2/2, sigma, size)
+
+
+def calorific_rows(sut, aggregation_matrix):
+    """Returns the rows of the (not aggregated) supply and use table that
+    have region specific aggregation values (the relative calorific values),
+    as csr matrices ordered by region and then by entry."""
+    raw_rows = (np.arange(aggregation_matrix.N_reg)[:,None]*
+                aggregation_matrix.N_prod +
+                aggregation_matrix.override_rows[None,:]).ravel()
+    return tuple(sparse_utils.as_format(a[raw_rows], 'csr') for a in sut)
+
+
+def perturb_calorific_values(aggregated, gas_rows, aggregation_matrix, rng,
+                             sigma):
+    """Returns the aggregated supply and use table for relative calorific
+    values multiplied by lognormal factors. Only the aggregated rows of the
+    region specific entries change, by the change of the value times the raw
+    rows gas_rows (see calorific_rows)."""
+    values = aggregation_matrix.override_values
+    delta = values*(lognormal_factors(rng, sigma, values.shape) - 1)
+    N_reg, n_entries = delta.shape
+    targets = np.repeat(np.arange(N_reg), n_entries)*aggregation_matrix.N_sec\
+              + np.tile(aggregation_matrix.override_cols, N_reg)
+    rows, target_rows = np.unique(targets, return_inverse=True)
+    correction = sp.csr_matrix((delta.ravel(), (target_rows,
+                               np.arange(N_reg*n_entries))),
+                               shape=(len(rows), N_reg*n_entries))
+    return tuple(_add_rows(a, rows, (correction @ raw).tocoo())
+                 for a, raw in zip(aggregated, gas_rows))
+
+
+def _add_rows(a, rows, values):
+    """Returns a copy of a with the sparse values added to rows."""
+    if sp.issparse(a):
+        addition = sp.csr_matrix((values.data, (rows[values.row],
+                                 values.col)), shape=a.shape)
+        return (a + addition).asformat(sparse_utils.get_format(a)).astype(
+                                       a.dtype, copy=False)
+    new = np.array(a)
+    new[rows] += values.toarray().astype(a.dtype, copy=False)
+    return new
+
+
+def perturb_sut(aggregated, rng, sigma, chunk_size=1024):
+    """Returns the aggregated supply and use table with every non zero
+    entry multiplied by a lognormal factor. Dense tables are perturbed
+    chunk_size rows at a time."""
+    tables = []
+    for a in aggregated:
+        if sp.issparse(a):
+            a = a.copy()
+            a.data *= lognormal_factors(rng, sigma, a.data.shape)
+        else:
+            a = np.array(a)
+            for start in range(0, a.shape[0], chunk_size):
+                rows = a[start:start+chunk_size]
+                non_zero = rows != 0
+                rows[non_zero] *= lognormal_factors(rng, sigma,
+                                                    non_zero.sum())
+        tables.append(a)
+    return tuple(tables)
+
+
+def perturb_grid_mix(grid_mix, rng, concentration):
+    """Returns a grid mix (see load_entsoe.get_grid_mix) of which the mix of
+    every grid is drawn from a Dirichlet distribution with the shares of
+    grid_mix as mean. A higher concentration gives mixes closer to
+    grid_mix. The total of every grid is kept."""
+    mix = sp.csc_matrix(grid_mix, copy=True)
+    mix.eliminate_zeros()
+    totals = sparse_utils.flat_sum(mix, 0)
+    cols = np.repeat(np.arange(mix.shape[1]), np.diff(mix.indptr))
+    draws = rng.gamma(concentration*mix.data/totals[cols])
+    draw_totals = np.bincount(cols, draws, minlength=mix.shape[1])
+    draw_totals[draw_totals == 0] = 1
+    mix.data = totals[cols]*draws/draw_totals[cols]
+    return mix.tocsr()
+
+
+class P2Quantile(object):
+    """Online estimate of quantile p of every element of a stream of arrays
+    with the P2 algorithm (Jain and Chlamtac, 1985): five markers per element
+    are moved with a piecewise parabolic fit, so the samples are not kept."""
+
+    def __init__(self, p, size):
+        self.p = p
+        self.count = 0
+        self.heights = np.zeros((5, size))
+        self.positions = np.tile(np.arange(5, dtype=float)[:,None], (1, size))
+        self.desired = np.array([0, 2*p, 4*p, 2 + 2*p, 4])
+        self.increments = np.array([0, p/2, p, (1 + p)/2, 1])
+
+    def add(self, x):
+        x = np.asarray(x, dtype=float).ravel()
+        q, n = self.heights, self.positions
+        if self.count < 5:
+            q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                q.sort(axis=0)
+            return
+        self.count += 1
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        cell = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        n += np.arange(5)[:,None] > cell[None,:]
+        self.desired += self.increments
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            move = ((d >= 1) & (n[i+1] - n[i] > 1)) |\
+                   ((d <= -1) & (n[i-1] - n[i] < -1))
+            if not move.any():
+                continue
+            s = np.where(d >= 0, 1.0, -1.0)
+            parabolic = q[i] + s/(n[i+1] - n[i-1])*(
+                        (n[i] - n[i-1] + s)*(q[i+1] - q[i])/(n[i+1] - n[i]) +
+                        (n[i+1] - n[i] - s)*(q[i] - q[i-1])/(n[i] - n[i-1]))
+            q_next = np.where(s > 0, q[i+1], q[i-1])
+            n_next = np.where(s > 0, n[i+1], n[i-1])
+            linear = q[i] + s*(q_next - q[i])/(n_next - n[i])
+            new = np.where((q[i-1] < parabolic) & (parabolic < q[i+1]),
+                           parabolic, linear)
+            q[i] = np.where(move, new, q[i])
+            n[i] += np.where(move, s, 0)
+
+    def value(self):
+        if self.count < 5:
+            return np.quantile(self.heights[:self.count], self.p, axis=0)
+        return self.heights[2].copy()
+
+
+class OnlineStatistics(object):
+    """Mean, standard deviation (Welford), minimum, maximum and quantiles of
+    a stream of arrays of the same shape."""
+
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self.shape = None
+
+    def add(self, x):
+        x = np.asarray(x, dtype=float)
+        if self.shape is None:
+            self.shape = x.shape
+            self._mean = np.zeros(x.size)
+            self._m2 = np.zeros(x.size)
+            self._min = np.full(x.size, np.inf)
+            self._max = np.full(x.size, -np.inf)
+            self._quantiles = [P2Quantile(p, x.size) for p in self.quantiles]
+        x = x.ravel()
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta/self.count
+        self._m2 += delta*(x - self._mean)
+        np.minimum(self._min, x, out=self._min)
+        np.maximum(self._max, x, out=self._max)
+        for quantile in self._quantiles:
+            quantile.add(x)
+
+    def result(self):
+        """Returns a dictionary with the statistics (arrays of the shape of
+        the samples), the quantiles as 'q<p>'."""
+        std = np.sqrt(self._m2/(self.count - 1)) if self.count > 1 else\
+              np.zeros_like(self._m2)
+        result = {'mean': self._mean, 'std': std, 'min': self._min,
+                  'max': self._max}
+        for p, quantile in zip(self.quantiles, self._quantiles):
+            result['q{:g}'.format(p)] = quantile.value()
+        return {k: v.reshape(self.shape) for k, v in result.items()}
+
+
+class SampleModel(object):
+    """Draws and solves Monte Carlo samples of the model.
+    Input:
+    base        :   dictionary with the outputs of the base stages needed to
+                    rebuild the perturbed stages, 'iot', 'intensities' (n x k)
+                    and, to perturb the calorific values, 'gas_rows' (see
+                    calorific_rows)
+    config      :   configparser object
+    logger      :   logger instance
+    log_dir     :   log directory of the stages
+    options     :   dictionary of get_options
+    """
+
+    def __init__(self, base, config, logger, log_dir, options):
+        self.base = base
+        self.config = config
+        self.logger = logger
+        self.log_dir = log_dir
+        self.options = options
+        self.perturb = set(options['perturb'])
+        self.perturbed_stages = set(PERTURBED_STAGES[p] for p in self.perturb)
+        self.intensities = np.asarray(base['intensities'], dtype=float)
+        Z, A = base['iot']
+        self.shape = A.shape
+        self.solver = LeontiefSolver(A, logger)
+        self.base_multipliers = self.solver.solve_transposed(
+                                self.intensities).reshape(
+                                self.intensities.shape)
+        self.n_unconverged = 0
+
+    def sample(self, rng):
+        """Returns the multipliers (n x k) of one sample drawn with rng."""
+        base, options = self.base, self.options
+        if 'entsoe' in self.perturb:
+            grid_mix = perturb_grid_mix(base['entsoe_mix'], rng,
+                                        options['entsoe_concentration'])
+        if self.perturb == {'entsoe'}:
+            return self._grid_mix_sample(grid_mix)
+        pipeline = Pipeline(system_model.model_stages(self.log_dir),
+                            self.config, self.logger)
+        rerun = pipeline.downstream(self.perturbed_stages) -\
+                self.perturbed_stages
+        pipeline.results.update((name, output) for name, output in
+                                base.items() if name in pipeline.stages and
+                                name not in rerun)
+        if 'aggregate' in self.perturbed_stages:
+            aggregated = base['aggregate']
+            if 'calvals' in self.perturb:
+                aggregated = perturb_calorific_values(aggregated,
+                             base['gas_rows'], base['aggregation_matrix'][0],
+                             rng, options['calvals_sigma'])
+            if 'sut' in self.perturb:
+                aggregated = perturb_sut(aggregated, rng,
+                                         options['sut_sigma'])
+            pipeline.results['aggregate'] = aggregated
+        if 'entsoe' in self.perturb:
+            pipeline.results['entsoe_mix'] = grid_mix
+        Z, A = pipeline.run('iot')
+        return self._solve(A)
+
+    def _grid_mix_sample(self, grid_mix):
+        """Solves a new grid mix as low rank update of the electricity market
+        columns, without rerunning any stage."""
+        U_elecmarkets = load_entsoe.update_electricity_mix(
+                        self.base['electricity_grids'][3], grid_mix,
+                        self.logger)
+        Z, A = self.base['iot']
+        Z, A, V, columns = system_model.update_electricity_mix_IOT(Z, A,
+                           self.base['sut_model'][0], U_elecmarkets,
+                           self.logger)
+        return self.solver.update_columns(columns, A.column_block(1)
+                             ).solve_transposed(self.intensities).reshape(
+                             self.intensities.shape)
+
+    def _solve(self, A):
+        """Returns the multipliers of A with GMRES, preconditioned with the
+        base factorization and started from the base multipliers."""
+        _name = self._solve.__name__
+        if A.shape != self.shape:
+            raise ValueError('The sample changed the shape of A from {} to {}'
+                             .format(self.shape, A.shape))
+        L_T = leontief_matrix(A).T.tocsr()
+        M = spla.LinearOperator(L_T.shape, matvec=self.solver.solve_transposed)
+        multipliers = np.empty_like(self.base_multipliers)
+        for j in range(self.intensities.shape[1]):
+            multipliers[:,j], info = spla.gmres(L_T, self.intensities[:,j],
+                                     x0=self.base_multipliers[:,j], M=M,
+                                     rtol=self.options['tol'])
+            if info != 0:
+                self.n_unconverged += 1
+                self.logger.warning(LogMessage(_name, 'GMRES did not converge'
+                                    ' (info {})'.format(info)))
+        return multipliers
+
+
+#state of the pool processes, set by _init_worker
+_sample_model = None
+
+
+def _init_worker(share_dir, config_dict, log_dir, logger_name, options):
+    global _sample_model
+    logger = logging.getLogger(logger_name + '.samples')
+    logger.setLevel(logging.WARNING) #no stage logs for every sample
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    _sample_model = SampleModel(read_shared(share_dir), config, logger,
+                                log_dir, options)
+
+
+def _run_chunk(args):
+    chunk, n_samples, seed = args
+    rng = np.random.default_rng(np.random.SeedSequence(seed,
+                                                       spawn_key=(chunk,)))
+    return [_sample_model.sample(rng) for i in range(n_samples)]
+
+
+def _chunk_results(chunks, processes, initargs):
+    """Yields the samples of the chunks in order. At most two chunks per
+    process are run ahead of the chunk that is yielded, so the samples
+    waiting to be summarized stay few."""
+    global _sample_model
+    if processes == 1:
+        _init_worker(*initargs)
+        try:
+            for chunk in chunks:
+                yield _run_chunk(chunk)
+        finally:
+            _sample_model = None
+        return
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=initargs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_run_chunk, chunk))
+            if len(pending) >= 2*(processes or os.cpu_count()):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def base_outputs(pipeline, perturb):
+    """Returns the outputs of the base stages the samples need: the inputs
+    of the stages to rerun, the outputs of the perturbed stages and the
+    IOT, or for grid mixes only the electricity grids and the model SUT."""
+    perturbed_stages = set(PERTURBED_STAGES[p] for p in perturb)
+    if set(perturb) == {'entsoe'}:
+        names = {'entsoe_mix', 'electricity_grids', 'sut_model'}
+    else:
+        rerun = pipeline.downstream(perturbed_stages) - perturbed_stages
+        names = set(i for name in rerun for i in pipeline.stages[name].inputs
+                    if i not in rerun)
+        names.update(perturbed_stages)
+    base = {name: pipeline.run(name) for name in sorted(names)}
+    base['iot'] = pipeline.run('iot')
+    if 'calvals' in perturb:
+        base['aggregation_matrix'] = pipeline.run('aggregation_matrix')
+        base['gas_rows'] = calorific_rows(pipeline.run('sut'),
+                                          base['aggregation_matrix'][0])
+    return base
+
+
+def monte_carlo(pipeline, config, logger, log_dir, out_dir, intensities,
+                final_demand=None, options=None):
+    """Runs the Monte Carlo samples of the model of pipeline.
+    Input:
+    pipeline        :   Pipeline of system_model.model_stages
+    out_dir         :   directory for the shared base outputs
+    intensities     :   direct intensities, vector or (n x k) matrix with one
+                        vector per column, over the rows of A
+    final_demand    :   optional final demand, vector or (n x d) matrix
+    options         :   dictionary of get_options, by default read from the
+                        config
+
+    Output:
+    dictionary with the OnlineStatistics of the 'multipliers' (n x k) and,
+    with final demand, the 'footprints' (k x d), and the 'base' multipliers
+    and footprints of the model without perturbations.
+    """
+    _name = monte_carlo.__name__
+    options = dict(options or get_options(config))
+    intensities = np.asarray(intensities, dtype=float)
+    intensities = intensities.reshape(intensities.shape[0], -1)
+    if final_demand is not None:
+        final_demand = np.asarray(final_demand, dtype=float)
+        final_demand = final_demand.reshape(final_demand.shape[0], -1)
+    perturb = list(options['perturb'])
+    if 'entsoe' in perturb and pipeline.run('entsoe_mix') is None:
+        logger.warning(LogMessage(_name, 'No ENTSO-E grid mix in the model '
+                                  '(update_grid_mix), not perturbed'))
+        perturb.remove('entsoe')
+    if not perturb:
+        raise ValueError('Nothing to perturb')
+    options['perturb'] = perturb
+    base = base_outputs(pipeline, perturb)
+    base['intensities'] = intensities
+    base_multipliers = np.column_stack([total_requirements(base['iot'][1], f,
+                                        logger) for f in intensities.T])
+    results = {'multipliers': OnlineStatistics(options['quantiles']),
+               'base': {'multipliers': base_multipliers}}
+    if final_demand is not None:
+        results['footprints'] = OnlineStatistics(options['quantiles'])
+        results['base']['footprints'] = base_multipliers.T @ final_demand
+    n_samples, chunk_size = options['n_samples'], options['chunk_size']
+    chunks = [(c, min(chunk_size, n_samples - start), options['seed'])
+              for c, start in enumerate(range(0, n_samples, chunk_size))]
+    logger.info(LogMessage(_name, 'Running {} samples perturbing {} in {} '
+                           'chunks'.format(n_samples, ', '.join(perturb),
+                                           len(chunks))))
+    start_time = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    share_dir = tempfile.mkdtemp(prefix='mojo_monte_carlo_', dir=out_dir)
+    try:
+        write_shared(base, share_dir)
+        del base
+        initargs = (share_dir, config_to_dict(config), log_dir, logger.name,
+                    options)
+        for samples in _chunk_results(chunks, options['processes'],
+                                      initargs):
+            for multipliers in samples:
+                results['multipliers'].add(multipliers)
+                if final_demand is not None:
+                    results['footprints'].add(multipliers.T @ final_demand)
+    finally:
+        shutil.rmtree(share_dir)
+    logger.info(LogMessage(_name, 'Finished {} samples in {:.1f} s'.format(
+                                  n_samples, time.time()-start_time)))
+    return results
+
+
+def write_results(results, out_dir):
+    """Writes the base values and statistics to monte_carlo.npz and, with
+    footprints, the footprint statistics to monte_carlo_footprints.csv.
+    Returns the paths of the files."""
+    arrays = {'base_' + k: v for k, v in results['base'].items()}
+    for name in ('multipliers', 'footprints'):
+        if name in results:
+            arrays.update(('{}_{}'.format(name, k), v) for k, v in
+                          results[name].result().items())
+    p2fs = [os.path.join(out_dir, 'monte_carlo.npz')]
+    np.savez(p2fs[0], **arrays)
+    if 'footprints' in results:
+        statistics = results['footprints'].result()
+        base = results['base']['footprints']
+        k, d = np.indices(base.shape)
+        table = pd.DataFrame({'intensity': k.ravel(), 'demand': d.ravel(),
+                              'base': base.ravel()})
+        for key, value in statistics.items():
+            table[key] = value.ravel()
+        p2fs.append(os.path.join(out_dir, 'monte_carlo_footprints.csv'))
+        table.to_csv(p2fs[1], index=False)
+    return p2fs
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, dest='config_file',
+                        default='./ConfigFile.ini', help='path to the'\
+                        'configuration file. Default file script folder.')
+    parser.add_argument("-f", "--intensities", type=str, required=True,
+                        help='.npy file with the direct intensities (one '\
+                        'vector or one vector per column) over the rows of A')
+    parser.add_argument("-y", "--final-demand", type=str, default=None,
+                        help='.npy file with the final demand (one vector or'\
+                        ' one vector per column)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    if os.path.exists(args.config_file):
+        config = configparser.ConfigParser()
+        config.read(args.config_file)
+        if config.get('project_info', 'log_dir'):
+            log_dir = config.get('project_info', 'log_dir')
+        else:
+            log_dir = config.get('project_info', 'project_outdir')
+        logger = mojo_logger.Logger(log_dir, config.get('project_info',
+                                    'project_name'), __file__)
+        out_dir = os.path.join(config.get('project_info', 'project_outdir'),
+                               'monte_carlo')
+        pipeline = Pipeline(system_model.model_stages(log_dir), config,
+                            logger, system_model.get_stage_cache(config,
+                                                                 logger))
+        results = monte_carlo(pipeline, config, logger, log_dir, out_dir,
+                              np.load(args.intensities),
+                              None if args.final_demand is None else
+                              np.load(args.final_demand))
+        for p2f in write_results(results, out_dir):
+            logger.info(LogMessage('monte_carlo', 'Wrote {}'.format(p2f)))
+    else:
+        print('Config file does not exist, please check path')
+        print('exiting...')
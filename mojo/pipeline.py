@@ -0,0 +1,301 @@
+#pipeline.py
+'''
+Runs the system model as a chain of stages with cached (checkpointed)
+outputs. Every stage declares its input stages, the config keys and data
+files it depends on and the functions that make up its code. The cache key of
+a stage is a hash of all of these together with the keys of its input stages,
+so changing one config value only reruns the stages downstream of it. The
+code of a stage includes the functions of this directory they call (by
+name or as attribute of a module), so a change of a helper invalidates it
+too. Outputs
+are written to disk as soon as a stage finishes, so an interrupted run
+continues from the last finished stage. The size of the cache is limited, the
+least recently used outputs are removed first.
+'''
+
+import hashlib
+import os
+import pickle
+import sys
+import time
+from mojo_logger import LogMessage
+
+
+def code_hash(func):
+    """Returns a hash of the byte code and constants of a function (or of the
+    __call__/__init__ code of a class), so that code changes change it."""
+    func = getattr(func, '__func__', func)
+    code = getattr(func, '__code__', None)
+    if code is None: #a class, hash all its methods
+        return hashlib.sha256(''.join(code_hash(f) for n, f in
+                              sorted(vars(func).items())
+                              if callable(f)).encode()).hexdigest()
+    sha256 = hashlib.sha256(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            sha256.update(const.co_code)
+        else:
+            sha256.update(repr(const).encode())
+    return sha256.hexdigest()
+
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_local_module(module):
+    p2f = getattr(module, '__file__', None)
+    return p2f is not None and os.path.dirname(os.path.abspath(p2f)) ==\
+                               MODULE_DIR
+
+
+def _is_local(obj):
+    """Whether obj is a function or class of a module in MODULE_DIR."""
+    if not callable(obj) or isinstance(obj, type(sys)):
+        return False
+    return _is_local_module(sys.modules.get(getattr(obj, '__module__', None)
+                                            or ''))
+
+
+def _code_objects(code):
+    yield code
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            yield from _code_objects(const)
+
+
+def called_functions(func):
+    """Returns the functions and classes of the modules in MODULE_DIR that
+    func (or, for a class, its methods) refers to by a global name or as
+    attribute of a module, e.g. sparse_utils.diagonal."""
+    func = getattr(func, '__func__', func)
+    if isinstance(func, type):
+        return [f for n, f in sorted(vars(func).items()) for f in
+                called_functions(f) if callable(getattr(f, '__func__', f))]
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return []
+    names = set(n for c in _code_objects(code) for n in c.co_names)
+    found = []
+    for name in names:
+        obj = func.__globals__.get(name)
+        if isinstance(obj, type(sys)): #a module, look up its used attributes
+            if not _is_local_module(obj):
+                continue
+            found.extend(getattr(obj, n) for n in names
+                         if _is_local(getattr(obj, n, None)))
+        elif _is_local(obj):
+            found.append(obj)
+    return found
+
+
+def code_closure(funcs):
+    """Returns funcs and all functions and classes they call (see
+    called_functions), directly or through others, sorted by name."""
+    found = {}
+    todo = list(funcs)
+    while todo:
+        func = todo.pop()
+        key = '{}.{}'.format(getattr(func, '__module__', ''),
+                             getattr(func, '__qualname__', repr(func)))
+        if key not in found:
+            found[key] = func
+            todo.extend(called_functions(func))
+    return [found[k] for k in sorted(found)]
+
+
+def _file_paths(p2f):
+    """Returns the data file p2f, or all files in the directory p2f (e.g. a
+    store or a dump split in files), sorted."""
+    if os.path.isdir(p2f):
+        return sorted(os.path.join(root, f) for root, dirs, files in
+                      os.walk(p2f) for f in files)
+    return [p2f] if os.path.exists(p2f) else []
+
+
+class Stage(object):
+    """A stage of the pipeline.
+    Input:
+    name        :   name of the stage
+    func        :   function called as func(config, logger, *inputs, **kwargs)
+                    with the outputs of the input stages
+    inputs      :   names of the input stages
+    config_keys :   (section, key) pairs of the config values the stage
+                    depends on
+    files       :   (section, key) pairs of data files the stage reads; the
+                    path is the value joined to the 'ddir' of the section.
+                    Their size and modification time (of all files in it
+                    for a directory) are part of the key.
+    code        :   functions of which the code (and that of the functions
+                    they call, see code_closure) is part of the key, by
+                    default only func. Classes of which only methods of
+                    instances are used must be listed.
+    version     :   version number, increase to invalidate cached outputs
+    kwargs      :   extra keyword arguments for func that do not affect the
+                    output (e.g. the log directory)
+    cache       :   whether to cache the output of this stage on disk
+    """
+
+    def __init__(self, name, func, inputs=(), config_keys=(), files=(),
+                 code=None, version=1, kwargs=None, cache=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.config_keys = tuple(config_keys)
+        self.files = tuple(files)
+        self.code = tuple(code) if code is not None else (func,)
+        self.version = version
+        self.kwargs = kwargs or {}
+        self.cache = cache
+
+
+class StageCache(object):
+    """Directory with pickled stage outputs, named by their key.
+    max_size is the maximum total size in bytes (None for no limit); when it
+    is exceeded the least recently used outputs are deleted."""
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        p2f = self.path(key)
+        with open(p2f, 'rb') as f:
+            value = pickle.load(f)
+        os.utime(p2f) #mark as recently used
+        return value
+
+    def store(self, key, value):
+        p2f = self.path(key)
+        tmp_p2f = p2f + '.tmp'
+        with open(tmp_p2f, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_p2f, p2f)
+        self.evict(keep=p2f)
+
+    def evict(self, keep=None):
+        """Deletes the least recently used outputs until the cache is smaller
+        than max_size. The file keep is never deleted."""
+        if self.max_size is None:
+            return []
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.pkl'):
+                p2f = os.path.join(self.cache_dir, file_name)
+                stat = os.stat(p2f)
+                entries.append((stat.st_mtime, stat.st_size, p2f))
+        total = sum(e[1] for e in entries)
+        removed = []
+        for mtime, size, p2f in sorted(entries):
+            if total <= self.max_size:
+                break
+            if p2f == keep:
+                continue
+            try:
+                os.remove(p2f)
+            except FileNotFoundError: #removed by another process
+                pass
+            total -= size
+            removed.append(p2f)
+        return removed
+
+
+class Pipeline(object):
+    """Runs stages with caching.
+    Input:
+    stages  :   list of Stage objects
+    config  :   configparser object
+    logger  :   logger instance
+    cache   :   StageCache, or None to run without caching
+    profiler:   mojo_logger.StageProfiler to profile the stages that are run
+                (not loaded from the cache), or None
+    """
+
+    def __init__(self, stages, config, logger, cache=None, profiler=None):
+        self.stages = {s.name: s for s in stages}
+        self.config = config
+        self.logger = logger
+        self.cache = cache
+        self.profiler = profiler
+        self.results = {} #outputs of this run, kept in memory
+        self.timings = {}
+        self._keys = {}
+
+    def key(self, name):
+        """Returns the cache key of a stage."""
+        if name in self._keys:
+            return self._keys[name]
+        stage = self.stages[name]
+        sha256 = hashlib.sha256()
+        sha256.update('{}:{}'.format(stage.name, stage.version).encode())
+        for func in code_closure(stage.code):
+            sha256.update(code_hash(func).encode())
+        for section, option in stage.config_keys:
+            sha256.update('{}.{}={}'.format(section, option, self.config.get(
+                          section, option, fallback='')).encode())
+        for section, option in stage.files:
+            file_name = self.config.get(section, option, fallback='')
+            if not file_name:
+                continue
+            p2f = os.path.join(self.config.get(section, 'ddir'), file_name)
+            for path in _file_paths(p2f):
+                stat = os.stat(path)
+                sha256.update('{}:{}:{}'.format(path, stat.st_size,
+                                                stat.st_mtime).encode())
+        for input_name in stage.inputs:
+            sha256.update(self.key(input_name).encode())
+        self._keys[name] = '{}-{}'.format(name, sha256.hexdigest()[:32])
+        return self._keys[name]
+
+    def downstream(self, names):
+        """Returns the names of the stages that depend (directly or through
+        other stages) on any of names, names included. These are the stages
+        to rerun when the outputs of names change."""
+        found = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages.values():
+                if stage.name not in found and found.intersection(
+                                                             stage.inputs):
+                    found.add(stage.name)
+                    changed = True
+        return found
+
+    def run(self, name):
+        """Returns the output of stage name, from memory, from the cache or
+        by running it (and, if needed, its input stages)."""
+        _name = Pipeline.run.__name__
+        if name in self.results:
+            return self.results[name]
+        stage = self.stages[name]
+        key = self.key(name)
+        if stage.cache and self.cache is not None and self.cache.has(key):
+            self.logger.info(LogMessage(_name, 'Loading stage {} from cache'.
+                                               format(name)))
+            try:
+                self.results[name] = self.cache.load(key)
+                return self.results[name]
+            except FileNotFoundError: #evicted by another process, rerun
+                pass
+        inputs = [self.run(input_name) for input_name in stage.inputs]
+        self.logger.info(LogMessage(_name, 'Running stage {}'.format(name)))
+        start = time.time()
+        if self.profiler is None:
+            self.results[name] = stage.func(self.config, self.logger, *inputs,
+                                            **stage.kwargs)
+        else:
+            with self.profiler.stage(name) as record:
+                self.results[name] = stage.func(self.config, self.logger,
+                                                *inputs, **stage.kwargs)
+                self.profiler.add_outputs(record, self.results[name])
+        self.timings[name] = time.time() - start
+        if stage.cache and self.cache is not None:
+            self.cache.store(key, self.results[name])
+        return self.results[name]
@@ -0,0 +1,154 @@
+#precision.py
+'''
+Numerical drift of the model IOT built in reduced precision. The dtype in
+the model_options of the config sets the storage precision of the supply,
+use and IOT tables (float64 or float32, which halves their memory), while
+reductions and the market blocks are accumulated in float64. This module
+compares Z and A of a run with the configured dtype with a float64
+reference run of the same config, block by block, and writes the drift to
+precision_drift.csv, e.g.
+    python precision.py -c ConfigFile.ini
+'''
+
+import argparse
+import configparser
+import csv
+import os
+import numpy as np
+import scipy.sparse as sp
+import mojo_logger
+from mojo_logger import LogMessage
+import system_model
+from batch import scenario_config
+
+DRIFT_FIELDS = ('table', 'block', 'dtype', 'max_abs_error', 'max_rel_error',
+                'rel_frobenius_error', 'max_col_sum_error')
+
+
+def block_drift(b, b_ref, chunk_size=1024):
+    """Returns the maximum absolute error, the sum of the squared errors,
+    the maximum absolute value and sum of squares of the reference and the
+    maximum absolute error of the column sums of block b relative to b_ref.
+    Blocks can be None (all zero), dense, memory mapped or sparse; dense
+    blocks are compared chunk_size columns at a time in float64."""
+    shape = b_ref.shape if b is None else b.shape
+    if b is None or b_ref is None:
+        b = sp.csr_matrix(shape) if b is None else b
+        b_ref = sp.csr_matrix(shape) if b_ref is None else b_ref
+    max_abs = sq_err = max_ref = sq_ref = max_col = 0.0
+    for start in range(0, shape[1], chunk_size):
+        stop = min(start + chunk_size, shape[1])
+        chunks = []
+        for a in (b, b_ref):
+            chunk = a[:, start:stop]
+            chunks.append(chunk.astype(float).toarray() if sp.issparse(chunk)
+                          else np.asarray(chunk, dtype=float))
+        error = chunks[0] - chunks[1]
+        if error.size:
+            max_abs = max(max_abs, np.abs(error).max())
+            max_ref = max(max_ref, np.abs(chunks[1]).max())
+            max_col = max(max_col, np.abs(error.sum(axis=0)).max())
+        sq_err += np.square(error).sum()
+        sq_ref += np.square(chunks[1]).sum()
+    return max_abs, sq_err, max_ref, sq_ref, max_col
+
+
+def drift_report(tables, ref_tables, dtype):
+    """Returns a list of records (dictionaries with DRIFT_FIELDS) with the
+    drift of every block and of the whole table, for the BlockMatrix tables
+    {'Z': Z, 'A': A} relative to ref_tables."""
+    records = []
+    for name, table in tables.items():
+        ref = ref_tables[name]
+        totals = np.zeros(5)
+        for i in range(table.n_blocks[0]):
+            for j in range(table.n_blocks[1]):
+                if table.block(i,j) is None and ref.block(i,j) is None:
+                    continue
+                drift = np.array(block_drift(table.block(i,j),
+                                             ref.block(i,j)))
+                records.append(_drift_record(name, '({},{})'.format(i,j),
+                                             dtype, drift))
+                totals[[1, 3]] += drift[[1, 3]]
+                totals[[0, 2, 4]] = np.maximum(totals[[0, 2, 4]],
+                                               drift[[0, 2, 4]])
+        records.append(_drift_record(name, 'all', dtype, totals))
+    return records
+
+
+def _drift_record(name, block, dtype, drift):
+    max_abs, sq_err, max_ref, sq_ref, max_col = drift
+    return {'table': name, 'block': block, 'dtype': str(dtype),
+            'max_abs_error': max_abs,
+            'max_rel_error': max_abs/max_ref if max_ref else 0.0,
+            'rel_frobenius_error': np.sqrt(sq_err/sq_ref) if sq_ref else 0.0,
+            'max_col_sum_error': max_col}
+
+
+def write_drift_report(records, p2f):
+    with open(p2f, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=DRIFT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    return p2f
+
+
+def precision_drift(config, logger, log_dir):
+    """Runs the system model with the dtype of the config and with float64,
+    writes the drift of Z and A to precision_drift.csv in the log directory
+    and returns the records."""
+    _name = precision_drift.__name__
+    dtype = system_model.get_dtype(config)
+    overrides = {'model_options.dtype': 'float64'}
+    if config.get('model_options', 'memory_budget', fallback=''):
+        #keep the streamed tables of both runs
+        overrides['model_options.stream_dir'] = os.path.join(config.get(
+                                    'model_options', 'stream_dir', fallback='')
+                                    or os.path.join(log_dir, 'stream'),
+                                    'float64')
+    ref_config = scenario_config(config, overrides)
+    logger.info(LogMessage(_name, 'Running the float64 reference model'))
+    Z_ref, A_ref = system_model.system_model(ref_config, logger, log_dir)[:2]
+    logger.info(LogMessage(_name, 'Running the {} model'.format(dtype)))
+    Z, A = system_model.system_model(config, logger, log_dir)[:2]
+    records = drift_report({'Z': Z, 'A': A}, {'Z': Z_ref, 'A': A_ref},
+                           dtype)
+    for record in records:
+        if record['block'] == 'all':
+            logger.info(LogMessage(_name, '{}: max relative error {:.3g}, '
+                                   'relative Frobenius error {:.3g}'.format(
+                                   record['table'], record['max_rel_error'],
+                                   record['rel_frobenius_error'])))
+    p2f = write_drift_report(records, os.path.join(
+                             mojo_logger.log_file_dir(logger, log_dir),
+                             'precision_drift.csv'))
+    logger.info(LogMessage(_name, 'Drift report written to {}'.format(p2f)))
+    return records
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, dest='config_file',
+                        default='./ConfigFile.ini', help='path to the'\
+                        'configuration file. Default file script folder.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    if os.path.exists(args.config_file):
+        config = configparser.ConfigParser()
+        config.read(args.config_file)
+        if config.get('project_info', 'log_dir'):
+            log_dir = config.get('project_info', 'log_dir')
+        else:
+            log_dir = config.get('project_info', 'project_outdir')
+        logger = mojo_logger.Logger(log_dir, config.get('project_info',
+                                    'project_name'), __file__)
+        precision_drift(config, logger, log_dir)
+    else:
+        print('Config file does not exist, please check path')
+        print('exiting...')
@@ -0,0 +1,366 @@
+#rdf_export.py
+'''
+Export of the A matrix of the model to RDF (N-Triples or Turtle) for the
+BONSAI database, without building an RDF graph in memory. Every non zero
+A[i,j] becomes a direct requirement with the using activity (column j), the
+supplying activity (row i, the IOT is product x product), the flow object of
+row i and the value. The activities (including the electricity and
+byproduct markets of create_market_and_product_names) and the flow objects
+are written once to a labels file.
+
+The non zeros are read column chunk by column chunk (model_store.
+table_columns, or the region blocks of a ModelStore) and turned into text
+by generators; the text is written in buffered chunks, optionally gzip
+compressed. The memory use only depends on the chunk and buffer sizes, not
+on the size of the model. Exporting from a model store can be split into
+one shard per column region, written in parallel, e.g.
+    python rdf_export.py -c ConfigFile.ini
+The namespaces and the vocabulary are set in the rdf_export section of the
+config.
+'''
+
+import argparse
+import configparser
+import gzip
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+import numpy as np
+import mojo_logger
+from mojo_logger import LogMessage
+import model_store
+import system_model
+
+FORMATS = ('nt', 'ttl')
+GZIP_LEVEL = 3 #the default 9 is about 5x slower for 20% smaller files
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+RDFS = 'http://www.w3.org/2000/01/rdf-schema#'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+#default namespaces and vocabulary, all can be set in the config
+VOCABULARY = {
+    'base_uri': 'http://rdf.bonsai.uno/',
+    'ontology': 'http://ontology.bonsai.uno/core#',
+    'version': 'exiobase3_3_17',
+    'model': 'mojo',
+    'coefficient_class': 'DirectRequirement',
+    'activity_class': 'Activity',
+    'market_class': 'Market',
+    'flow_object_class': 'FlowObject',
+    'input_of': 'isInputOf',
+    'output_of': 'isOutputOf',
+    'flow_object': 'hasFlowObject',
+    'activity_type': 'hasActivityType',
+    'location': 'hasLocation',
+    'unit': 'hasUnit',
+    }
+
+
+class Vocabulary(object):
+    """The IRIs of the exported triples.
+    Input:
+    options     :   dictionary overriding VOCABULARY
+    """
+
+    def __init__(self, options=None):
+        v = dict(VOCABULARY, **(options or {}))
+        ontology = self.ontology = v['ontology']
+        base = v['base_uri'].rstrip('/') + '/'
+        self.coefficient = base + '{}/{}/A/'.format(v['model'], v['version'])
+        self.activity = base + '{}/{}/activity/'.format(v['model'],
+                                                        v['version'])
+        self.activity_type = base + 'activitytype/{}/'.format(v['version'])
+        self.flow_object = base + 'flowobject/{}/'.format(v['version'])
+        self.location = base + 'location/{}/'.format(v['version'])
+        self.terms = {key: ontology + v[key] for key in
+                      ('coefficient_class', 'activity_class', 'market_class',
+                       'flow_object_class', 'input_of', 'output_of',
+                       'flow_object', 'activity_type', 'location', 'unit')}
+        self.terms['type'] = RDF + 'type'
+        self.terms['value'] = RDF + 'value'
+        self.terms['label'] = RDFS + 'label'
+        self.terms['double'] = XSD + 'double'
+
+    def turtle_term(self, key):
+        """Returns the Turtle term of a term of the ontology: bont:<name>
+        (see turtle_prefixes) if the name is a valid local name, else the
+        full <IRI>."""
+        name = self.terms[key][len(self.ontology):]
+        if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_-]*', name):
+            return 'bont:' + name
+        return '<{}>'.format(self.terms[key])
+
+
+def _iri(namespace, *parts):
+    return '<' + namespace + '/'.join(quote(str(p), safe='') for p in parts)\
+           + '>'
+
+
+def _literal(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+                 '\n', '\\n') + '"'
+
+
+def label_iris(row_labels, col_labels, vocabulary):
+    """Returns the IRIs of the supplying activity and the flow object of
+    every row and of the using activity of every column. The activity of a
+    row is the activity of the column with the same index (A is product x
+    product)."""
+    col_activities = np.array([_iri(vocabulary.activity, r, c) for r, c in
+                               zip(col_labels.column('Region'),
+                                   _activity_codes(col_labels))],
+                              dtype=object)
+    flow_objects = np.array([_iri(vocabulary.flow_object, c) for c in
+                             row_labels.column('code 2')], dtype=object)
+    return col_activities[:len(row_labels)], flow_objects, col_activities
+
+
+def _activity_codes(col_labels):
+    """Returns the activity type codes of the columns: the product codes
+    (C_) as activity codes (A_), the market codes (M_) as they are."""
+    return col_labels.map('code 2', lambda x: x.str.replace('C_', 'A_',
+                          regex=False)).column('code 2')
+
+
+def label_triples(row_labels, col_labels, vocabulary):
+    """Yields the triples (N-Triples lines) of the activities and flow
+    objects, one string per label."""
+    t = vocabulary.terms
+    col_activities = label_iris(row_labels, col_labels, vocabulary)[2]
+    markets = col_labels.contains('code 2', 'M_')
+    for j, (region, name, code) in enumerate(zip(
+                     col_labels.column('Region'), col_labels.column('Name'),
+                     _activity_codes(col_labels))):
+        s = col_activities[j]
+        yield ''.join('{} <{}> {} .\n'.format(s, p, o) for p, o in (
+              (t['type'], '<{}>'.format(t['activity_class'])),
+              (t['activity_type'], _iri(vocabulary.activity_type, code)),
+              (t['location'], _iri(vocabulary.location, region)),
+              (t['label'], _literal(name))) +
+              (((t['type'], '<{}>'.format(t['market_class'])),) if markets[j]
+               else ()))
+    flow_labels = row_labels.unique('code 2')
+    for code, name, unit in zip(flow_labels.column('code 2'),
+                                flow_labels.column('Name'),
+                                flow_labels.column('unit')):
+        s = _iri(vocabulary.flow_object, code)
+        yield ''.join('{} <{}> {} .\n'.format(s, p, o) for p, o in (
+              (t['type'], '<{}>'.format(t['flow_object_class'])),
+              (t['label'], _literal(name)), (t['unit'], _literal(unit))))
+
+
+def iter_nonzeros(get_columns, cols, chunk_columns=256):
+    """Yields the non zeros of the columns cols as (rows, cols, values)
+    arrays, chunk_columns columns at a time. get_columns(cols) returns the
+    columns as sparse matrix."""
+    for start in range(0, len(cols), chunk_columns):
+        chunk = cols[start:start + chunk_columns]
+        block = get_columns(chunk).tocoo()
+        order = np.lexsort((block.row, block.col))
+        yield block.row[order], chunk[block.col[order]],\
+              block.data[order].astype(float)
+
+
+def coefficient_lines(nonzeros, iris, vocabulary, rdf_format='nt'):
+    """Yields the text of the direct requirements of the non zeros (see
+    iter_nonzeros), one string per chunk.
+    Input:
+    nonzeros        :   iterable of (rows, cols, values)
+    iris            :   row_activities, flow_objects, col_activities of
+                        label_iris
+    rdf_format      :   'nt' (N-Triples) or 'ttl' (Turtle, the triples of a
+                        coefficient grouped with ;)
+    """
+    t = vocabulary.terms
+    row_activities, flow_objects, col_activities = iris
+    if rdf_format == 'nt':
+        template = ('{0} <' + t['type'] + '> <' + t['coefficient_class'] +
+                    '> .\n{0} <' + t['input_of'] + '> {1} .\n{0} <' +
+                    t['output_of'] + '> {2} .\n{0} <' + t['flow_object'] +
+                    '> {3} .\n{0} <' + t['value'] + '> "{4!r}"^^<' +
+                    t['double'] + '> .\n')
+    else:
+        term = vocabulary.turtle_term
+        template = ('{0} a ' + term('coefficient_class') + ' ;\n    ' +
+                    term('input_of') + ' {1} ;\n    ' + term('output_of') +
+                    ' {2} ;\n    ' + term('flow_object') + ' {3} ;\n    '
+                    'rdf:value "{4!r}"^^xsd:double .\n')
+    for rows, cols, values in nonzeros:
+        subjects = ['<{}{}_{}>'.format(vocabulary.coefficient, i, j)
+                    for i, j in zip(rows.tolist(), cols.tolist())]
+        yield ''.join(map(template.format, subjects, col_activities[cols],
+                          row_activities[rows], flow_objects[rows],
+                          values.tolist()))
+
+
+def turtle_prefixes(vocabulary):
+    """Returns the prefixes of the Turtle files, bont: is the ontology."""
+    return ('@prefix bont: <{}> .\n@prefix rdf: <{}> .\n@prefix xsd: <{}> .\n'
+            '\n'.format(vocabulary.ontology, RDF, XSD))
+
+
+def write_text(chunks, p2f, compress=False, buffer_size=1<<22, header=''):
+    """Writes the text chunks to p2f (gzip compressed if compress), in
+    writes of about buffer_size characters. Returns the number of
+    characters."""
+    n_chars = 0
+    tmp_p2f = p2f + '.tmp'
+    if compress:
+        f = gzip.open(tmp_p2f, 'wt', compresslevel=GZIP_LEVEL,
+                      encoding='utf-8')
+    else:
+        f = open(tmp_p2f, 'w', encoding='utf-8')
+    with f:
+        buffer, buffered = [header], len(header)
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= buffer_size:
+                f.write(''.join(buffer))
+                n_chars += buffered
+                buffer, buffered = [], 0
+        f.write(''.join(buffer))
+        n_chars += buffered
+    os.replace(tmp_p2f, p2f)
+    return n_chars
+
+
+def _file_name(name, rdf_format, compress):
+    return '{}.{}{}'.format(name, rdf_format, '.gz' if compress else '')
+
+
+def export_A(A, row_labels, col_labels, out_dir, logger, rdf_format='nt',
+             compress=True, vocabulary=None, chunk_columns=256):
+    """Writes A (BlockMatrix, numpy array, memory map or sparse matrix) and
+    its labels to out_dir as A.<rdf_format>[.gz] and labels.nt[.gz]. Returns
+    the paths of the files."""
+    _name = export_A.__name__
+    _check_format(rdf_format)
+    vocabulary = vocabulary or Vocabulary()
+    start = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    p2fs = [_write_labels(row_labels, col_labels, out_dir, compress,
+                          vocabulary)]
+    iris = label_iris(row_labels, col_labels, vocabulary)
+    nonzeros = iter_nonzeros(lambda cols: model_store.table_columns(A, cols),
+                             np.arange(A.shape[1]), chunk_columns)
+    p2fs.append(os.path.join(out_dir, _file_name('A', rdf_format, compress)))
+    write_text(coefficient_lines(nonzeros, iris, vocabulary, rdf_format),
+               p2fs[-1], compress, header=turtle_prefixes(vocabulary) if
+               rdf_format == 'ttl' else '')
+    logger.info(LogMessage(_name, 'Exported A to {} in {:.1f} s'.format(
+                                  out_dir, time.time()-start)))
+    return p2fs
+
+
+def _write_labels(row_labels, col_labels, out_dir, compress, vocabulary):
+    p2f = os.path.join(out_dir, _file_name('labels', 'nt', compress))
+    write_text(label_triples(row_labels, col_labels, vocabulary), p2f,
+               compress)
+    return p2f
+
+
+def _check_format(rdf_format):
+    if rdf_format not in FORMATS:
+        raise ValueError('Unknown RDF format {}, use {}'.format(rdf_format,
+                         ' or '.join(FORMATS)))
+
+
+def _export_region(args):
+    """Writes the direct requirements of the columns of one region of the A
+    table of a model store to a shard, see export_model_store."""
+    store_dir, region, out_dir, rdf_format, compress, options,\
+                                              chunk_columns = args
+    store = model_store.ModelStore(store_dir)
+    vocabulary = Vocabulary(options)
+    iris = label_iris(store.row_labels, store.col_labels, vocabulary)
+    region_cols = store.col_index(region)
+    block = store.column_block('A', region, 'csc')
+    position = {c: k for k, c in enumerate(region_cols)}
+    nonzeros = iter_nonzeros(lambda cols: block[:, [position[c] for c in
+                             cols]], region_cols, chunk_columns)
+    p2f = os.path.join(out_dir, _file_name('A_' + quote(region, safe=''),
+                                           rdf_format, compress))
+    write_text(coefficient_lines(nonzeros, iris, vocabulary, rdf_format), p2f,
+               compress, header=turtle_prefixes(vocabulary) if
+               rdf_format == 'ttl' else '')
+    return p2f
+
+
+def export_model_store(store_dir, out_dir, logger, rdf_format='nt',
+                       compress=True, options=None, processes=None,
+                       chunk_columns=256):
+    """Writes the A table of a model store (see model_store.write_model) to
+    out_dir as one shard A_<region>.<rdf_format>[.gz] per column region and
+    the labels to labels.nt[.gz]. The shards are written by a pool of
+    processes (processes=1 writes them one by one), each reading only the
+    column block of its region. Returns the paths of the files."""
+    _name = export_model_store.__name__
+    _check_format(rdf_format)
+    start = time.time()
+    store = model_store.ModelStore(store_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    p2fs = [_write_labels(store.row_labels, store.col_labels, out_dir,
+                          compress, Vocabulary(options))]
+    jobs = [(store_dir, region, out_dir, rdf_format, compress, options,
+             chunk_columns) for region in store.regions
+            if len(store.col_index(region))]
+    if processes == 1:
+        p2fs.extend(map(_export_region, jobs))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            p2fs.extend(pool.map(_export_region, jobs))
+    logger.info(LogMessage(_name, 'Exported A in {} shards to {} in {:.1f} s'
+                                  .format(len(jobs), out_dir,
+                                          time.time()-start)))
+    return p2fs
+
+
+def get_options(config):
+    """Returns the vocabulary options of the rdf_export section of the
+    config (the keys of VOCABULARY)."""
+    return {key: config.get('rdf_export', key) for key in VOCABULARY
+            if config.get('rdf_export', key, fallback='')}
+
+
+def ParseArgs():
+    '''
+    ParsArgs parser the command line options
+    and returns them as a Namespace object
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, dest='config_file',
+                        default='./ConfigFile.ini', help='path to the'\
+                        'configuration file. Default file script folder.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    if os.path.exists(args.config_file):
+        config = configparser.ConfigParser()
+        config.read(args.config_file)
+        if config.get('project_info', 'log_dir'):
+            log_dir = config.get('project_info', 'log_dir')
+        else:
+            log_dir = config.get('project_info', 'project_outdir')
+        logger = mojo_logger.Logger(log_dir, config.get('project_info',
+                                    'project_name'), __file__)
+        store_dir = config.get('model_options', 'model_output_dir',
+                               fallback='') or os.path.join(config.get(
+                               'project_info', 'project_outdir'), 'model')
+        if not os.path.exists(os.path.join(store_dir, 'index.json')):
+            config.set('model_options', 'model_output_dir', store_dir)
+            system_model.system_model(config, logger, log_dir)
+        processes = config.get('rdf_export', 'processes', fallback='')
+        export_model_store(store_dir, config.get('rdf_export', 'out_dir',
+                           fallback='') or os.path.join(config.get(
+                           'project_info', 'project_outdir'), 'rdf'), logger,
+                           config.get('rdf_export', 'format', fallback='nt'),
+                           config.getboolean('rdf_export', 'compress',
+                                             fallback=True),
+                           get_options(config),
+                           int(processes) if processes else None)
+    else:
+        print('Config file does not exist, please check path')
+        print('exiting...')
@@ -0,0 +1,332 @@
+#rdf_import.py
+'''
+Reads the supply and use tables from a local RDF dump (N-Triples or Turtle
+files, optionally gzip compressed) without building an RDF graph. The dump
+is read line by line and only the triples with the predicates of the
+vocabulary of rdf_export (flow object, input of, output of, value, location
+and activity type) are kept:
+    flow        hasFlowObject <.../C_PARI>, isOutputOf or isInputOf an
+                activity, rdf:value and optionally hasLocation (the region
+                the product of a use flow comes from)
+    activity    hasActivityType <.../A_PARI> and hasLocation <.../AU>
+The flow object, activity type and location IRIs are resolved to indices
+with dictionaries that are filled once per distinct IRI (the codes are the
+last part of the IRI). The flows are collected in COO buffers which are added
+to the sparse tables every buffer_size flows, so the memory use is the size
+of the tables plus the buffers.
+
+The triples of a subject are expected to be together, as written by most
+serializers; the triples of subjects that are split over the dump are kept
+until the subject is complete. Flows of activities that are defined later in
+the dump are kept (as compact arrays) until the activity is found.
+'''
+
+import gzip
+import os
+import re
+from urllib.parse import unquote
+import numpy as np
+import scipy.sparse as sp
+from mojo_logger import LogMessage
+import rdf_export
+
+EXTENSIONS = ('.nt', '.ttl', '.nt.gz', '.ttl.gz')
+PREDICATES = ('flow_object', 'input_of', 'output_of', 'value', 'location',
+              'activity_type')
+_TOKEN = re.compile(r'"""|<[^>]*>|"(?:[^"\\]|\\.)*"(?:\^\^(?:<[^>]*>|'
+                    r'[^\s;,]+)|@[A-Za-z0-9-]+)?|[;,]|[^\s;,]+')
+
+
+def dump_files(path):
+    """Returns the RDF files of a dump: path itself or the files in the
+    directory path with one of EXTENSIONS, sorted by name."""
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, f) for f in sorted(os.listdir(path))
+            if f.endswith(EXTENSIONS)]
+
+
+def _open_text(p2f):
+    if p2f.endswith('.gz'):
+        return gzip.open(p2f, 'rt', encoding='utf-8')
+    return open(p2f, encoding='utf-8')
+
+
+def iter_ntriples(lines):
+    """Yields the (subject, predicate, object) terms of N-Triples lines, IRIs
+    with their <>."""
+    for line in lines:
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        s, p, o = line.split(None, 2)
+        yield s, p, o.rstrip()[:-1].rstrip()
+
+
+def iter_turtle(lines):
+    """Yields the (subject, predicate, object) terms of Turtle lines, as
+    iter_ntriples would for the same triples (prefixed names, a and literal
+    datatypes expanded to <IRI>). Supports the statements with ;
+    and , lists and @prefix/PREFIX directives, not blank node property lists,
+    collections or triple quoted (multi line) literals."""
+    prefixes = {}
+    directive, subject, predicate = None, None, None
+    for line in lines:
+        if line.lstrip().startswith('#'):
+            continue
+        for token in _tokens(line):
+            if directive is not None:
+                directive.append(token)
+                if len(directive) == 3:
+                    prefixes[directive[1].rstrip(':')] = directive[2][1:-1]
+                if token == '.' or (len(directive) == 3 and
+                                    directive[0] == 'PREFIX'):
+                    directive = None
+            elif token in ('@prefix', 'PREFIX'):
+                directive = [token]
+            elif token == '.':
+                subject, predicate = None, None
+            elif token == ';':
+                predicate = None
+            elif token == ',':
+                continue
+            elif token[0] in '[(' or token.startswith('"""'):
+                raise ValueError('Unsupported Turtle syntax {}'.format(token))
+            elif subject is None:
+                subject = _expand(token, prefixes)
+            elif predicate is None:
+                predicate = '<{}type>'.format(rdf_export.RDF) if token == 'a'\
+                            else _expand(token, prefixes)
+            else:
+                yield subject, predicate, _expand(token, prefixes)
+
+
+def _tokens(line):
+    for token in _TOKEN.findall(line):
+        #a statement may end directly after a prefixed name or literal
+        if len(token) > 1 and token.endswith('.') and token[0] != '<':
+            yield token[:-1]
+            yield '.'
+        else:
+            yield token
+
+
+def _expand(token, prefixes):
+    """Returns a Turtle term as N-Triples term: prefixed names (also the
+    datatype of a literal) as <IRI>, numbers as typed literals."""
+    if token[0] == '<' or token.startswith('_:'):
+        return token
+    if token[0] == '"':
+        lexical, typed, datatype = token.rpartition('^^')
+        if typed and datatype[0] != '<':
+            return '{}^^{}'.format(lexical, _expand(datatype, prefixes))
+        return token
+    if token[0] in '0123456789+-.': #numeric literal
+        datatype = 'double' if 'e' in token.lower() else\
+                   'decimal' if '.' in token else 'integer'
+        return '"{}"^^<{}{}>'.format(token, rdf_export.XSD, datatype)
+    prefix, _, local = token.partition(':')
+    if prefix not in prefixes:
+        raise ValueError('Unknown prefix in {}'.format(token))
+    return '<{}{}>'.format(prefixes[prefix], local)
+
+
+def iter_triples(p2f):
+    """Yields the triples of an N-Triples (.nt) or Turtle (.ttl) file, gzip
+    compressed if it ends with .gz."""
+    with _open_text(p2f) as f:
+        if p2f.endswith(('.ttl', '.ttl.gz')):
+            yield from iter_turtle(f)
+        else:
+            yield from iter_ntriples(f)
+
+
+def _literal_value(term):
+    return float(term[1:term.rindex('"')])
+
+
+class _CodeResolver(object):
+    """Maps IRIs to the index of their code (the last part of the IRI) in
+    codes, -1 for unknown codes. Every distinct IRI is resolved once."""
+
+    def __init__(self, codes):
+        self._index = {c: i for i, c in enumerate(codes)}
+        self._iris = {}
+
+    def __call__(self, iri):
+        index = self._iris.get(iri)
+        if index is None:
+            code = unquote(iri[1:-1].rstrip('/').rsplit('/', 1)[-1])
+            index = self._iris[iri] = self._index.get(code, -1)
+        return index
+
+
+class SutReader(object):
+    """Collects the supply (V) and use (U) table from the triples of an RDF
+    dump, in the layout of load_exiobase.get_sut: the rows are the products
+    of every country, the columns the activities of every country.
+    Input:
+    countries   :   country codes, in the order of the tables
+    products    :   product codes (C_), in the order of the tables
+    activities  :   activity codes (A_), in the order of the tables
+    logger      :   logger instance
+    options     :   vocabulary options, see rdf_export.VOCABULARY
+    buffer_size :   number of flows collected before they are added to the
+                    tables
+    """
+
+    def __init__(self, countries, products, activities, logger, options=None,
+                 buffer_size=1000000):
+        self.logger = logger
+        self.n_prod, self.n_act = len(products), len(activities)
+        self.shape = (len(countries)*self.n_prod, len(countries)*self.n_act)
+        self.buffer_size = buffer_size
+        terms = rdf_export.Vocabulary(options).terms
+        self._predicates = {'<{}>'.format(terms[k]): k for k in PREDICATES}
+        self._location = _CodeResolver(countries)
+        self._product = _CodeResolver(products)
+        self._activity_type = _CodeResolver(activities)
+        self._activity_id = {} #activity IRI -> id
+        #column and country of every activity id, -1 unknown, -2 invalid
+        self._act_col, self._act_loc = [], []
+        self._pending = {} #subjects of which not all triples are read
+        #buffers of product, origin country, activity id and value
+        self._buffers = {'V': ([], [], [], []), 'U': ([], [], [], [])}
+        self._carry = {'V': None, 'U': None} #flows of unknown activities
+        self.tables = {k: sp.csr_matrix(self.shape) for k in ('V', 'U')}
+        self.n_skipped = 0
+
+    def read(self, triples):
+        """Adds the flows and activities of the triples."""
+        subject, state = None, None
+        predicates = self._predicates
+        for s, p, o in triples:
+            key = predicates.get(p)
+            if key is None:
+                continue
+            if s != subject:
+                if subject is not None:
+                    self._close(subject, state)
+                subject, state = s, self._pending.pop(s, {})
+            state[key] = o
+        if subject is not None:
+            self._close(subject, state)
+
+    def _activity(self, iri):
+        act_id = self._activity_id.get(iri)
+        if act_id is None:
+            act_id = self._activity_id[iri] = len(self._act_col)
+            self._act_col.append(-1)
+            self._act_loc.append(-1)
+        return act_id
+
+    def _close(self, subject, state):
+        """Adds a subject of which all triples in a group are read, or keeps
+        it until the rest of its triples is read."""
+        if 'flow_object' in state or 'value' in state:
+            if 'flow_object' in state and 'value' in state and (
+               'input_of' in state or 'output_of' in state):
+                return self._add_flow(state)
+        elif 'activity_type' in state and 'location' in state:
+            act_id = self._activity(subject)
+            act_type = self._activity_type(state['activity_type'])
+            loc = self._location(state['location'])
+            valid = act_type >= 0 and loc >= 0
+            self._act_col[act_id] = loc*self.n_act + act_type if valid else -2
+            self._act_loc[act_id] = loc if valid else -2
+            return
+        self._pending[subject] = state
+
+    def _add_flow(self, state):
+        product = self._product(state['flow_object'])
+        if product < 0:
+            self.n_skipped += 1
+            return
+        if 'input_of' in state:
+            #use of a product from the flow location, the supplying activity
+            #or else the country of the using activity
+            table, act_id = 'U', self._activity(state['input_of'])
+            if 'location' in state:
+                origin = self._location(state['location'])
+                if origin < 0:
+                    self.n_skipped += 1
+                    return
+            elif 'output_of' in state:
+                origin = -2 - self._activity(state['output_of'])
+            else:
+                origin = -1
+        else:
+            table, act_id = 'V', self._activity(state['output_of'])
+            origin = -1
+        buffer = self._buffers[table]
+        buffer[0].append(product)
+        buffer[1].append(origin)
+        buffer[2].append(act_id)
+        buffer[3].append(_literal_value(state['value']))
+        if len(buffer[0]) >= self.buffer_size:
+            self._flush(table)
+
+    def _flush(self, table, final=False):
+        """Adds the flows in the buffer (and those kept before) of activities
+        that are known to table, keeps the others (final: skips them)."""
+        buffer = self._buffers[table]
+        arrays = [np.array(buffer[0], dtype=np.int32),
+                  np.array(buffer[1], dtype=np.int64),
+                  np.array(buffer[2], dtype=np.int64),
+                  np.array(buffer[3], dtype=float)]
+        for b in buffer:
+            b.clear()
+        if self._carry[table] is not None:
+            arrays = [np.concatenate(a) for a in zip(self._carry[table],
+                                                     arrays)]
+            self._carry[table] = None
+        product, origin, act_id, value = arrays
+        act_col = np.array(self._act_col, dtype=np.int64)
+        act_loc = np.array(self._act_loc, dtype=np.int64)
+        cols = act_col[act_id]
+        country = np.where(origin >= 0, origin, act_loc[act_id])
+        supplier = origin <= -2
+        country[supplier] = act_loc[-2 - origin[supplier]]
+        known = (cols >= 0) & (country >= 0)
+        unknown = (cols == -1) | (country == -1)
+        if final:
+            self.n_skipped += int(np.count_nonzero(~known))
+        else:
+            self.n_skipped += int(np.count_nonzero(~known & ~unknown))
+            if np.any(unknown):
+                self._carry[table] = [a[unknown] for a in arrays]
+        self.tables[table] = self.tables[table] + sp.csr_matrix(
+                             (value[known], (country[known]*self.n_prod +
+                             product[known], cols[known])), shape=self.shape)
+
+    def finalize(self):
+        """Returns the supply and use table (csr). Subjects and flows that are
+        incomplete at the end of the dump are skipped."""
+        _name = SutReader.finalize.__name__
+        pending = list(self._pending.items())
+        self._pending = {}
+        for subject, state in pending: #activities defined by split subjects
+            if 'activity_type' in state and 'location' in state:
+                self._close(subject, state)
+        self.n_skipped += len(self._pending)
+        for table in ('V', 'U'):
+            self._flush(table, final=True)
+            self.tables[table].sum_duplicates()
+            self.tables[table].eliminate_zeros()
+        if self.n_skipped:
+            self.logger.warning(LogMessage(_name, 'Skipped {} flows or '
+                                'subjects with unknown codes or activities, '
+                                'or missing triples'.format(self.n_skipped)))
+        return self.tables['V'], self.tables['U']
+
+
+def read_sut(path, countries, products, activities, logger, options=None,
+             buffer_size=1000000):
+    """Returns the supply and use table (csr) of the RDF dump path (a file or
+    a directory of files, see dump_files), see SutReader."""
+    _name = read_sut.__name__
+    reader = SutReader(countries, products, activities, logger, options,
+                       buffer_size)
+    for p2f in dump_files(path):
+        logger.info(LogMessage(_name, 'Reading RDF from {}'.format(p2f)))
+        reader.read(iter_triples(p2f))
+    return reader.finalize()
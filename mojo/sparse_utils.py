@@ -0,0 +1,155 @@
+#sparse_utils.py
+'''
+Small helpers that let the system model stages work on dense numpy arrays
+as well as on scipy.sparse matrices.
+'''
+
+import numpy as np
+import scipy.sparse as sp
+
+MATRIX_FORMATS = ('dense', 'csr', 'csc')
+#storage precision of the large tables, reductions are always accumulated in
+#float64
+DTYPES = ('float64', 'float32')
+
+
+def check_format(matrix_format):
+    """Raise a ValueError if matrix_format is not a supported format."""
+    if matrix_format not in MATRIX_FORMATS:
+        raise ValueError('Unknown matrix format {}, choose one of {}'.format(
+                         matrix_format, ', '.join(MATRIX_FORMATS)))
+    return matrix_format
+
+
+def check_dtype(dtype):
+    """Returns dtype as numpy dtype, raises a ValueError if it is not a
+    supported storage precision."""
+    if str(dtype) not in DTYPES:
+        raise ValueError('Unknown dtype {}, choose one of {}'.format(dtype,
+                         ', '.join(DTYPES)))
+    return np.dtype(dtype)
+
+
+def as_dtype(a, dtype):
+    """Returns a numpy array or scipy.sparse matrix with values of dtype,
+    without copying if it already has that dtype."""
+    if a.dtype == dtype:
+        return a
+    if sp.issparse(a):
+        return a.astype(dtype)
+    return np.asarray(a, dtype=dtype)
+
+
+def get_format(a):
+    """Returns the storage format of a: 'dense', 'csr' or 'csc'. Sparse
+    matrices in any other format are reported as 'csr'."""
+    if not sp.issparse(a):
+        return 'dense'
+    return a.format if a.format in MATRIX_FORMATS else 'csr'
+
+
+def as_format(a, matrix_format):
+    """Returns a in the requested storage format.
+    Input:
+    a               :   numpy array or scipy.sparse matrix
+    matrix_format   :   'dense', 'csr' or 'csc'
+    """
+    check_format(matrix_format)
+    if matrix_format == 'dense':
+        return a.toarray() if sp.issparse(a) else np.asarray(a)
+    if sp.issparse(a):
+        return a.asformat(matrix_format)
+    return sp.csr_matrix(a).asformat(matrix_format)
+
+
+def flat_sum(a, axis):
+    """Sum over axis, always returning a flat float64 numpy array (scipy.sparse
+    matrices return a 2d np.matrix)."""
+    return np.asarray(a.sum(axis=axis, dtype=float)).ravel()
+
+
+def row_and_column_sums(a, chunk_size=4096):
+    """Returns the row sums and the column sums of a dense or sparse matrix,
+    accumulated in float64 in one pass over the data. Dense arrays (and
+    memory maps) are read in blocks of chunk_size rows."""
+    n_rows, n_cols = a.shape
+    if sp.issparse(a):
+        if get_format(a) == 'csc':
+            col_sums, row_sums = row_and_column_sums(a.T)
+            return row_sums, col_sums
+        a = a.tocsr()
+        rows = np.repeat(np.arange(n_rows), np.diff(a.indptr))
+        return np.bincount(rows, weights=a.data, minlength=n_rows),\
+               np.bincount(a.indices, weights=a.data, minlength=n_cols)
+    row_sums = np.zeros(n_rows)
+    col_sums = np.zeros(n_cols)
+    for start in range(0, n_rows, chunk_size):
+        chunk = a[start:start+chunk_size]
+        row_sums[start:start+chunk_size] = chunk.sum(axis=1, dtype=float)
+        col_sums += chunk.sum(axis=0, dtype=float)
+    return row_sums, col_sums
+
+
+def diagonal(a):
+    """Returns the diagonal of a dense or sparse matrix as numpy array."""
+    return a.diagonal() if sp.issparse(a) else np.diag(a)
+
+
+def diag_matrix(d, matrix_format):
+    """Returns a square matrix with d on its diagonal in the requested
+    format."""
+    if matrix_format == 'dense':
+        return np.diag(d)
+    return sp.diags(d, format=matrix_format)
+
+
+def zero_rows(a, rows):
+    """Returns a copy of a with the rows set to zero.
+    Input:
+    a       :   numpy array or scipy.sparse matrix
+    rows    :   boolean mask or integer indices of the rows to set to zero
+    """
+    if not sp.issparse(a):
+        a = a.copy()
+        a[rows, :] = 0
+        return a
+    keep = np.ones(a.shape[0], dtype=a.dtype)
+    keep[rows] = 0
+    a = (sp.diags(keep) @ a).asformat(get_format(a))
+    a.eliminate_zeros()
+    return a
+
+
+def scale_columns(a, factors, inplace=False):
+    """Returns a with every column j divided by factors[j], in the dtype of
+    a. If inplace is True a (a writable numpy array, csr or csc matrix) is
+    scaled in place and returned."""
+    factors = np.asarray(factors).astype(a.dtype, copy=False)
+    if not sp.issparse(a):
+        if inplace:
+            a /= factors
+            return a
+        return a/factors
+    matrix_format = get_format(a)
+    a = a.asformat(matrix_format, copy=not inplace)
+    if matrix_format == 'csc':
+        a.data /= np.repeat(factors, np.diff(a.indptr))
+    else:
+        a.data /= factors[a.indices]
+    return a
+
+
+def minus_offdiagonal(u, v):
+    """Returns u - v + diag(v), i.e. u minus the off diagonal entries of v,
+    without a full diag(v) temporary. For dense tables the result is the only
+    new array. The result is sparse (in the format of u) only if u and v are
+    both sparse."""
+    v_diag = diagonal(v)
+    if sp.issparse(u) and sp.issparse(v):
+        z = (u - v + sp.diags(v_diag, dtype=v.dtype)).asformat(get_format(u))
+        z.eliminate_zeros()
+        return z
+    z = np.subtract(as_format(u, 'dense'), as_format(v, 'dense'))
+    diag = np.arange(len(v_diag))
+    z[diag, diag] += v_diag
+    return z
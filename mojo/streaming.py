@@ -0,0 +1,227 @@
+#streaming.py
+'''
+Region streamed (out of core) construction of the main block of the model
+IOT. The supply and use tables are read as a stream of column blocks of whole
+regions, either from memory maps (the dense binary cache of sut_cache) or
+from sparse matrices. Every column block is aggregated, the electricity and
+exclusive byproduct rows are moved to their markets and the blocks of Z and A
+are written to .npy files on disk, which are returned as read only memory
+maps. The number of regions per column block follows from a memory budget,
+so the peak memory no longer grows with the square of the number of regions.
+
+The data is passed twice:
+1.  stream_aggregate aggregates the column blocks into vagg.npy and uagg.npy
+    and accumulates the row and column totals and the diagonal of the
+    aggregated supply table, from which the exclusive byproducts are found.
+2.  stream_model reads the aggregated column blocks, collects the (small)
+    market blocks and writes the main blocks of Z and A.
+
+All files are written in Fortran (column major) order, so a column block is
+one contiguous read or write, in the storage precision dtype (float64 or
+float32). The totals and the market blocks are accumulated in float64.
+'''
+
+import os
+import numpy as np
+import scipy.sparse as sp
+from mojo_logger import LogMessage
+import sparse_utils
+
+#number of (rows x columns) buffers held at the same time, per pass.
+#Pass 1 holds the supply and use column blocks (raw rows), their aggregates
+#and the aggregation temporaries, pass 2 the supply and use blocks, Z, A and
+#temporaries.
+AGGREGATE_BUFFERS = (2, 4) #(raw rows, aggregated rows)
+MODEL_BUFFERS = 6
+
+
+def regions_per_block(memory_budget, N_reg, N_sec, bytes_per_column):
+    """Returns the number of regions in a column block so that the column
+    blocks fit in memory_budget (bytes). At least one region is used, also if
+    it does not fit in the budget."""
+    return int(max(1, min(N_reg, memory_budget//(bytes_per_column*N_sec))))
+
+
+def region_blocks(N_reg, n_regions):
+    """Yields the (first, last + 1) regions of consecutive column blocks of
+    n_regions regions."""
+    for first in range(0, N_reg, n_regions):
+        yield first, min(first + n_regions, N_reg)
+
+
+def read_columns(a, start, stop, dtype=float):
+    """Returns columns start:stop of a numpy array, memory map or sparse
+    matrix as a dense array of dtype."""
+    if sp.issparse(a):
+        return sparse_utils.as_format(a[:, start:stop], 'dense').astype(
+                                      dtype, copy=False)
+    return np.array(a[:, start:stop], dtype=dtype)
+
+
+def open_output(out_dir, name, shape, dtype=float):
+    """Creates a column major .npy file to be filled block by block and
+    returns it as writable memory map."""
+    os.makedirs(out_dir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy.tmp'),
+                                     mode='w+', dtype=dtype, shape=shape,
+                                     fortran_order=True)
+
+
+def close_output(out_dir, name, table):
+    """Flushes an output of open_output, moves it into place and returns it
+    as read only memory map."""
+    table.flush()
+    tmp_p2f = table.filename
+    del table
+    p2f = os.path.join(out_dir, name + '.npy')
+    os.replace(tmp_p2f, p2f)
+    return np.load(p2f, mmap_mode='r')
+
+
+def stream_aggregate(v, u, aggregation_matrix, out_dir, memory_budget,
+                     logger, dtype=float):
+    """Aggregates the supply and use table column block by column block.
+    Input:
+    v, u                :   supply and use table (N_reg*N_prod x N_reg*N_sec)
+                            as (memory mapped) numpy array or sparse matrix
+    aggregation_matrix  :   BlockAggregationMatrix
+    out_dir             :   directory for vagg.npy and uagg.npy
+    memory_budget       :   memory for the column blocks in bytes
+    dtype               :   storage precision of the blocks and outputs
+
+    Output:
+    vagg, uagg          :   read only memory maps of the aggregated tables
+    supply_totals       :   row totals of vagg (total product output)
+    activity_totals     :   column totals of vagg (total activity output)
+    supply_diagonal     :   diagonal of vagg
+    """
+    _name = stream_aggregate.__name__
+    N_reg, N_sec = aggregation_matrix.N_reg, aggregation_matrix.N_sec
+    n_raw, n = v.shape[0], N_reg*N_sec
+    raw_buffers, agg_buffers = AGGREGATE_BUFFERS
+    itemsize = np.dtype(dtype).itemsize
+    n_regions = regions_per_block(memory_budget, N_reg, N_sec, itemsize*(
+                                  raw_buffers*n_raw + agg_buffers*n))
+    logger.info(LogMessage(_name, 'Aggregating in column blocks of {} '
+                                  'regions'.format(n_regions)))
+    vagg = open_output(out_dir, 'vagg', (n, n), dtype)
+    uagg = open_output(out_dir, 'uagg', (n, n), dtype)
+    supply_totals = np.zeros(n)
+    activity_totals = np.zeros(n)
+    supply_diagonal = np.zeros(n)
+    for first, last in region_blocks(N_reg, n_regions):
+        start, stop = first*N_sec, last*N_sec
+        v_block = aggregation_matrix.aggregate(read_columns(v, start, stop,
+                                                            dtype))
+        vagg[:, start:stop] = v_block
+        supply_totals += v_block.sum(axis=1, dtype=float)
+        activity_totals[start:stop] = v_block.sum(axis=0, dtype=float)
+        supply_diagonal[start:stop] = v_block[np.arange(start, stop),
+                                              np.arange(stop - start)]
+        del v_block
+        uagg[:, start:stop] = aggregation_matrix.aggregate(read_columns(u,
+                                                           start, stop, dtype))
+    return close_output(out_dir, 'vagg', vagg),\
+           close_output(out_dir, 'uagg', uagg), supply_totals,\
+           activity_totals, supply_diagonal
+
+
+def stream_model(vagg, uagg, N_reg, N_sec, elec_rows, market_products,
+                 market_rows, supply_diagonal, out_dir, memory_budget,
+                 logger, dtype=float):
+    """Moves the electricity and exclusive byproduct rows of the aggregated
+    tables to their markets and writes the main (aggregated table) blocks of
+    Z and A column block by column block. Gives the same blocks as
+    create_electricity_grids, create_excl_byprod_markets and make_IOT.
+    Input:
+    vagg, uagg      :   aggregated supply and use table (N_reg*N_sec square)
+    elec_rows       :   rows of the electricity products
+    market_products :   product ids of the exclusive byproduct markets
+    market_rows     :   list with, for every exclusive byproduct market, the
+                        rows of the byproduct in the regions where it is an
+                        exclusive byproduct
+    supply_diagonal :   diagonal of vagg
+    out_dir         :   directory for Z.npy and A.npy
+    memory_budget   :   memory for the column blocks in bytes
+    dtype           :   storage precision of Z and A
+
+    Output:
+    Z, A            :   read only memory maps of the main blocks of Z and A
+    main_diagonal   :   diagonal of the main supply table (V_markets)
+    electricity_grids:  V_elecmarkets, U_elecmarkets,
+                        elec_market_product_supply, elec_market_product_use
+    byproduct_markets:  v_market_excl_byproduct, u_market_excl_byproduct,
+                        excl_market_products_supply, excl_market_products_use
+    as in create_electricity_grids and create_excl_byprod_markets (dense).
+    """
+    _name = stream_model.__name__
+    n = N_reg*N_sec
+    n_regions = regions_per_block(memory_budget, N_reg, N_sec,
+                                  np.dtype(dtype).itemsize*MODEL_BUFFERS*n)
+    logger.info(LogMessage(_name, 'Building the IOT in column blocks of {} '
+                                  'regions'.format(n_regions)))
+    elec_rows = np.asarray(elec_rows, dtype=int)
+    n_markets = len(market_rows)
+    all_market_rows = np.concatenate(market_rows) if n_markets else\
+                      np.array([], dtype=int)
+    col_regions = np.arange(n)//N_sec
+    U_elecmarkets = np.zeros((n, N_reg))
+    elec_market_product_supply = np.zeros((N_reg, n))
+    elec_market_product_use = np.zeros((N_reg, n))
+    excl_market_products_supply = np.zeros((n_markets, n))
+    excl_market_products_use = np.zeros((n_markets, n))
+    #the principal production of the byproducts (in every region) supplies
+    #the global market
+    u_market_excl_byproduct = np.zeros((n, n_markets))
+    for i, product in enumerate(market_products):
+        product_rows = np.arange(product, n, N_sec)
+        u_market_excl_byproduct[product_rows, i] =\
+                                              supply_diagonal[product_rows]
+    v_market_excl_byproduct = u_market_excl_byproduct.sum(axis=0)
+    #principal production of the main table, the byproduct supply is moved to
+    #the markets
+    main_diagonal = supply_diagonal.copy()
+    main_diagonal[all_market_rows] = 0
+    x_dummy = main_diagonal.copy()
+    x_dummy[x_dummy == 0] = 1
+
+    Z = open_output(out_dir, 'Z', (n, n), dtype)
+    A = open_output(out_dir, 'A', (n, n), dtype)
+    for first, last in region_blocks(N_reg, n_regions):
+        start, stop = first*N_sec, last*N_sec
+        cols = np.arange(start, stop)
+        block_cols = np.arange(stop - start)
+        v_block = np.array(vagg[:, start:stop])
+        u_block = np.array(uagg[:, start:stop])
+        regions = col_regions[start:stop]
+        #electricity: bought from and sold to the national grids
+        u_elec = u_block[elec_rows, :]
+        U_elecmarkets[elec_rows, first:last] = u_elec.reshape(len(elec_rows),
+                                      last - first, N_sec).sum(axis=2,
+                                                               dtype=float)
+        elec_market_product_use[regions, cols] = u_elec.sum(axis=0,
+                                                            dtype=float)
+        v_block[cols, block_cols] = 0 #only off diagonal supply from here on
+        elec_market_product_supply[regions, cols] =\
+                              v_block[elec_rows, :].sum(axis=0, dtype=float)
+        #exclusive byproducts: bought from and sold to the global markets
+        for i, rows in enumerate(market_rows):
+            excl_market_products_use[i, start:stop] = u_block[rows, :].sum(
+                                                         axis=0, dtype=float)
+            excl_market_products_supply[i, start:stop] = v_block[rows, :].sum(
+                                                         axis=0, dtype=float)
+        for rows in (elec_rows, all_market_rows):
+            v_block[rows, :] = 0
+            u_block[rows, :] = 0
+        u_block -= v_block #Z = U - V + diag(V)
+        del v_block
+        Z[:, start:stop] = u_block
+        u_block /= x_dummy[start:stop]
+        A[:, start:stop] = u_block
+        del u_block
+    V_elecmarkets = U_elecmarkets.sum(axis=0)
+    return close_output(out_dir, 'Z', Z), close_output(out_dir, 'A', A),\
+           main_diagonal, (V_elecmarkets, U_elecmarkets,
+           elec_market_product_supply, elec_market_product_use),\
+           (v_market_excl_byproduct, u_market_excl_byproduct,
+           excl_market_products_supply, excl_market_products_use)
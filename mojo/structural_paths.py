@@ -0,0 +1,190 @@
+#structural_paths.py
+'''
+Structural path analysis (SPA) of the footprint f^T (I - A)^-1 y of a final
+demand y for direct intensities f, with the A matrix from
+system_model.make_IOT. A path j0 <- j1 <- ... <- jk runs upstream from a
+sector j0 in the final demand to its suppliers and contributes
+    f[jk] * A[jk,jk-1] * ... * A[j1,j0] * y[j0]
+to the footprint.
+
+The paths are enumerated best-first: the search always extends the path
+with the largest bound on everything upstream of it, which is the value of
+the path times the multiplier (total requirements) m = (I - A)^-T f of its
+last node. The multipliers are computed once, with a given LeontiefSolver or
+with GMRES (a single vector does not need a factorization), and the inputs of
+every node are read from a csc copy of A made once. Paths whose
+bound is below the threshold, or below the smallest of the best n_paths
+found so far, are pruned, so only a small part of the power series is
+visited.
+
+The bound is exact for non negative A. A from make_IOT has negative entries
+for the substituted byproducts; the absolute value of the bound is then
+used, which can prune a subtree whose parts cancel out.
+'''
+
+import heapq
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse.linalg as spla
+from mojo_logger import LogMessage
+from block_matrix import BlockMatrix
+from leontief import LeontiefSolver, leontief_matrix
+import sparse_utils
+
+
+class StructuralPathAnalysis(object):
+    """Structural path analysis for one vector of direct intensities.
+    Input:
+    A           :   coefficient matrix (dense, sparse or BlockMatrix)
+    intensities :   direct intensities f (e.g. emissions per unit output)
+    logger      :   logger instance
+    solver      :   LeontiefSolver of A to compute the multipliers with, if
+                    None they are computed with total_requirements
+    """
+
+    def __init__(self, A, intensities, logger, solver=None):
+        _name = StructuralPathAnalysis.__name__
+        self.logger = logger
+        if isinstance(A, BlockMatrix):
+            A = A.to_sparse('csc')
+        A = sparse_utils.as_format(A, 'csc')
+        A.eliminate_zeros()
+        #the inputs of node j are indices[indptr[j]:indptr[j+1]]
+        self.indptr, self.indices, self.data = A.indptr, A.indices,\
+                                               A.data.astype(float)
+        self.intensities = np.asarray(intensities, dtype=float).ravel()
+        if solver is None:
+            self.multipliers = total_requirements(A, self.intensities,
+                                                  logger)
+        else:
+            self.multipliers = np.asarray(solver.solve_transposed(
+                                          self.intensities)).ravel()
+        logger.info(LogMessage(_name, 'Structural path analysis of {} nodes '
+                                      'and {} edges'.format(A.shape[0],
+                                                            A.nnz)))
+
+    def footprint(self, y):
+        """Returns the total footprint m^T y of final demand y."""
+        return float(self.multipliers @ np.asarray(y, dtype=float).ravel())
+
+    def paths(self, y, n_paths=100, threshold=1e-4, max_depth=12,
+              max_expansions=10**6):
+        """Returns the n_paths paths with the largest (absolute) contribution
+        to the footprint of y.
+        Input:
+        y               :   final demand vector
+        n_paths         :   number of paths to return
+        threshold       :   paths with a bound below threshold times the
+                            total footprint are pruned
+        max_depth       :   maximum number of upstream steps
+        max_expansions  :   maximum number of paths that are extended
+
+        Output:
+        list of (contribution, path) tuples sorted by decreasing absolute
+        contribution, path is a tuple of node indices starting at the final
+        demand sector and going upstream.
+        """
+        _name = self.paths.__name__
+        start_time = time.time()
+        y = np.asarray(y, dtype=float).ravel()
+        total = self.footprint(y)
+        min_value = abs(threshold*total)
+        nodes, parents = [], [] #tree of the visited paths
+        best = [] #min heap of (|contribution|, id, contribution)
+        queue = [] #max heap of (-|bound|, id, value, depth)
+
+        def add(value, node, parent, depth):
+            bound = abs(value*self.multipliers[node])
+            if bound < min_value:
+                return
+            path_id = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            heapq.heappush(queue, (-bound, path_id, value, depth))
+            contribution = value*self.intensities[node]
+            if abs(contribution) >= min_value:
+                if len(best) < n_paths:
+                    heapq.heappush(best, (abs(contribution), path_id,
+                                          contribution))
+                elif abs(contribution) > best[0][0]:
+                    heapq.heapreplace(best, (abs(contribution), path_id,
+                                             contribution))
+
+        for node in np.nonzero(y)[0]:
+            add(y[node], node, -1, 0)
+        n_expanded = 0
+        while queue and n_expanded < max_expansions:
+            bound, path_id, value, depth = heapq.heappop(queue)
+            if len(best) == n_paths:
+                #nothing upstream can enter the top n_paths any more
+                min_value = max(min_value, best[0][0])
+            if -bound < min_value:
+                break
+            if depth == max_depth:
+                continue
+            n_expanded += 1
+            node = nodes[path_id]
+            inputs = slice(self.indptr[node], self.indptr[node+1])
+            values = value*self.data[inputs]
+            suppliers = self.indices[inputs]
+            keep = np.abs(values*self.multipliers[suppliers]) >= min_value
+            for supplier, supplier_value in zip(suppliers[keep],
+                                                values[keep]):
+                add(supplier_value, supplier, path_id, depth + 1)
+        result = sorted(((c, self._path(i, nodes, parents)) for _, i, c in
+                         best), key=lambda p: -abs(p[0]))
+        self.logger.info(LogMessage(_name, 'Found {} paths covering {:.1%} of '
+                                    'the footprint in {:.2f} s ({} paths '
+                                    'extended)'.format(len(result),
+                                    sum(c for c, p in result)/total if total
+                                    else 0, time.time()-start_time,
+                                    n_expanded)))
+        return result
+
+    @staticmethod
+    def _path(path_id, nodes, parents):
+        path = []
+        while path_id >= 0:
+            path.append(nodes[path_id])
+            path_id = parents[path_id]
+        return tuple(reversed(path))
+
+    def to_frame(self, paths, y, labels=None):
+        """Returns the paths as DataFrame with their rank, contribution,
+        share of the footprint of y, depth and nodes. labels is an optional
+        LabelTable (e.g. the row labels of create_model_labels) used to name
+        the nodes."""
+        total = self.footprint(y)
+        def name(node):
+            return str(node) if labels is None else\
+                   ' | '.join(str(x) for x in labels.label(node))
+        return pd.DataFrame({'rank': np.arange(1, len(paths)+1),
+                             'contribution': [c for c, p in paths],
+                             'share': [c/total if total else np.nan
+                                       for c, p in paths],
+                             'depth': [len(p)-1 for c, p in paths],
+                             'path': [' <- '.join(name(n) for n in p)
+                                      for c, p in paths]})
+
+
+def total_requirements(A, intensities, logger, tol=1e-10):
+    """Returns the multipliers m with (I - A)^T m = intensities, solved with
+    GMRES. If it does not converge I - A is factorized instead."""
+    _name = total_requirements.__name__
+    m, info = spla.gmres(leontief_matrix(A).T.tocsr(), intensities, rtol=tol,
+                         restart=50, maxiter=1000)
+    if info != 0:
+        logger.warning(LogMessage(_name, 'GMRES did not converge (info {}), '
+                                         'factorizing I - A'.format(info)))
+        m = LeontiefSolver(A, logger).solve_transposed(intensities)
+    return np.asarray(m).ravel()
+
+
+def share_through(paths, nodes, total):
+    """Returns the share of the footprint total carried by the paths that
+    pass through any of nodes (e.g. the columns of the electricity
+    markets)."""
+    nodes = set(int(n) for n in nodes)
+    through = sum(c for c, p in paths if nodes.intersection(p))
+    return through/total if total else 0.0
@@ -0,0 +1,151 @@
+#sut_cache.py
+'''
+Binary cache for the supply and use tables. Parsing the multi index csv
+files is slow, so the first time a table is read it is stored as .npy (dense)
+or .npz (sparse) file, with its labels in a json file next to it. Later runs
+read the binary file instead, dense tables are memory mapped.
+
+A cache entry is valid as long as the size and content hash (sha256) of the
+source file are unchanged. The hash is only recomputed if the modification
+time of the source file changed.
+'''
+
+import hashlib
+import json
+import os
+import numpy as np
+import scipy.sparse as sp
+from mojo_logger import LogMessage
+import sparse_utils
+
+CACHE_VERSION = 1
+
+
+def file_signature(p2f, with_hash=True, chunk_size=2**24):
+    """Returns the size, modification time and (optionally) the sha256 hash of
+    the file p2f as a dictionary."""
+    stat = os.stat(p2f)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if with_hash:
+        sha256 = hashlib.sha256()
+        with open(p2f, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+        signature['sha256'] = sha256.hexdigest()
+    return signature
+
+
+def cache_paths(p2f, cache_dir, matrix_format):
+    """Returns the paths of the data and meta data file of the cache entry
+    for source file p2f."""
+    base = os.path.join(cache_dir, os.path.basename(p2f))
+    ext = 'npy' if matrix_format == 'dense' else 'npz'
+    return '{}.{}.{}'.format(base, matrix_format, ext), base + '.json'
+
+
+def _read_meta(meta_p2f):
+    if not os.path.exists(meta_p2f):
+        return None
+    with open(meta_p2f) as f:
+        return json.load(f)
+
+
+def _write_meta(meta, meta_p2f):
+    tmp_p2f = meta_p2f + '.tmp'
+    with open(tmp_p2f, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_p2f, meta_p2f)
+
+
+def is_valid(p2f, cache_dir, matrix_format, logger):
+    """Checks whether the cache entry of p2f exists and belongs to the
+    current version of the source file. If only the modification time
+    changed the stored modification time is updated."""
+    _name = is_valid.__name__
+    data_p2f, meta_p2f = cache_paths(p2f, cache_dir, matrix_format)
+    meta = _read_meta(meta_p2f)
+    if meta is None or meta.get('version') != CACHE_VERSION or\
+       matrix_format not in meta['formats'] or not os.path.exists(data_p2f):
+        return False
+    signature = file_signature(p2f, with_hash=False)
+    if signature['size'] != meta['size']:
+        logger.info(LogMessage(_name, 'Size of {} changed'.format(p2f)))
+        return False
+    if signature['mtime'] == meta['mtime']:
+        return True
+    signature = file_signature(p2f)
+    if signature['sha256'] != meta['sha256']:
+        logger.info(LogMessage(_name, 'Content of {} changed'.format(p2f)))
+        return False
+    meta['mtime'] = signature['mtime'] #only touched, keep the cache
+    _write_meta(meta, meta_p2f)
+    return True
+
+
+def write_cache(p2f, cache_dir, table, matrix_format, logger):
+    """Writes the values of the pandas DataFrame table to the cache together
+    with its labels and the signature of the source file p2f."""
+    _name = write_cache.__name__
+    os.makedirs(cache_dir, exist_ok=True)
+    data_p2f, meta_p2f = cache_paths(p2f, cache_dir, matrix_format)
+    logger.info(LogMessage(_name, 'Writing cache {}'.format(data_p2f)))
+    values = sparse_utils.as_format(table.to_numpy(dtype=float),
+                                    matrix_format)
+    tmp_p2f = data_p2f + '.tmp'
+    with open(tmp_p2f, 'wb') as f:
+        if matrix_format == 'dense':
+            np.save(f, values)
+        else:
+            sp.save_npz(f, values, compressed=False)
+    os.replace(tmp_p2f, data_p2f)
+    meta = file_signature(p2f)
+    old_meta = _read_meta(meta_p2f)
+    formats = [matrix_format]
+    if old_meta is not None and old_meta.get('version') == CACHE_VERSION and\
+                               old_meta['sha256'] == meta['sha256']:
+        #other formats of the same source file remain valid
+        formats = sorted(set(old_meta['formats']) | set(formats))
+    meta.update({'version': CACHE_VERSION,
+                 'formats': formats,
+                 'shape': list(table.shape),
+                 'index': [list(x) for x in table.index],
+                 'columns': [list(x) for x in table.columns]})
+    _write_meta(meta, meta_p2f)
+    return values
+
+
+def read_cache(p2f, cache_dir, matrix_format):
+    """Reads a table from the cache. Dense tables are memory mapped
+    (read only)."""
+    data_p2f, _ = cache_paths(p2f, cache_dir, matrix_format)
+    if matrix_format == 'dense':
+        return np.load(data_p2f, mmap_mode='r')
+    return sp.load_npz(data_p2f).asformat(matrix_format)
+
+
+def read_labels(p2f, cache_dir):
+    """Returns the row and column labels of the cached table of p2f as lists
+    of tuples."""
+    _, meta_p2f = cache_paths(p2f, cache_dir, 'dense')
+    meta = _read_meta(meta_p2f)
+    return [tuple(x) for x in meta['index']],\
+           [tuple(x) for x in meta['columns']]
+
+
+def cached_table(p2f, cache_dir, read_table, logger, matrix_format='dense',
+                 rebuild=False):
+    """Returns the table of source file p2f from the cache, (re)building the
+    cache entry when it is missing, stale or when rebuild is True.
+    Input:
+    p2f             Path to the source file
+    cache_dir       Directory of the cache
+    read_table      Function reading p2f into a pandas DataFrame
+    matrix_format   'dense', 'csr' or 'csc'
+    rebuild         Force rebuilding the cache entry
+    """
+    _name = cached_table.__name__
+    if not rebuild and is_valid(p2f, cache_dir, matrix_format, logger):
+        logger.info(LogMessage(_name, 'Reading {} from cache'.format(p2f)))
+        return read_cache(p2f, cache_dir, matrix_format)
+    logger.info(LogMessage(_name, 'Building cache for {}'.format(p2f)))
+    return write_cache(p2f, cache_dir, read_table(p2f), matrix_format, logger)
@@ -5,216 +5,700 @@ BONSAI system model
 '''
 
 
-import pysut
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import os
 import argparse
 import configparser
+from contextlib import nullcontext
 import mojo_logger
 from mojo_logger import LogMessage
 import load_exiobase
+import load_entsoe
+import sut_cache
+import streaming
+import model_store
+import rdf_export
+import rdf_import
 import aggregation as agg
+from label_index import LabelIndex, LabelTable
+from block_matrix import BlockMatrix
+import sparse_utils
+from pipeline import Pipeline, Stage, StageCache
 
 
-def system_model(config,logger,log_dir):
+def system_model(config,logger,log_dir, rebuild_cache=False):
     '''
-    Function description
+    Runs the system model as a pipeline of stages (see model_stages). If
+    stage_cache_dir is set in the model_options of the config the outputs of
+    the stages are cached there and only the stages of which the inputs,
+    config or code changed are rerun.
+    If memory_budget is set in the model_options the model is built region
+    block by region block within that budget instead (see
+    streamed_system_model).
+    If model_output_dir is set in the model_options Z_model, A_model and
+    (when built in memory) the model supply and use table are written there
+    as model store (see model_store.py).
+    Returns the model IOT Z_model, A_model and the row and column labels.
     '''
     _name = system_model.__name__ #name for logging
     logger.info(LogMessage(_name, 'Starting the system model.'))
+    logger.info(LogMessage(_name, 'Using {} matrices'.format(
+                sparse_utils.check_format(config.get('model_options',
+                'matrix_format', fallback='dense')))))
+    profiler = None
+    if config.getboolean('model_options', 'profile', fallback=False):
+        profiler = mojo_logger.StageProfiler(
+                     mojo_logger.log_file_dir(logger, log_dir), logger,
+                     config.getboolean('model_options', 'profile_memory',
+                                       fallback=True),
+                     config.getboolean('model_options', 'profile_cprofile',
+                                       fallback=False))
+    pipeline = Pipeline(model_stages(log_dir, rebuild_cache), config, logger,
+                        get_stage_cache(config, logger), profiler)
+    pipeline.run('aggregation_report')
+    memory_budget = config.get('model_options', 'memory_budget',
+                               fallback='') #in GB, empty to work in memory
+    if memory_budget:
+        stream_dir = config.get('model_options', 'stream_dir', fallback='')\
+                     or os.path.join(log_dir, 'stream')
+        Z_model, A_model, row_labels, col_labels = streamed_system_model(
+                     pipeline, config, logger, float(memory_budget)*1e9,
+                     stream_dir, rebuild_cache, profiler)
+    else:
+        Z_model, A_model = pipeline.run('iot')
+        row_labels, col_labels = pipeline.run('model_labels')
+    output_dir = config.get('model_options', 'model_output_dir', fallback='')
+    if output_dir:
+        tables = {'Z': Z_model, 'A': A_model}
+        if memory_budget:
+            logger.warning(LogMessage(_name, 'The model supply and use table '
+                                      'are not kept when streaming, only Z '
+                                      'and A are written'))
+        else:
+            tables['V'], tables['U'] = pipeline.run('sut_model')
+        compression = config.get('model_options', 'model_output_compression',
+                                 fallback='') or 'none'
+        with _profile_stage(profiler, 'write_model'):
+            model_store.write_model(output_dir, tables, row_labels,
+                                    col_labels, logger, compression)
+    if profiler is not None:
+        logger.info(LogMessage(_name, 'Wrote the run profile to {}'.format(
+                                      profiler.write()[0])))
+    return Z_model, A_model, row_labels, col_labels
+
+
+def streamed_system_model(pipeline, config, logger, memory_budget,
+                          stream_dir, rebuild_cache=False, profiler=None):
+    """Builds the model IOT out of core for tables that do not fit in memory
+    (several times over). The supply and use tables are read as memory maps
+    and processed as a stream of column blocks of whole regions (see
+    streaming.py): the aggregated tables and the main blocks of Z and A are
+    written block by block to stream_dir and returned as read only memory
+    maps, only the market blocks are kept in memory. The names, aggregation
+    matrix and ENTSO-E mix are taken from the (cached) pipeline stages.
+    Input:
+    pipeline        :   Pipeline with the stages of model_stages
+    memory_budget   :   memory for the column blocks in bytes, which sets the
+                        number of regions per block
+    stream_dir      :   directory for the streamed tables
 
-    exio_v, exio_u = load_exiobase.get_sut(config.get('exio_data','ddir'),
+    Output:
+    Z_model, A_model:   BlockMatrix IOT, block (0,0) memory mapped
+    row_labels, col_labels
+    """
+    _name = streamed_system_model.__name__
+    logger.info(LogMessage(_name, 'Streaming the model in {} with a memory '
+                                  'budget of {:.2f} GB'.format(stream_dir,
+                                  memory_budget/1e9)))
+    iot_names, country_list, labels = pipeline.run('names')
+    aggregation_matrix, N_reg, N_prod, N_sec = pipeline.run(
+                                                     'aggregation_matrix')
+    exio_v, exio_u = _open_sut_stream(config, logger, rebuild_cache)
+    with _profile_stage(profiler, 'stream_aggregate'):
+        vagg, uagg, supply_totals, activity_totals, supply_diagonal =\
+                     streaming.stream_aggregate(exio_v, exio_u,
+                                                aggregation_matrix, stream_dir,
+                                                memory_budget, logger,
+                                                get_dtype(config))
+    del exio_v, exio_u
+    all_excl_byprods = iot_names.values[exclusive_byproduct_rows(
+                                        supply_totals, activity_totals)]
+    logger.info(LogMessage(_name, 'Found total of {} instances of an '
+                                  'exclusive byproduct'.format(
+                                  len(all_excl_byprods))))
+    excl_byproducts, market_names, grid_electricity, elec_markets =\
+           create_market_and_product_names(all_excl_byprods, N_reg,
+                                           country_list, logger)
+    #rows of the byproducts that are moved to the markets, as in
+    #create_excl_byprod_markets
+    prod_names = LabelTable.from_array(all_excl_byprods)
+    byprod_regions = labels.region_id(prod_names.column('Region'))
+    byprod_products = labels.product_id(prod_names.column('code 1'))
+    market_products = labels.product_id(excl_byproducts.column('code 1'))
+    market_rows = [byprod_regions[byprod_products == p]*N_sec + p
+                   for p in market_products]
+    with _profile_stage(profiler, 'stream_model'):
+        Z_main, A_main, main_diagonal, grids, markets =\
+                     streaming.stream_model(vagg, uagg, N_reg, N_sec,
+                                            np.where(labels.product_mask(
+                                            'p40.11'))[0], market_products,
+                                            market_rows, supply_diagonal,
+                                            stream_dir, memory_budget, logger,
+                                            get_dtype(config))
+    V_elecmarkets, U_elecmarkets, elec_market_product_supply,\
+           elec_market_product_use = grids
+    entsoe_mix = pipeline.run('entsoe_mix')
+    if entsoe_mix is not None:
+        U_elecmarkets = load_entsoe.update_electricity_mix(U_elecmarkets,
+                                                           entsoe_mix, logger)
+    #the market blocks with only the diagonal of the main block, which
+    #already is in Z_main and A_main
+    V_model, U_model = assemble_SUT(sp.diags(main_diagonal, format='csr'),
+                                    None, V_elecmarkets, U_elecmarkets,
+                                    elec_market_product_supply,
+                                    elec_market_product_use, *markets,
+                                    logger=logger)
+    Z_model, A_model = make_IOT(U_model, V_model, logger)
+    row_labels, col_labels = create_model_labels(iot_names, grid_electricity,
+                                                 elec_markets, excl_byproducts,
+                                                 market_names)
+    return Z_model.replace_block(0, 0, Z_main),\
+           A_model.replace_block(0, 0, A_main), row_labels, col_labels
+
+
+def _open_sut_stream(config, logger, rebuild_cache=False):
+    """Returns the supply and use table for streaming: read only memory maps
+    of the dense binary cache (see sut_cache), or csc matrices for the long
+    format supply table and the RDF dump. Without cache_dir the tables are
+    read into memory."""
+    _name = _open_sut_stream.__name__
+    if config.get('exio_data', 'rdf_dump', fallback=''):
+        return _read_rdf_sut(config, logger, 'csc')
+    ddir = config.get('exio_data', 'ddir')
+    cache_dir = config.get('exio_data', 'cache_dir', fallback='')
+    if not cache_dir:
+        logger.warning(LogMessage(_name, 'No cache_dir set, reading the '
+                                         'supply and use tables into memory'))
+    tables = {}
+    for option, table_name in (('supply', 'Supply'), ('use', 'Use')):
+        if option == 'supply' and config.get('exio_data', 'supply_long',
+                                             fallback=''):
+            tables[option] = load_exiobase.get_long_supply(ddir,
+                                 config.get('exio_data', 'supply_long'),
+                                 config.get('exio_data', 'aggregated_names'),
+                                 config.get('exio_data', 'aggregation_matrix'),
+                                 logger, 'csc')
+            continue
+        file_name = config.get('exio_data', option)
+        table = load_exiobase.get_table(ddir, file_name, table_name, logger,
+                                        'dense', cache_dir, rebuild_cache)
+        if cache_dir and not isinstance(table, np.memmap):
+            del table #the cache was just built, read it back as memory map
+            table = sut_cache.read_cache(os.path.join(ddir, file_name),
+                                         cache_dir, 'dense')
+        tables[option] = table
+    return tables['supply'], tables['use']
+
+
+def _profile_stage(profiler, name):
+    """Returns profiler.stage(name), or a context that does nothing if
+    profiler is None."""
+    return nullcontext() if profiler is None else profiler.stage(name)
+
+
+def get_stage_cache(config, logger):
+    """Returns the StageCache set by stage_cache_dir and stage_cache_size in
+    the model_options of the config, None if no cache directory is set."""
+    stage_cache_dir = config.get('model_options', 'stage_cache_dir',
+                                 fallback='')
+    if not stage_cache_dir:
+        return None
+    max_size = config.get('model_options', 'stage_cache_size',
+                          fallback='') #in GB, empty for no limit
+    logger.info(LogMessage(get_stage_cache.__name__, 'Caching stage outputs '
+                                                     'in {}'.format(
+                                                     stage_cache_dir)))
+    return StageCache(stage_cache_dir,
+                      float(max_size)*1e9 if max_size else None)
+
+
+def model_stages(log_dir, rebuild_cache=False):
+    """Returns the stages of the system model for pipeline.Pipeline. The
+    output of a stage is cached under a key made from the listed config keys,
+    data files, code and the keys of its input stages. The code includes the
+    functions called by the listed ones (see pipeline.code_closure); classes
+    of which only instances are passed in (LabelIndex) are listed."""
+    exio_files = [('exio_data', 'supply'), ('exio_data', 'use'),
+                  ('exio_data', 'supply_long'), ('exio_data', 'rdf_dump')]
+    return [
+        Stage('sut', _load_sut_stage, files=exio_files,
+              config_keys=[('model_options', 'matrix_format'),
+                           ('model_options', 'dtype'),
+                           ('exio_data', 'supply'), ('exio_data', 'use'),
+                           ('exio_data', 'supply_long'),
+                           ('exio_data', 'rdf_dump'),
+                           ('exio_data', 'aggregated_names'),
+                           ('exio_data', 'aggregation_matrix')] +
+                          [('rdf_export', key) for key in
+                           rdf_export.VOCABULARY],
+              code=[_load_sut_stage, load_exiobase.get_sut,
+                    load_exiobase.get_table, load_exiobase.get_long_supply,
+                    load_exiobase.get_rdf_sut, rdf_import.SutReader],
+              kwargs={'rebuild_cache': rebuild_cache},
+              cache=False), #see sut_cache, pickling would read the memory
+                            #maps of the binary cache into memory
+        Stage('names', _names_stage,
+              files=[('exio_data', 'aggregated_names')],
+              config_keys=[('exio_data', 'aggregated_names')],
+              code=[_names_stage, load_exiobase.get_aggregated_product_names,
+                    LabelIndex]),
+        Stage('aggregation_matrix', _aggregation_matrix_stage,
+              files=[('exio_data', 'aggregation_matrix'),
+                     ('exio_data', 'calvals_matrix')],
+              config_keys=[('exio_data', 'aggregation_matrix'),
+                           ('exio_data', 'calvals_matrix')],
+              code=[_aggregation_matrix_stage, agg.get_aggregation_matrix,
+                    agg.BlockAggregationMatrix]),
+        Stage('aggregation_report', _aggregation_report_stage,
+              inputs=['aggregation_matrix'],
+              files=[('exio_data', 'aggregation_matrix'),
+                     ('exio_data', 'calvals_matrix')],
+              config_keys=[('exio_data', 'aggregation_matrix'),
+                           ('exio_data', 'calvals_matrix'),
+                           ('project_info', 'aggregation_report_file')],
+              code=[_aggregation_report_stage, agg.write_aggregation_report],
+              kwargs={'log_dir': log_dir},
+              cache=False), #a side effect, written on every run
+        Stage('aggregate', _aggregate_stage,
+              inputs=['sut', 'aggregation_matrix'],
+              code=[_aggregate_stage, agg.aggregate,
+                    agg.BlockAggregationMatrix]),
+        Stage('byproducts', _byproducts_stage,
+              inputs=['aggregate', 'names', 'aggregation_matrix'],
+              code=[_byproducts_stage, get_exclusive_byproducts,
+                    exclusive_byproduct_rows, sparse_utils.row_and_column_sums,
+                    create_market_and_product_names, LabelTable]),
+        Stage('model_labels', _model_labels_stage,
+              inputs=['names', 'byproducts'],
+              code=[_model_labels_stage, create_model_labels, LabelTable],
+              cache=False),
+        Stage('entsoe_mix', _entsoe_mix_stage, inputs=['names'],
+              files=[('entsoe_data', 'supply'), ('entsoe_data', 'use'),
+                     ('entsoe_data', 'products'),
+                     ('entsoe_data', 'activities'),
+                     ('entsoe_data', 'bentso_store')],
+              config_keys=[('entsoe_data', 'update_grid_mix'),
+                           ('entsoe_data', 'ddir'), ('entsoe_data', 'supply'),
+                           ('entsoe_data', 'use'), ('entsoe_data', 'products'),
+                           ('entsoe_data', 'activities'),
+                           ('entsoe_data', 'bentso_store'),
+                           ('entsoe_data', 'year')],
+              code=[_entsoe_mix_stage, load_entsoe.get_entsoe,
+                    load_entsoe.get_generation,
+                    load_entsoe.get_bentso_generation,
+                    load_entsoe.get_concordance, load_entsoe.get_grid_mix,
+                    LabelIndex]),
+        Stage('electricity_grids', _electricity_grids_stage,
+              inputs=['aggregate', 'names', 'aggregation_matrix',
+                      'entsoe_mix'],
+              code=[_electricity_grids_stage, create_electricity_grids,
+                    _create_sparse_electricity_grids,
+                    load_entsoe.update_electricity_mix, LabelIndex]),
+        Stage('byproduct_markets', _byproduct_markets_stage,
+              inputs=['electricity_grids', 'byproducts', 'names',
+                      'aggregation_matrix'],
+              code=[_byproduct_markets_stage, create_excl_byprod_markets,
+                    LabelIndex]),
+        Stage('sut_model', _sut_model_stage,
+              inputs=['electricity_grids', 'byproduct_markets'],
+              code=[_sut_model_stage, assemble_SUT], cache=False),
+        Stage('iot', _iot_stage, inputs=['sut_model'],
+              code=[_iot_stage, make_IOT, _make_block_IOT]),
+        ]
+
+
+#The stage functions of model_stages, called as
+#func(config, logger, *outputs of the input stages)
+def _load_sut_stage(config, logger, rebuild_cache=False):
+    matrix_format = sparse_utils.check_format(config.get('model_options',
+                                     'matrix_format', fallback='dense'))
+    dtype = get_dtype(config)
+    cache_dir = config.get('exio_data', 'cache_dir', fallback='')
+    if config.get('exio_data', 'rdf_dump', fallback=''):
+        exio_v, exio_u = _read_rdf_sut(config, logger, matrix_format)
+    elif config.get('exio_data', 'supply_long', fallback=''):
+        #read the supply table directly from the long format
+        exio_v = load_exiobase.get_long_supply(config.get('exio_data','ddir'),
+                                   config.get('exio_data','supply_long'),
+                                   config.get('exio_data', 'aggregated_names'),
+                                   config.get('exio_data','aggregation_matrix'),
+                                   logger, matrix_format)
+        exio_u = load_exiobase.get_table(config.get('exio_data','ddir'),
+                                   config.get('exio_data','use'), 'Use',
+                                   logger, matrix_format, cache_dir,
+                                   rebuild_cache)
+    else:
+        exio_v, exio_u = load_exiobase.get_sut(config.get('exio_data','ddir'),
                                    config.get('exio_data','supply'),
-                                   config.get('exio_data','use'), logger)
+                                   config.get('exio_data','use'), logger,
+                                   matrix_format, cache_dir, rebuild_cache)
+    #all later tables keep the storage precision of the SUT
+    return sparse_utils.as_dtype(exio_v, dtype),\
+           sparse_utils.as_dtype(exio_u, dtype)
+
+
+def _read_rdf_sut(config, logger, matrix_format):
+    """Returns the supply and use table of the RDF dump rdf_dump of the
+    exio_data section of the config."""
+    return load_exiobase.get_rdf_sut(config.get('exio_data', 'ddir'),
+                           config.get('exio_data', 'rdf_dump'),
+                           config.get('exio_data', 'aggregated_names'),
+                           config.get('exio_data', 'aggregation_matrix'),
+                           logger, matrix_format,
+                           rdf_export.get_options(config))
+
+
+def get_dtype(config):
+    """Returns the storage precision of the supply, use and IOT tables set by
+    dtype in the model_options of the config (float64 by default)."""
+    return sparse_utils.check_dtype(config.get('model_options', 'dtype',
+                                               fallback='') or 'float64')
+
+
+def _names_stage(config, logger):
     iot_names, country_dic, prod_dic, country_list = load_exiobase.\
                                  get_aggregated_product_names(
                                  config.get('exio_data','ddir'),
                                  config.get('exio_data', 'aggregated_names'),
                                  logger)
-    
-    aggregation_matrix, N_reg, N_prod, N_sec = agg.get_aggregation_matrix(
-                                  config.get('exio_data','ddir'),
+    labels = LabelIndex(iot_names) #integer index of the labels used by all
+    #stages instead of looking up strings
+    return iot_names, country_list, labels
+
+
+def _aggregation_matrix_stage(config, logger):
+    #the report is written by the aggregation_report stage
+    return agg.get_aggregation_matrix(config.get('exio_data','ddir'),
                                   config.get('exio_data','aggregation_matrix'),
                                   config.get('exio_data','calvals_matrix'),
-                                  log_dir, config.get('project_info',
-                                  'aggregation_report_file'), logger)
-    exio_vagg, exio_uagg = agg.aggregate(exio_v, exio_u, aggregation_matrix,
-                                         logger)
-    all_excl_byprods = get_exclusive_byproducts(exio_vagg, exio_uagg,
-                            N_reg, iot_names, logger)
-    excl_byproducts, market_names, grid_electricity, elec_markets =\
-           create_market_and_product_names(all_excl_byprods, N_reg,
-           country_list, logger)
+                                  '', '', logger)
+
+
+def _aggregation_report_stage(config, logger, aggregation, log_dir):
+    agg.write_aggregation_report(config.get('exio_data','ddir'),
+                                 config.get('exio_data','aggregation_matrix'),
+                                 config.get('exio_data','calvals_matrix'),
+                                 aggregation[0], log_dir,
+                                 config.get('project_info',
+                                            'aggregation_report_file'),
+                                 logger)
 
 
-    V_without_elec, U_without_elec, V_elecmarkets, U_elecmarkets,\
-           elec_market_product_supply, elec_market_product_use =\
-           create_electricity_grids(exio_vagg, exio_uagg, N_reg,
-                                    N_sec, iot_names, logger)
+def _aggregate_stage(config, logger, sut, aggregation):
+    exio_v, exio_u = sut
+    return agg.aggregate(exio_v, exio_u, aggregation[0], logger)
 
+
+def _byproducts_stage(config, logger, aggregated, names, aggregation):
+    exio_vagg, exio_uagg = aggregated
+    iot_names, country_list, labels = names
+    N_reg = aggregation[1]
+    all_excl_byprods = iot_names.values[get_exclusive_byproducts(exio_vagg,
+                                                                 logger)]
+    excl_byproducts, market_names, grid_electricity, elec_markets =\
+           create_market_and_product_names(all_excl_byprods, N_reg,
+           country_list, logger)
+    return all_excl_byprods, excl_byproducts, market_names, grid_electricity,\
+           elec_markets
+
+
+def _model_labels_stage(config, logger, names, byproducts):
+    all_excl_byprods, excl_byproducts, market_names, grid_electricity,\
+           elec_markets = byproducts
+    return create_model_labels(names[0], grid_electricity, elec_markets,
+                               excl_byproducts, market_names)
+
+
+def _entsoe_mix_stage(config, logger, names):
+    if not config.getboolean('entsoe_data', 'update_grid_mix',
+                             fallback=False):
+        return None
+    if config.get('entsoe_data', 'bentso_store', fallback=''):
+        #annual generation from the hourly bentso data
+        generation, activities = load_entsoe.get_bentso_generation(
+                                     config.get('entsoe_data', 'bentso_store'),
+                                     config.get('entsoe_data', 'year'), logger)
+    else:
+        supply, use, products, activities = load_entsoe.get_entsoe(
+                                     config.get('entsoe_data', 'ddir'),
+                                     config.get('entsoe_data', 'supply'),
+                                     config.get('entsoe_data', 'use'),
+                                     config.get('entsoe_data', 'products'),
+                                     config.get('entsoe_data', 'activities'),
+                                     logger)
+        generation = load_entsoe.get_generation(supply)
+    product_concordance, region_concordance = load_entsoe.get_concordance(
+                                     activities, names[2], logger)
+    return load_entsoe.get_grid_mix(generation, product_concordance,
+                                    region_concordance)
+
+
+def _electricity_grids_stage(config, logger, aggregated, names, aggregation,
+                             entsoe_mix):
+    exio_vagg, exio_uagg = aggregated
+    aggregation_matrix, N_reg, N_prod, N_sec = aggregation
+    grids = create_electricity_grids(exio_vagg, exio_uagg, N_reg, N_sec,
+                                     names[2], logger)
+    if entsoe_mix is None:
+        return grids
+    grids = list(grids)
+    grids[3] = load_entsoe.update_electricity_mix(grids[3], entsoe_mix, logger)
+    return tuple(grids)
+
+
+def _byproduct_markets_stage(config, logger, electricity_grids, byproducts,
+                             names, aggregation):
+    V_without_elec, U_without_elec = electricity_grids[:2]
+    all_excl_byprods, excl_byproducts = byproducts[:2]
+    N_sec = aggregation[3]
+    return create_excl_byprod_markets(V_without_elec, U_without_elec,
+                                      excl_byproducts, all_excl_byprods, N_sec,
+                                      names[2], logger)
+
+
+def _sut_model_stage(config, logger, electricity_grids, byproduct_markets):
+    V_elecmarkets, U_elecmarkets, elec_market_product_supply,\
+           elec_market_product_use = electricity_grids[2:]
     V_markets, U_markets, v_market_excl_byproduct,\
            u_market_excl_byproduct, excl_market_products_supply,\
-           excl_market_products_use = create_excl_byprod_markets(
-           V_without_elec, U_without_elec, excl_byproducts, prod_dic,
-           country_dic, all_excl_byprods, N_sec, iot_names, logger)
+           excl_market_products_use = byproduct_markets
+    return assemble_SUT(V_markets, U_markets, V_elecmarkets, U_elecmarkets,
+                        elec_market_product_supply, elec_market_product_use,
+                        v_market_excl_byproduct, u_market_excl_byproduct,
+                        excl_market_products_supply, excl_market_products_use,
+                        logger)
 
-    V_model, U_model = assemble_SUT(V_markets, U_markets,
-                                    V_elecmarkets,
-                                    U_elecmarkets,
-                                    elec_market_product_supply,
-                                    elec_market_product_use,
-                                    v_market_excl_byproduct,
-                                    u_market_excl_byproduct,
-                                    excl_market_products_supply,
-                                    excl_market_products_use,
-                                    logger)
-    
-    Z_model, A_model = make_IOT(V_model, U_model, logger)
+
+def _iot_stage(config, logger, sut_model):
+    V_model, U_model = sut_model
+    return make_IOT(U_model, V_model, logger)
 
 
-    #check if for the existence of exclusive byproducts
-def get_exclusive_byproducts(v,u,N_reg, product_names, logger):
-    """Function checks for exclusive byproducts and returns them in an
-    array.
+def get_exclusive_byproducts(v, logger):
+    """Finds the exclusive byproducts: products that are supplied (as
+    secondary production of other activities) in a region where the
+    activity of which they are the principal product does not produce
+    anything. The row and column totals of the supply table are computed in
+    one pass over v, which can be dense, memory mapped or sparse.
     Input:
-    v               : numpy array containing the supply table
-    u               : numpy array containing the use table
-    N_regions       : number of regions in the MRIO
-    product_names   : Pandas dataframe with the product names in the aggregated
-                      SUTs.
+    v               : (square) supply table (products x activities)
 
     Output:
-    excl_byprod_names   :   numpy array with a list of exclusive by products
-                            The same product miight show up multiple times but
-                            for different regions
+    excl_byprod_rows    :   integer array with the rows of the exclusive
+                            byproducts. The same product might show up
+                            multiple times but for different regions
     """
     _name = get_exclusive_byproducts.__name__ #function name for logging
     logger.info(LogMessage(_name, 'Checking for exclusive by products'))
-    SUT_obj = pysut.SupplyUseTable(V=v, U=u, regions=N_reg)
-    supply_diag_check_eval = SUT_obj.supply_diag_check()
-    excl_byprod_names = product_names.values[supply_diag_check_eval[:,2]==1,:]
-    nr_excl_byprods = len(excl_byprod_names)
+    supply_totals, activity_totals = sparse_utils.row_and_column_sums(v)
+    excl_byprod_rows = exclusive_byproduct_rows(supply_totals,
+                                                activity_totals)
+    nr_excl_byprods = len(excl_byprod_rows)
     if nr_excl_byprods == 0:
         logger.info(LogMessage(_name,'No exclusive byproducts found'))
     else:
-        logger.info(LogMessage(_name, 'Found total of {} instances of an'\
+        logger.info(LogMessage(_name, 'Found total of {} instances of an '\
                                       'exclusive byproduct'.format(
                                       nr_excl_byprods)))
-    return excl_byprod_names
+    return excl_byprod_rows
+
+
+def exclusive_byproduct_rows(supply_totals, activity_totals):
+    """Returns the rows of the products with non zero total supply
+    (supply_totals, row totals of V) of which the principal activity has no
+    output (activity_totals, column totals of V)."""
+    return np.where((supply_totals != 0) & (activity_totals == 0))[0]
 
 def create_market_and_product_names(prod_names, N_reg, Reg_list, logger):
     """Create market names, and product names.
     Input:
-    prod_names      :   array of exclusive byproducts (this should include at
-                        at least one electricity byproduct e.g. electricity
-                        from coal (as byproduct from heat from coal).
+    prod_names      :   LabelTable (or array) of exclusive byproducts (this
+                        should include at least one electricity byproduct
+                        e.g. electricity from coal (as byproduct from heat
+                        from coal).
     N_reg           :   number of regions in the MRIO system
     
     Output:
-    excl_byproducts :   array of exclusive byproducts (excl electricity)
-    market_names    :   array of market names corresponding to the excl byprods
-    grid_electricity:   array of 'Electricity from grid' names for the different
-                        regions. i.e. 1 entry for each electricity market
+    excl_byproducts :   LabelTable of exclusive byproducts (excl electricity)
+    market_names    :   LabelTable of market names corresponding to the excl
+                        byprods
+    grid_electricity:   LabelTable of 'Electricity from grid' names for the
+                        different regions. i.e. 1 entry for each electricity
+                        market
     elec_markets    :   Like grid_electricity but now "Market for electricity"
 
-    All outputs have the format [['Region', 'Name', 'code 1', 'code 2', 'unit']]
+    All outputs have the columns ['Region', 'Name', 'code 1', 'code 2', 'unit']
     where the unit only exists for the products not for the markets.
     """
     _name = create_market_and_product_names.__name__
     logger.info(LogMessage(_name, 'Creating name arrays for markets and'\
                                    'and their products'))
+    if not isinstance(prod_names, LabelTable):
+        prod_names = LabelTable.from_array(prod_names)
     #get a unique list of the product names to create global markets
-    unique_prod_indices = np.unique(prod_names[:,1], return_index=True)[-1]
-    excl_byproducts = prod_names[unique_prod_indices]
-    #print(market_names)
-    market_names = excl_byproducts.copy()
-    market_names[:,0] = 'GLO' #set the region to global
+    excl_byproducts = prod_names.unique('Name')
     #now change the names of the products to Market for 'product', incl codes.
-    #also remove the electricity from the excl_byproducts
-    rm_index = []
-    for i,prod in enumerate(excl_byproducts):
-        market_names[i,1] = 'Market for ' + market_names[i,1]
-        market_names[i,2] = market_names[i,2].replace('p','m')
-        market_names[i,3] = market_names[i,3].replace('C_','M_')
-        #there are multiple electricity byproducts. they supplyt the same market
-        #so give them the same code/market name
-        if 'm40.11' in market_names[i,2]:
-            market_names[i,2] = 'm40.11'
-            market_names[i,1] = 'Market for electricity'
-            market_names[i,3] = 'M_ELEC'
-        if 'p40.11.' in prod[2]:
-            rm_index.append(i)
+    #The names are changed once per distinct value, not per row.
+    market_names = excl_byproducts.assign('Region', 'GLO') #set the region to
+    #global
+    market_names = market_names.map('Name', lambda x: 'Market for ' + x)
+    market_names = market_names.map('code 1',
+                                lambda x: x.str.replace('p','m', regex=False))
+    market_names = market_names.map('code 2',
+                                lambda x: x.str.replace('C_','M_', regex=False))
+    #there are multiple electricity byproducts. they supplyt the same market
+    #so give them the same code/market name
+    elec = market_names.contains('code 1', 'm40.11')
+    market_names = market_names.assign('code 1', 'm40.11', elec)
+    market_names = market_names.assign('Name', 'Market for electricity', elec)
+    market_names = market_names.assign('code 2', 'M_ELEC', elec)
     #remove electricity from excl byproducts
-    excl_byproducts = np.delete(excl_byproducts, np.array(rm_index), axis=0)
+    excl_byproducts = excl_byproducts[~excl_byproducts.contains('code 1',
+                                                                'p40.11.')]
     #drop the duplicate electricity markets
-    market_name_indices = np.unique(market_names[:,1], return_index=True)[-1]
-    market_names = market_names[market_name_indices]
+    market_names = market_names.unique('Name')
     #split the markets into exclusive byproduct markets and electricity markets
-    elec_markets = np.array([x for x in market_names if x[2]=='m40.11']*N_reg).\
-                                                                reshape(N_reg,5)
-    elec_markets[:,0] = Reg_list
-    market_names = np.delete(market_names,
-                             np.where(market_names[:,2]=='m40.11')[0], axis=0)
+    elec = market_names.equals('code 1', 'm40.11')
+    elec_markets = market_names[np.repeat(np.where(elec)[0], N_reg)]
+    elec_markets = elec_markets.assign('Region', Reg_list)
+    market_names = market_names[~elec]
     #create electricity market products ('Electricity from the grid')
-    grid_electricity = elec_markets.copy()
-    for i in range(len(elec_markets)):
-        grid_electricity[i,1] = 'Electricity from the grid'
-        grid_electricity[i,2] = grid_electricity[i,2].replace('m','p')
-        grid_electricity[i,3] = grid_electricity[i,3].replace('M_','C_',)
+    grid_electricity = elec_markets.assign('Name', 'Electricity from the grid')
+    grid_electricity = grid_electricity.map('code 1',
+                                lambda x: x.str.replace('m','p', regex=False))
+    grid_electricity = grid_electricity.map('code 2',
+                                lambda x: x.str.replace('M_','C_', regex=False))
     #drop units for markets:
-    elec_markets = elec_markets[:,:-1]
-    market_names = market_names[:,:-1]
+    elec_markets = elec_markets.drop('unit')
+    market_names = market_names.drop('unit')
     return excl_byproducts, market_names, grid_electricity, elec_markets
 
 
-def create_electricity_grids(exio_vagg, exio_uagg, N_reg, N_prod, iot_names,
+def create_model_labels(iot_names, grid_electricity, elec_markets,
+                        excl_byproducts, market_names):
+    """Returns the row (product) and column (activity) labels of the final
+    model tables V_model, U_model and A_model as LabelTables, in the order
+    used by assemble_SUT: the aggregated table, the electricity markets and
+    the exclusive byproduct markets. The products of the byproduct markets are
+    the byproducts from the global (GLO) market.
+    """
+    products = LabelTable.from_array(iot_names[['Country code', 'Product name',
+                                     'Product code 1', 'Product code 2',
+                                     'Unit']].values)
+    market_products = excl_byproducts.assign('Region', 'GLO')
+    row_labels = products.concat(grid_electricity, market_products)
+    col_labels = products.drop('unit').concat(elec_markets, market_names)
+    return row_labels, col_labels
+
+
+def create_electricity_grids(exio_vagg, exio_uagg, N_reg, N_prod, labels,
                              logger):
     _name = create_electricity_grids.__name__ #function name for logging
     logger.info(LogMessage(_name, 'Creating electricity grid for the {}\
                                    regions'.format(N_reg)))
-    U_without_elec = exio_uagg.copy()
-    V_without_elec = exio_vagg.copy()
-    diag_dummy_indices = np.arange(V_without_elec.shape[0])
-    V_without_elec[diag_dummy_indices, diag_dummy_indices] = 0 #set to zero for
-    #principle production so we can sum off diagonal electricity
-    
-    V_elecmarkets = np.zeros(N_reg) #These are the totals of the
+    if sp.issparse(exio_uagg):
+        return _create_sparse_electricity_grids(exio_vagg, exio_uagg, N_reg,
+                                                N_prod, labels)
+    n_rows, n_cols = exio_uagg.shape
+    elec_indices = labels.product_mask('p40.11') #boolean array with the
+    #electricity commodities
+    elec_rows = np.where(elec_indices)[0]
+    n_elec = len(elec_rows)
+    #all regions at once on a (rows, N_reg, N_prod) view of the column blocks
+    u_elec = exio_uagg[elec_indices,:]
+    u_elec_regions = u_elec.reshape(n_elec, N_reg, N_prod)
+    v_elec = exio_vagg[elec_indices,:]
+    v_elec[np.arange(n_elec), elec_rows] = 0 #set to zero for principle
+    #production so we can sum off diagonal electricity
+    regions = np.arange(N_reg)
+
+    U_elecmarkets = np.zeros((n_rows,N_reg)) #This
+    #defines the electricity mix in a national grid. This will be updated with
+    #entso data. Format (N_prod*N_reg x N_reg)
+    U_elecmarkets[elec_indices,:] = u_elec_regions.sum(axis=2, dtype=float)
+    V_elecmarkets = U_elecmarkets.sum(axis=0) #These are the totals of the
     #electricity used in a country, as this is the total that a national grid
     #will provide. Format is (N_reg x 1), will be diagonalized in
     #final V' table
-    U_elecmarkets = np.zeros((exio_uagg.shape[0],N_reg)) #This
-    #defines the electricity mix in a national grid. This will be updated with
-    #entso data. Format (N_prod*N_reg x N_reg)
-    elec_indices = iot_names['Product code 1'].str.contains('p40.11').values
-    #boolean array with the electricity commodities
-    elec_market_product_use = np.zeros((N_reg, exio_uagg.shape[0])) #The input
+    elec_market_product_use = np.zeros((N_reg, n_cols)) #The input
     #vector for grid electricity for the different activities, as they now draw
-    #from the grid instead of directly from producers.
-    #Format (N_reg, N_reg*N_products+N_reg)
-    elec_market_product_supply = np.zeros((N_reg, exio_uagg.shape[0]))
-    
-    for i in range(N_reg): #loop over countries
-        U_elecmarkets[elec_indices,i] = exio_uagg[elec_indices,
-                                           i*N_prod:i*N_prod+N_prod].sum(axis=1)
-        V_elecmarkets[i] = U_elecmarkets[elec_indices,i].sum()
-        elec_market_product_use[i,i*N_prod:i*N_prod+N_prod] = exio_uagg[
-                              elec_indices,i*N_prod:i*N_prod+N_prod].sum(axis=0)
-        elec_market_product_supply[i,i*N_prod:i*N_prod+N_prod] =\
-               V_without_elec[elec_indices,i*N_prod:i*N_prod+N_prod].sum(axis=0)
-        V_without_elec[elec_indices,i*N_prod:i*N_prod+N_prod] = 0
-    
-    V_without_elec[diag_dummy_indices, diag_dummy_indices] = exio_vagg[
-                                         diag_dummy_indices, diag_dummy_indices]
-    U_without_elec[elec_indices,:] = 0 #is the new partial Use table where
+    #from the grid instead of directly from producers. Only the block of the
+    #own region is filled. Format (N_reg, N_reg*N_products)
+    elec_market_product_use.reshape(N_reg, N_reg, N_prod)[regions,regions,:] =\
+                                     u_elec_regions.sum(axis=0, dtype=float)
+    elec_market_product_supply = np.zeros((N_reg, n_cols))
+    elec_market_product_supply.reshape(N_reg, N_reg, N_prod)[
+                    regions,regions,:] = v_elec.sum(axis=0, dtype=float
+                                                    ).reshape(N_reg, N_prod)
+
+    #only the electricity rows are overwritten in the copies, keeping the
+    #principle production of electricity
+    V_without_elec = np.array(exio_vagg)
+    V_without_elec[elec_rows,:] = 0
+    V_without_elec[elec_rows, elec_rows] = exio_vagg[elec_rows, elec_rows]
+    U_without_elec = np.array(exio_uagg) #is the new partial Use table where
     #electricity use from producers has been set to 0
+    U_without_elec[elec_rows,:] = 0
     return V_without_elec, U_without_elec, V_elecmarkets, U_elecmarkets,\
            elec_market_product_supply, elec_market_product_use
 
-def create_excl_byprod_markets(v, u, excl_byproducts, prod_dic, country_dic,
-                               prod_names, N_prod, iot_names, logger):
+def _create_sparse_electricity_grids(exio_vagg, exio_uagg, N_reg, N_prod,
+                                     labels):
+    """Sparse version of create_electricity_grids. Instead of looping over
+    the regions the region blocks of the columns are summed with a sparse
+    (N_reg*N_prod x N_reg) region indicator matrix. All matrix outputs are
+    returned in the format of exio_uagg, the vectors as numpy arrays."""
+    matrix_format = sparse_utils.get_format(exio_uagg)
+    n_cols = exio_uagg.shape[1]
+    elec_indices = labels.product_mask('p40.11')
+    col_regions = np.arange(n_cols)//N_prod
+    region_indicator = sp.csr_matrix((np.ones(n_cols),
+                                     (np.arange(n_cols), col_regions)),
+                                     shape=(n_cols, N_reg))
+    #only keep the electricity rows and sum them per region
+    U_elecmarkets = (sparse_utils.zero_rows(exio_uagg, ~elec_indices) @
+                     region_indicator).asformat(matrix_format)
+    V_elecmarkets = sparse_utils.flat_sum(U_elecmarkets, 0)
+    #electricity use of every activity, now bought from its national grid
+    elec_use = sparse_utils.flat_sum(exio_uagg[elec_indices,:], 0)
+    elec_market_product_use = sp.csr_matrix((elec_use,
+                                       (col_regions, np.arange(n_cols))),
+                                       shape=(N_reg, n_cols)).asformat(
+                                       matrix_format)
+    #off diagonal (secondary) electricity production, supplied to the grid
+    v_diag = exio_vagg.diagonal()
+    v_offdiag = exio_vagg - sp.diags(v_diag, dtype=v_diag.dtype)
+    elec_supply = sparse_utils.flat_sum(v_offdiag[elec_indices,:], 0)
+    elec_market_product_supply = sp.csr_matrix((elec_supply,
+                                       (col_regions, np.arange(n_cols))),
+                                       shape=(N_reg, n_cols)).asformat(
+                                       matrix_format)
+    #remove the electricity rows but keep principle production
+    V_without_elec = (sparse_utils.zero_rows(exio_vagg, elec_indices) +
+                      sp.diags(v_diag*elec_indices, dtype=v_diag.dtype)
+                      ).asformat(matrix_format)
+    V_without_elec.eliminate_zeros()
+    U_without_elec = sparse_utils.zero_rows(exio_uagg, elec_indices)
+    return V_without_elec, U_without_elec, V_elecmarkets, U_elecmarkets,\
+           elec_market_product_supply, elec_market_product_use
+
+def create_excl_byprod_markets(v, u, excl_byproducts, prod_names, N_prod,
+                               labels, logger):
     _name = create_excl_byprod_markets.__name__
     logger.info(LogMessage(_name, 'Creating markets for exclusive byproducts'))
+    matrix_format = sparse_utils.get_format(u)
     v_market_excl_byproduct = np.zeros(len(excl_byproducts)) #create a vector
     #for the market supply
     u_market_excl_byproduct = np.zeros((u.shape[0], len(excl_byproducts)))
@@ -222,36 +706,51 @@ def create_excl_byprod_markets(v, u, excl_byproducts, prod_dic, country_dic,
                                         u.shape[0]))
     excl_market_products_supply = np.zeros((len(excl_byproducts),
                                             u.shape[0]))
+    market_rows = [] #rows of the byproducts that are moved to the markets
+    if not isinstance(prod_names, LabelTable):
+        prod_names = LabelTable.from_array(prod_names)
+    if not isinstance(excl_byproducts, LabelTable):
+        excl_byproducts = LabelTable.from_array(excl_byproducts)
+    #regions and products of all exclusive byproducts
+    byprod_regions = labels.region_id(prod_names.column('Region'))
+    byprod_products = labels.product_id(prod_names.column('code 1'))
     
-    U_markets = u.copy() #This will be the final "main" use table (without markets)
-    V_markets = v.copy() #this will be the final "main" supply table without markets
-    
-    for i,excl_prod in enumerate(excl_byproducts):
-        prod_ind = prod_dic[excl_prod[1]]
-        excl_prod_indices = np.where(iot_names.as_matrix()[:,2]==\
-                                excl_byproducts[i,2])[0]
-        u_market_excl_byproduct[excl_prod_indices,i] =\
-                                v[excl_prod_indices,excl_prod_indices]
+    for i,excl_prod in enumerate(excl_byproducts.column('code 1')):
+        prod_ind = labels.product_id(excl_prod)
+        excl_prod_indices = labels.product_rows(prod_ind)
+        u_market_excl_byproduct[excl_prod_indices,i] = np.asarray(
+                                v[excl_prod_indices,excl_prod_indices]).ravel()
         v_market_excl_byproduct[i] = u_market_excl_byproduct[:,i].sum()
 
-        excl_byprod_countries = prod_names[np.where(prod_names[:,2] ==\
-                                excl_prod[2]),0][0]
-        c_index = np.array([country_dic[x] for x in excl_byprod_countries])
-        excl_market_products_use[i,:] =\
-                                u[c_index*N_prod+prod_ind,:].sum(axis=0)
+        c_index = byprod_regions[byprod_products == prod_ind] #the regions
+        #where this product is an exclusive byproduct
+        excl_market_products_use[i,:] = sparse_utils.flat_sum(
+                                u[c_index*N_prod+prod_ind,:], 0)
                                 #every acticity that normally buys the product
                                 #from a country where this is only a by product
                                 #now needs to buy this from the market.
-        U_markets[c_index*N_prod+prod_ind,:] = 0 #We then set the use from the
-        #particular countries to 0 as they only buy from the market.
-
-        excl_market_products_supply[i,:] = v[
-            c_index*N_prod+prod_ind,:].sum(axis=0) #We now need to move the
+        excl_market_products_supply[i,:] = sparse_utils.flat_sum(v[
+            c_index*N_prod+prod_ind,:], 0) #We now need to move the
             #byproduction in these countries to the market. We can simpy sum
             #over the columns as the production of the other countries in this
             #country will always be 0 and won't affect the sum
-        V_markets[c_index*N_prod+prod_ind,:] = 0 #as above for the use but now
-        #for the byproduct supply
+        market_rows.append(c_index*N_prod+prod_ind)
+
+    market_rows = np.concatenate(market_rows) if market_rows else\
+                  np.array([], dtype=int)
+    U_markets = sparse_utils.zero_rows(u, market_rows) #This will be the final
+    #"main" use table (without markets). The particular countries now only buy
+    #from the market.
+    V_markets = sparse_utils.zero_rows(v, market_rows) #this will be the final
+    #"main" supply table without markets, the byproduct supply moved to the
+    #market.
+    if matrix_format != 'dense':
+        u_market_excl_byproduct = sparse_utils.as_format(
+                                    u_market_excl_byproduct, matrix_format)
+        excl_market_products_use = sparse_utils.as_format(
+                                    excl_market_products_use, matrix_format)
+        excl_market_products_supply = sparse_utils.as_format(
+                                    excl_market_products_supply, matrix_format)
     return V_markets, U_markets, v_market_excl_byproduct,\
            u_market_excl_byproduct, excl_market_products_supply,\
            excl_market_products_use
@@ -259,36 +758,37 @@ def create_excl_byprod_markets(v, u, excl_byproducts, prod_dic, country_dic,
 def assemble_SUT(v,u,V_elecmarkets,U_elecmarkets,elec_market_product_supply,
                  elec_market_product_use, v_market_excl_byproduct,
                  u_market_excl_byproduct, excl_market_products_supply,
-                 excl_market_products_use, logger):
-    #here we assemble everything into one Use and one Supply table
+                 excl_market_products_use, logger, concatenate=False):
+    """Assembles everything into one Use and one Supply table. The tables are
+    returned as BlockMatrix with the blocks
+        [[main table,        electricity markets, byproduct markets],
+         [electricity block, electricity diagonal, 0                ],
+         [byproduct block,   0,                    byproduct diagonal]]
+    which refers to the input arrays without copying them. Only if
+    concatenate is True the blocks are copied into single dense (or sparse,
+    in the format of u) tables.
+    """
     _name = assemble_SUT.__name__
     logger.info(LogMessage(_name, 'Assembling the final SUT...'))
     exio_dim = v.shape[0]
     n_elecmarket = len(V_elecmarkets)
     n_excl_bp = len(v_market_excl_byproduct)
-    full_dimension =exio_dim + n_elecmarket + n_excl_bp
-    
-    U_full = np.zeros((full_dimension,full_dimension))
-    V_full = np.zeros((full_dimension,full_dimension))
-    #first insert the main use and supply tables
-    U_full[:exio_dim,:exio_dim] = u
-    V_full[:exio_dim,:exio_dim] = v
-    
-    #now insert_electricity markets
-    U_full[exio_dim:exio_dim+n_elecmarket,:exio_dim] = elec_market_product_use
-    U_full[:exio_dim,exio_dim:exio_dim+n_elecmarket] = U_elecmarkets
-    V_full[exio_dim:exio_dim+n_elecmarket,:exio_dim] =\
-                                                elec_market_product_supply
-    V_full[exio_dim:exio_dim+n_elecmarket,exio_dim:exio_dim+n_elecmarket] =\
-                                                np.diag(V_elecmarkets)
-    
-    #now insert exclusive byproduct markets
-    U_full[exio_dim+n_elecmarket:,:exio_dim] = excl_market_products_use
-    U_full[:exio_dim,exio_dim+n_elecmarket:] = u_market_excl_byproduct
-    
-    V_full[exio_dim+n_elecmarket:,:exio_dim] = excl_market_products_supply
-    V_full[exio_dim+n_elecmarket:,exio_dim+n_elecmarket:] =\
-                                                np.diag(v_market_excl_byproduct)
+    sizes = [exio_dim, n_elecmarket, n_excl_bp]
+    U_full = BlockMatrix([[u, U_elecmarkets, u_market_excl_byproduct],
+                          [elec_market_product_use, None, None],
+                          [excl_market_products_use, None, None]],
+                         sizes, sizes)
+    V_full = BlockMatrix([[v, None, None],
+                          [elec_market_product_supply,
+                           sp.diags(V_elecmarkets, format='csr'), None],
+                          [excl_market_products_supply, None,
+                           sp.diags(v_market_excl_byproduct, format='csr')]],
+                         sizes, sizes)
+    if concatenate:
+        matrix_format = sparse_utils.get_format(u)
+        logger.info(LogMessage(_name, 'Concatenating the SUT blocks'))
+        return V_full.concatenate(matrix_format),\
+               U_full.concatenate(matrix_format)
     return V_full, U_full
 
 
@@ -304,16 +804,95 @@ def make_IOT(U, V, logger):
     Output:
     Z       :   Input-Output table (product x product)
     A       :   Coefficient matrix to input output table Z
+    
+    Z and A are sparse if U and V are, in the same format as U. If U and V
+    are BlockMatrix objects (see assemble_SUT), Z and A are computed block by
+    block and returned as BlockMatrix too. Z and A have the dtype of U and V
+    and are the only (full size) arrays allocated: the diagonal of V is
+    added back in place and A is scaled in place.
     """
     _name = make_IOT.__name__
     logger.info(LogMessage(_name, 'Constructing IOT from SUT'))
-    Z = U - V + np.diag(np.diag(V))
-    x_dummy = np.diag(V).copy()
+    if isinstance(U, BlockMatrix):
+        return _make_block_IOT(U, V)
+    Z = sparse_utils.minus_offdiagonal(U, V)
+    x_dummy = sparse_utils.diagonal(V).astype(float)
     x_dummy[x_dummy == 0] = 1
-    A = Z/x_dummy
+    A = sparse_utils.scale_columns(Z.copy(), x_dummy, inplace=True)
     return Z, A
 
 
+def _make_block_IOT(U, V):
+    """make_IOT for BlockMatrix U and V with the same block structure."""
+    x_dummy = V.diagonal()
+    x_dummy[x_dummy == 0] = 1
+    n_row_blocks, n_col_blocks = U.n_blocks
+    Z_blocks = [[None]*n_col_blocks for i in range(n_row_blocks)]
+    A_blocks = [[None]*n_col_blocks for i in range(n_row_blocks)]
+    for i in range(n_row_blocks):
+        for j in range(n_col_blocks):
+            u, v = U.block(i,j), V.block(i,j)
+            if v is not None and i == j: #keep the principal production
+                if u is None:
+                    u = sp.csr_matrix(v.shape, dtype=v.dtype)
+                z = sparse_utils.minus_offdiagonal(u, v)
+            elif v is None:
+                z = u
+            elif u is None:
+                z = -v
+            elif sp.issparse(u) and sp.issparse(v):
+                z = u - v
+            else:
+                z = np.subtract(sparse_utils.as_format(u, 'dense'),
+                                sparse_utils.as_format(v, 'dense'))
+            if sp.issparse(z):
+                z = z.asformat(sparse_utils.get_format(z))
+                z.eliminate_zeros()
+                if z.nnz == 0:
+                    z = None
+            if z is not None:
+                Z_blocks[i][j] = z
+                A_blocks[i][j] = sparse_utils.scale_columns(z,
+                                                    x_dummy[V.col_slice(j)])
+    return BlockMatrix(Z_blocks, U.row_sizes, U.col_sizes),\
+           BlockMatrix(A_blocks, U.row_sizes, U.col_sizes)
+
+
+def update_electricity_mix_IOT(Z, A, V, U_elecmarkets, logger):
+    """Updates the model IOT for a new electricity mix of the national
+    grids, without rebuilding the model. Only the electricity market columns
+    of Z and A change: block (0,1) of Z is U_elecmarkets and its column
+    totals are the new supply of the grids (V_elecmarkets).
+    Input:
+    Z, A, V         :   BlockMatrix IOT and supply table from make_IOT and
+                        assemble_SUT
+    U_elecmarkets   :   new electricity mix (N_reg*N_prod x N_reg), as made by
+                        create_electricity_grids
+
+    Output:
+    Z, A, V         :   updated BlockMatrix objects, sharing all unchanged
+                        blocks with the inputs
+    columns         :   the columns of A that changed, for
+                        leontief.LeontiefSolver.update_columns(columns,
+                        A.column_block(1))
+    """
+    _name = update_electricity_mix_IOT.__name__
+    logger.info(LogMessage(_name, 'Updating the electricity market columns'))
+    matrix_format = sparse_utils.get_format(U_elecmarkets)
+    V_elecmarkets = sparse_utils.flat_sum(U_elecmarkets, 0)
+    x_dummy = V_elecmarkets.copy()
+    x_dummy[x_dummy == 0] = 1
+    if matrix_format != 'dense':
+        U_elecmarkets = U_elecmarkets.copy()
+        U_elecmarkets.eliminate_zeros()
+    Z = Z.replace_block(0, 1, U_elecmarkets)
+    A = A.replace_block(0, 1, sparse_utils.scale_columns(U_elecmarkets,
+                                                         x_dummy))
+    V = V.replace_block(1, 1, sp.diags(V_elecmarkets, format='csr'))
+    columns = np.arange(A.col_offsets[1], A.col_offsets[2])
+    return Z, A, V, columns
+
+
 def ParseArgs():
     '''
     ParsArgs parser the command line options
@@ -333,6 +912,10 @@ def ParseArgs():
     parser.add_argument("--cs", dest="copy_script", action="store_true",
                         help="If True saves the script file to the log dir")
 
+    parser.add_argument("--rc", "--rebuild-cache", dest="rebuild_cache",
+                        action="store_true", help="If True rebuilds the"\
+                        ' binary cache of the supply and use tables')
+
     args = parser.parse_args()
 
     print("Arguments parsed.")
@@ -355,7 +938,7 @@ if __name__ == "__main__":
                                     args.copy_script, args.copy_config,
                                     os.path.realpath(args.config_file))
 
-        system_model(config,logger, log_dir)
+        system_model(config,logger, log_dir, args.rebuild_cache)
 
     else:
         print('Config file does not exist, please check path')
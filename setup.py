@@ -53,7 +53,7 @@ setup(
         'numpy',
         'os',
         'pandas',
-        'pysut'
+        'scipy'
     ],
     url="https://github.com/BONSAMURAIS/mojo",
     long_description=open('README.md').read(),
@@ -0,0 +1,109 @@
+import configparser
+import json
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#the mojo modules import each other by their plain names
+sys.path.insert(0, os.path.join(ROOT, 'mojo'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def logger():
+    return logging.getLogger('mojo_tests')
+
+
+def _write_sut_csv(table, p2f):
+    """Writes a synthetic table in the csv layout read by get_sut."""
+    n_rows, n_cols = table.shape
+    index = pd.MultiIndex.from_arrays([['r']*n_rows,
+                                       np.arange(n_rows).astype(str),
+                                       ['a']*n_rows, ['b']*n_rows,
+                                       ['u']*n_rows])
+    columns = pd.MultiIndex.from_arrays([['r']*n_cols,
+                                         np.arange(n_cols).astype(str),
+                                         ['a']*n_cols, ['b']*n_cols])
+    pd.DataFrame(table.toarray(), index=index, columns=columns).to_csv(p2f)
+
+
+@pytest.fixture(scope='session')
+def synthetic_dir(tmp_path_factory):
+    """Directory with a small synthetic EXIOBASE shaped data set (see
+    benchmarks/synthetic.py) with the supply and use table as csv."""
+    from synthetic import make_synthetic, write_synthetic
+    path_name = str(tmp_path_factory.mktemp('synthetic'))
+    data = make_synthetic(N_reg=2, seed=1)
+    write_synthetic(data, path_name)
+    _write_sut_csv(data['V'], os.path.join(path_name, 'supply.csv'))
+    _write_sut_csv(data['U'], os.path.join(path_name, 'use.csv'))
+    return path_name
+
+
+ENTSOE_TECHNOLOGIES = ['Fossil Gas', 'Wind Onshore', 'Nuclear', 'Grid']
+
+
+def _write_entsoe(path_name, regions, seed):
+    """Writes ENTSO-E data (see load_entsoe.get_entsoe) with random
+    generation of ENTSOE_TECHNOLOGIES in regions."""
+    os.makedirs(path_name)
+    labels = [[r, t] for r in regions for t in ENTSOE_TECHNOLOGIES]
+    rng = np.random.default_rng(seed)
+    np.save(os.path.join(path_name, 'entsoe-supply.npy'),
+            np.diag(rng.random(len(labels))*100))
+    np.save(os.path.join(path_name, 'entsoe-use.npy'),
+            rng.random((len(labels), len(labels))))
+    for name in ('products', 'activities'):
+        with open(os.path.join(path_name, 'entsoe-{}.json'.format(name)),
+                  'w') as f:
+            json.dump(labels, f)
+
+
+@pytest.fixture(scope='session')
+def entsoe_dirs(tmp_path_factory):
+    """Two directories with different ENTSO-E data of the regions of the
+    synthetic data, e.g. two years."""
+    from synthetic import make_synthetic
+    regions = make_synthetic(N_reg=2, seed=1)['regions']
+    path_name = str(tmp_path_factory.mktemp('entsoe'))
+    dirs = [os.path.join(path_name, str(year)) for year in (2016, 2017)]
+    for seed, entsoe_dir in enumerate(dirs):
+        _write_entsoe(entsoe_dir, regions, seed)
+    return dirs
+
+
+@pytest.fixture
+def model_config(synthetic_dir, entsoe_dirs, tmp_path):
+    """Returns a function making the config of the system model on the
+    synthetic data, with the model_options given as keyword arguments. The
+    ENTSO-E data is the first of entsoe_dirs, not used unless
+    update_grid_mix is set."""
+    def make_config(**model_options):
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'project_info': {'aggregation_report_file': 'report.csv'},
+            'exio_data': {'ddir': synthetic_dir, 'supply': 'supply.csv',
+                          'use': 'use.csv', 'supply_long': '',
+                          'aggregation_matrix': 'aggregation_matrix.csv',
+                          'calvals_matrix': 'Calorific_values.csv',
+                          'aggregated_names': 'IOTnames.csv',
+                          'cache_dir': ''},
+            'model_options': dict({'matrix_format': 'dense',
+                                   'stage_cache_dir': '',
+                                   'memory_budget': '',
+                                   'stream_dir': str(tmp_path/'stream')},
+                                  **model_options),
+            'entsoe_data': {'update_grid_mix': 'False',
+                            'ddir': entsoe_dirs[0],
+                            'supply': 'entsoe-supply.npy',
+                            'use': 'entsoe-use.npy',
+                            'products': 'entsoe-products.json',
+                            'activities': 'entsoe-activities.json',
+                            'bentso_store': '', 'year': '2016'}})
+        return config
+    return make_config
+
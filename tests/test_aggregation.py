@@ -0,0 +1,119 @@
+import gzip
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import aggregation as agg
+import load_exiobase
+from aggregation import BlockAggregationMatrix
+
+
+@pytest.fixture
+def aggregation_matrix():
+    rng = np.random.default_rng(0)
+    N_reg, N_prod, N_sec = 3, 7, 4
+    block = (rng.random((N_prod, N_sec)) < 0.4).astype(float)
+    #region specific values, e.g. the relative calorific values
+    return BlockAggregationMatrix(block, N_reg, override_rows=[1, 5],
+                                  override_cols=[2, 2],
+                                  override_values=rng.random((N_reg, 2)))
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr', 'csc'])
+def test_aggregate_equals_full_matrix(aggregation_matrix, matrix_format):
+    rng = np.random.default_rng(1)
+    a = rng.random((aggregation_matrix.shape[0], 5))
+    a[a < 0.6] = 0
+    table = a if matrix_format == 'dense' else\
+            sp.csr_matrix(a).asformat(matrix_format)
+    result = aggregation_matrix.aggregate(table)
+    if matrix_format == 'dense':
+        assert isinstance(result, np.ndarray)
+    else:
+        assert result.format == matrix_format
+        result = result.toarray()
+    np.testing.assert_allclose(result, aggregation_matrix.toarray().T @ a,
+                               rtol=1e-12, atol=1e-14)
+
+
+def test_region_block_has_overrides(aggregation_matrix):
+    full = aggregation_matrix.toarray()
+    N_prod, N_sec = aggregation_matrix.N_prod, aggregation_matrix.N_sec
+    for r in range(aggregation_matrix.N_reg):
+        block = full[r*N_prod:(r+1)*N_prod, r*N_sec:(r+1)*N_sec]
+        np.testing.assert_array_equal(block,
+                                      aggregation_matrix.region_block(r))
+        np.testing.assert_array_equal(block[[1, 5], [2, 2]],
+                                      aggregation_matrix.override_values[r])
+
+
+def test_aggregate_rejects_wrong_rows(aggregation_matrix):
+    with pytest.raises(ValueError):
+        aggregation_matrix.aggregate(np.ones((4, 2)))
+
+
+def test_aggregate_synthetic_sut(synthetic_dir, logger, tmp_path):
+    block_matrix = agg.get_aggregation_matrix(synthetic_dir,
+                                 'aggregation_matrix.csv',
+                                 'Calorific_values.csv', str(tmp_path),
+                                 'report.csv', logger)[0]
+    full_matrix = block_matrix.toarray()
+    v, u = load_exiobase.get_sut(synthetic_dir, 'supply.csv', 'use.csv',
+                                 logger)
+    expected = agg.aggregate(v, u, full_matrix, logger)
+    for matrix_format in ('dense', 'csr'):
+        tables = load_exiobase.get_sut(synthetic_dir, 'supply.csv',
+                                       'use.csv', logger, matrix_format)
+        result = agg.aggregate(*tables, block_matrix, logger)
+        for a, b in zip(expected, result):
+            b = b.toarray() if matrix_format != 'dense' else b
+            np.testing.assert_allclose(b, a, rtol=1e-12, atol=1e-12)
+
+
+def _report_lines(aggregation_matrix, new_aggregation_matrix, country_list,
+                  N_reg):
+    """The lines of the aggregation report, one region, industry and
+    product at a time."""
+    full = new_aggregation_matrix.toarray()
+    N_prod, N_sec = aggregation_matrix.shape
+    lines = []
+    for c in range(N_reg):
+        for i in range(N_sec):
+            n_prods = aggregation_matrix.iloc[:,i].sum()
+            if n_prods > 1:
+                for p in np.where(aggregation_matrix.iloc[:,i] == 1)[0]:
+                    lines.append('|'.join([country_list[c],
+                                 '|'.join(aggregation_matrix.columns[i]),
+                                 '{}'.format(n_prods),
+                                 '|'.join(aggregation_matrix.index[p][1:]),
+                                 '{}'.format(full[p+c*N_prod, i+c*N_sec]),
+                                 '']))
+    return lines
+
+
+@pytest.mark.parametrize('out_file', ['report.csv', 'report.csv.gz'])
+def test_aggregation_report(synthetic_dir, logger, tmp_path, out_file):
+    aggregation_matrix, calval = agg.read_aggregation_files(synthetic_dir,
+                                 'aggregation_matrix.csv',
+                                 'Calorific_values.csv', logger)
+    new_aggregation_matrix, N_reg, N_prod, N_sec = agg.get_aggregation_matrix(
+                                 synthetic_dir, 'aggregation_matrix.csv',
+                                 'Calorific_values.csv', '', '', logger)
+    country_list = list(calval.columns)
+    agg.aggregation_report(aggregation_matrix, new_aggregation_matrix,
+                           ['Manufacure of Gas'], country_list,
+                           str(tmp_path), out_file, N_reg, N_prod, N_sec,
+                           logger, chunk_size=7)
+    opener = gzip.open if out_file.endswith('.gz') else open
+    with opener(str(tmp_path/out_file), 'rt') as f:
+        lines = f.read().splitlines()
+    assert lines[:3] == ['# Agrgegation report ', '# The Following '
+                         'industries were aggregated usingcaloric values: ',
+                         '# Manufacure of Gas ']
+    assert lines[3].split('|') == list(agg.aggregation_report_table(
+                                  aggregation_matrix, new_aggregation_matrix,
+                                  country_list, N_reg).columns) + ['']
+    expected = _report_lines(aggregation_matrix, new_aggregation_matrix,
+                             country_list, N_reg)
+    #the calorific values of the gases differ per region
+    assert len(set(line.split('|')[-2] for line in expected)) > 2
+    assert lines[4:] == expected
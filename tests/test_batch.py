@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import batch
+import system_model
+from pipeline import Pipeline
+
+
+def _dense(table):
+    return table.toarray() if hasattr(table, 'toarray') else\
+           np.asarray(table)
+
+
+def test_shared_round_trip(tmp_path):
+    large = np.random.default_rng(0).random((100, 100))
+    small = np.arange(5.0)
+    obj = {'tables': (large, sp.csr_matrix(large)), 'small': small,
+           'names': np.array(['a', 'b'], dtype=object)}
+    batch.write_shared(obj, str(tmp_path))
+    #the large array and the data of the sparse matrix
+    assert sorted(f for f in os.listdir(str(tmp_path))
+                  if f.endswith('.npy')) == ['array_0.npy', 'array_1.npy']
+    result = batch.read_shared(str(tmp_path))
+    dense, csr = result['tables']
+    assert isinstance(dense, np.memmap) and not dense.flags.writeable
+    np.testing.assert_array_equal(dense, large)
+    np.testing.assert_array_equal(csr.toarray(), large)
+    assert not isinstance(result['small'], np.memmap)
+    np.testing.assert_array_equal(result['small'], small)
+    assert list(result['names']) == ['a', 'b']
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr'])
+def test_batch_model(model_config, entsoe_dirs, logger, tmp_path,
+                     matrix_format):
+    config = model_config(matrix_format=matrix_format)
+    scenarios = {'entsoe_{}'.format(os.path.basename(d)):
+                 {'entsoe_data.update_grid_mix': 'True',
+                  'entsoe_data.ddir': d} for d in entsoe_dirs}
+    out_dir = str(tmp_path/'batch')
+    timings = batch.batch_model(config, scenarios, logger, str(tmp_path),
+                                out_dir, processes=2,
+                                targets=('iot', 'model_labels'))
+    assert list(timings.index) == ['shared'] + list(scenarios)
+    results = []
+    for name, overrides in scenarios.items():
+        result = batch.read_shared(os.path.join(out_dir, name))
+        #the same as a standalone run with the same overrides
+        pipeline = Pipeline(system_model.model_stages(str(tmp_path)),
+                            batch.scenario_config(config, overrides), logger)
+        for a, b in zip(result['iot'], pipeline.run('iot')):
+            np.testing.assert_allclose(_dense(a), _dense(b), rtol=1e-12,
+                                       atol=1e-15)
+        results.append(_dense(result['iot'][1]))
+    #the grid mix of the two years differs
+    assert not np.allclose(results[0], results[1])
+    assert not [f for f in os.listdir(out_dir) if f.startswith('mojo_shared')]
@@ -0,0 +1,98 @@
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+import bentso_store
+from bentso_store import BentsoStore
+
+
+def _time_index(freq, periods, tz):
+    #in ns, as in the pickles of bentso
+    return pd.date_range('2016-01-01', periods=periods, freq=freq,
+                         tz=tz).as_unit('ns')
+
+
+@pytest.fixture(scope='module')
+def bentso_data():
+    """Fake bentso data: file name -> DataFrame or Series."""
+    rng = np.random.default_rng(0)
+    generation = pd.DataFrame(rng.random((96, 2))*100,
+                              index=_time_index('15min', 96, 'Europe/Berlin'),
+                              columns=['Fossil Gas', 'Wind Onshore'])
+    hourly = pd.DataFrame(rng.random((48, 3))*10,
+                          index=_time_index('h', 48, 'Europe/Amsterdam'),
+                          columns=['Fossil Gas', 'Nuclear', 'Solar'])
+    hourly.iloc[5, 1] = np.nan #missing values count as zero
+    return {'generation-DE-2016.pickle': generation,
+            'generation-NL-2016.pickle': hourly,
+            'capacity-DE-2016.pickle': pd.DataFrame(
+                [[1000.0, 500.0]], columns=['Fossil Gas', 'Wind Onshore'],
+                index=_time_index('YS', 1, None)),
+            'load-DE-2016.pickle': pd.Series(rng.random(24)*50,
+                                   index=_time_index('h', 24, 'UTC')),
+            'trade-AL-GR-2016.pickle': pd.Series(rng.random(24),
+                                       index=_time_index('h', 24, None))}
+
+
+@pytest.fixture(params=[1, 2], scope='module')
+def store(request, bentso_data, tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('bentso')
+    for file_name, data in bentso_data.items():
+        with open(str(data_dir/file_name), 'wb') as f:
+            pickle.dump(data, f)
+    (data_dir/'readme.txt').write_text('not a pickle')
+    store_dir = str(data_dir/'store')
+    bentso_store.convert_bentso(str(data_dir), store_dir,
+                                processes=request.param)
+    return BentsoStore(store_dir)
+
+
+def test_parse_file_name():
+    assert bentso_store.parse_file_name('trade-AL-GR-2016.pickle') ==\
+           ('trade', 'AL-GR', 2016)
+    assert bentso_store.parse_file_name('generation-DE-2017.pickle') ==\
+           ('generation', 'DE', 2017)
+
+
+def test_keys(store):
+    assert sorted(store.keys('generation')) == [('DE', 2016), ('NL', 2016)]
+    assert store.keys('trade') == [('AL-GR', 2016)]
+    assert store.has('generation', 'NL', 2016)
+    assert not store.has('generation', 'NL', 2017)
+    assert not store.has('load', 'NL', 2016)
+
+
+def test_get(store, bentso_data):
+    for file_name, expected in bentso_data.items():
+        kind, country, year = bentso_store.parse_file_name(file_name)
+        data = store.get(kind, country, year)
+        if isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(data, expected, check_freq=False)
+        else:
+            pd.testing.assert_frame_equal(data, expected, check_freq=False)
+
+
+def test_annual(store, bentso_data):
+    generation = bentso_data['generation-DE-2016.pickle']
+    pd.testing.assert_series_equal(store.annual('generation', 'DE', 2016),
+                                   generation.sum()*0.25)
+    hourly = bentso_data['generation-NL-2016.pickle']
+    pd.testing.assert_series_equal(store.annual('generation', 'NL', 2016),
+                                   hourly.sum())
+    capacity = bentso_data['capacity-DE-2016.pickle']
+    pd.testing.assert_series_equal(store.annual('capacity', 'DE', 2016),
+                                   capacity.iloc[0], check_names=False)
+    load = bentso_data['load-DE-2016.pickle']
+    assert store.annual('load', 'DE', 2016)['load'] ==\
+           pytest.approx(load.sum())
+
+
+def test_wrong_version(store, tmp_path):
+    store_dir = str(tmp_path/'store')
+    shutil.copytree(store.store_dir, store_dir)
+    with open(os.path.join(store_dir, 'load', 'index.json'), 'w') as f:
+        f.write('{"version": 0, "entries": {}}')
+    with pytest.raises(ValueError):
+        BentsoStore(store_dir).keys('load')
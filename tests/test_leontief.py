@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from block_matrix import BlockMatrix
+from leontief import LeontiefSolver
+
+N = 12
+
+
+@pytest.fixture
+def A():
+    """Random sparse coefficient matrix with column sums below one, so that
+    I - A is invertible."""
+    rng = np.random.default_rng(0)
+    A = rng.random((N, N)) * (rng.random((N, N)) < 0.4)
+    A[N//2:,:N//2] = 0 #an empty block for the BlockMatrix input
+    return A / (A.sum(axis=0) + 1) * 0.9
+
+
+def _dense_solve(A, b, trans=False):
+    M = np.identity(A.shape[0]) - A
+    return np.linalg.solve(M.T if trans else M, b)
+
+
+@pytest.mark.parametrize('method', ['lu', 'iterative'])
+def test_solve(A, logger, method):
+    solver = LeontiefSolver(A, logger, method=method, tol=1e-12)
+    rng = np.random.default_rng(1)
+    y, Y = rng.random(N), rng.random((N, 3))
+    np.testing.assert_allclose(solver.solve(y), _dense_solve(A, y),
+                               rtol=1e-8)
+    np.testing.assert_allclose(solver.solve(Y), _dense_solve(A, Y),
+                               rtol=1e-8)
+    np.testing.assert_allclose(solver.solve_transposed(y),
+                               _dense_solve(A, y, trans=True), rtol=1e-8)
+    np.testing.assert_allclose(solver.solve_transposed(Y),
+                               _dense_solve(A, Y, trans=True), rtol=1e-8)
+
+
+@pytest.mark.parametrize('matrix_format', ['csr', 'block'])
+def test_solve_matrix_formats(A, logger, matrix_format):
+    if matrix_format == 'block':
+        k = N // 2
+        A_in = BlockMatrix([[A[:k,:k], sp.csr_matrix(A[:k,k:])],
+                            [None, A[k:,k:]]], [k, N-k], [k, N-k])
+    else:
+        A_in = sp.csr_matrix(A)
+    y = np.arange(N, dtype=float)
+    np.testing.assert_allclose(LeontiefSolver(A_in, logger).solve(y),
+                               _dense_solve(A, y), rtol=1e-10)
+
+
+def test_unknown_method(A, logger):
+    with pytest.raises(ValueError):
+        LeontiefSolver(A, logger, method='qr')
+
+
+def test_save_load(A, logger, tmp_path):
+    p2f = str(tmp_path/'lu.npz')
+    LeontiefSolver(A, logger).save(p2f)
+    solver = LeontiefSolver.load(p2f, logger)
+    Y = np.random.default_rng(2).random((N, 2))
+    np.testing.assert_allclose(solver.solve(Y), _dense_solve(A, Y),
+                               rtol=1e-10)
+    np.testing.assert_allclose(solver.solve_transposed(Y),
+                               _dense_solve(A, Y, trans=True), rtol=1e-10)
+
+
+def _new_columns(A, columns, seed):
+    A_columns = np.random.default_rng(seed).random((N, len(columns)))
+    A_columns = A_columns / A_columns.sum(axis=0) * 0.5
+    A_new = A.copy()
+    A_new[:,columns] = A_columns
+    return A_columns, A_new
+
+
+@pytest.mark.parametrize('columns_format', ['dense', 'csc'])
+def test_update_columns(A, logger, columns_format):
+    columns = [1, 4, 7]
+    A_columns, A_new = _new_columns(A, columns, 3)
+    if columns_format == 'csc':
+        A_columns = sp.csc_matrix(A_columns)
+    solver = LeontiefSolver(A, logger).update_columns(columns, A_columns)
+    rng = np.random.default_rng(4)
+    y, Y = rng.random(N), rng.random((N, 3))
+    np.testing.assert_allclose(solver.solve(y), _dense_solve(A_new, y),
+                               rtol=1e-10)
+    np.testing.assert_allclose(solver.solve(Y), _dense_solve(A_new, Y),
+                               rtol=1e-10)
+    np.testing.assert_allclose(solver.solve_transposed(y),
+                               _dense_solve(A_new, y, trans=True),
+                               rtol=1e-10)
+    np.testing.assert_allclose(solver.solve_transposed(Y),
+                               _dense_solve(A_new, Y, trans=True),
+                               rtol=1e-10)
+
+
+def test_chained_update_columns(A, logger):
+    A_columns, A_new = _new_columns(A, [1, 4], 5)
+    solver = LeontiefSolver(A, logger).update_columns([1, 4], A_columns)
+    #overlapping columns, the later update wins
+    A_columns, A_new = _new_columns(A_new, [4, 9], 6)
+    solver = solver.update_columns([4, 9], A_columns)
+    np.testing.assert_array_equal(solver.columns, [1, 4, 9])
+    Y = np.random.default_rng(7).random((N, 2))
+    np.testing.assert_allclose(solver.solve(Y), _dense_solve(A_new, Y),
+                               rtol=1e-10)
+    np.testing.assert_allclose(solver.solve_transposed(Y),
+                               _dense_solve(A_new, Y, trans=True),
+                               rtol=1e-10)
+
+
+def test_update_columns_of_loaded_solver(A, logger, tmp_path):
+    p2f = str(tmp_path/'lu.npz')
+    LeontiefSolver(A, logger).save(p2f)
+    with pytest.raises(ValueError):
+        LeontiefSolver.load(p2f, logger).update_columns([0], A[:,[0]])
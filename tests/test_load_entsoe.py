@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+import load_entsoe
+from label_index import LabelIndex, LabelTable
+
+REGIONS = ['DE', 'GB', 'NL']
+PRODUCTS = ['p01', 'p40.11.a', 'p40.11.b', 'p40.11.e']
+#NI is mapped to GB, XX is no EXIOBASE region, Grid has no product and
+#Nuclear (p40.11.c) is not one of PRODUCTS
+ENTSOE = [['DE', 'Fossil Gas'], ['DE', 'Wind Onshore'],
+          ['DE', 'Wind Offshore'], ['DE', 'Grid'], ['NI', 'Fossil Hard coal'],
+          ['GB', 'Fossil Gas'], ['XX', 'Fossil Gas'], ['DE', 'Nuclear']]
+GENERATION = np.array([10.0, 4.0, 2.0, 100.0, 3.0, 20.0, 50.0, 30.0])
+
+
+@pytest.fixture
+def labels():
+    names = pd.DataFrame({'Country code': np.repeat(REGIONS, len(PRODUCTS)),
+                          'Product code 1': np.tile(PRODUCTS, len(REGIONS)),
+                          'Product code 2': np.tile(PRODUCTS, len(REGIONS)),
+                          'Product name': np.tile(PRODUCTS, len(REGIONS)),
+                          'Unit': 'TJ'})
+    return LabelIndex(names)
+
+
+def _expected_grid_mix():
+    """The grid mix of ENTSOE summed one activity at a time."""
+    mix = np.zeros((len(REGIONS)*len(PRODUCTS), len(REGIONS)))
+    for (country, technology), value in zip(ENTSOE, GENERATION):
+        region = load_entsoe.COUNTRY_CONCORDANCE.get(country, country)
+        product = load_entsoe.TECHNOLOGY_CONCORDANCE.get(technology)
+        if region in REGIONS and product in PRODUCTS:
+            r = REGIONS.index(region)
+            mix[r*len(PRODUCTS) + PRODUCTS.index(product), r] += value
+    return mix
+
+
+def test_grid_mix(labels, logger):
+    entsoe_labels = LabelTable.from_array(ENTSOE, load_entsoe.ENTSOE_COLUMNS)
+    product_concordance, region_concordance = load_entsoe.get_concordance(
+                                              entsoe_labels, labels, logger)
+    assert product_concordance.shape == (len(labels), len(ENTSOE))
+    assert region_concordance.shape == (len(ENTSOE), len(REGIONS))
+    grid_mix = load_entsoe.get_grid_mix(GENERATION, product_concordance,
+                                        region_concordance)
+    assert sp.isspmatrix_csr(grid_mix)
+    expected = _expected_grid_mix()
+    np.testing.assert_array_equal(grid_mix.toarray(), expected)
+    #the wind of DE is summed, the coal of NI is in the grid of GB
+    assert expected[3, 0] == 6.0 and expected[5, 1] == 3.0
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr', 'csc'])
+def test_update_electricity_mix(logger, matrix_format):
+    U = np.random.default_rng(0).random((len(REGIONS)*len(PRODUCTS),
+                                         len(REGIONS)))
+    grid_mix = sp.csr_matrix(_expected_grid_mix())
+    U_in = U if matrix_format == 'dense' else sp.csr_matrix(U).asformat(
+                                                          matrix_format)
+    new_U = load_entsoe.update_electricity_mix(U_in, grid_mix, logger)
+    if matrix_format == 'dense':
+        assert isinstance(new_U, np.ndarray)
+    else:
+        assert new_U.format == matrix_format
+        new_U = new_U.toarray()
+    mix = grid_mix.toarray()
+    for r in range(len(REGIONS)):
+        if mix[:, r].sum() > 0: #the mix scaled to the grid total
+            expected = mix[:, r]*U[:, r].sum()/mix[:, r].sum()
+        else: #NL has no ENTSO-E data and keeps its mix
+            expected = U[:, r]
+        np.testing.assert_allclose(new_U[:, r], expected, rtol=1e-12)
+    np.testing.assert_allclose(new_U.sum(axis=0), U.sum(axis=0), rtol=1e-12)
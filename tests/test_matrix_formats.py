@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import system_model
+from pipeline import Pipeline
+
+
+def _dense(table):
+    return table.toarray() if hasattr(table, 'toarray') else\
+           np.asarray(table)
+
+
+def _model_tables(config, logger, log_dir):
+    pipeline = Pipeline(system_model.model_stages(log_dir), config, logger)
+    V_model, U_model = pipeline.run('sut_model')
+    Z_model, A_model = pipeline.run('iot')
+    return [_dense(t) for t in (V_model, U_model, Z_model, A_model)]
+
+
+@pytest.mark.parametrize('matrix_format', ['csr', 'csc'])
+def test_sparse_model_equals_dense(model_config, logger, tmp_path,
+                                   matrix_format):
+    expected = _model_tables(model_config(), logger, str(tmp_path))
+    result = _model_tables(model_config(matrix_format=matrix_format), logger,
+                           str(tmp_path))
+    for name, a, b in zip('VUZA', expected, result):
+        assert a.shape == b.shape, name
+        np.testing.assert_allclose(b, a, rtol=1e-12, atol=1e-12, err_msg=name)
@@ -0,0 +1,88 @@
+import json
+import os
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from block_matrix import BlockMatrix
+from label_index import LabelTable
+from model_store import ModelStore, write_model
+
+#the rows and columns of the regions are interleaved, GLO has no rows
+ROW_REGIONS = ['NL', 'DE', 'NL', 'DE', 'NL', 'DE']
+COL_REGIONS = ['DE', 'NL', 'NL', 'GLO', 'DE', 'NL', 'DE']
+
+
+def _labels(regions):
+    return LabelTable.from_array([[r, 'p{}'.format(i), 'c{}'.format(i), 'x',
+                                   'EUR'] for i, r in enumerate(regions)])
+
+
+@pytest.fixture
+def tables():
+    rng = np.random.default_rng(0)
+    shape = (len(ROW_REGIONS), len(COL_REGIONS))
+    A = rng.random(shape) * (rng.random(shape) < 0.5)
+    A[:, COL_REGIONS.index('GLO')] = 0 #an empty block column
+    Z = rng.random(shape).astype(np.float32)
+    return A, Z
+
+
+@pytest.mark.parametrize('compression', ['none', 'zlib'])
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr', 'block'])
+def test_round_trip(tables, logger, tmp_path, compression, matrix_format):
+    A, Z = tables
+    if matrix_format == 'csr':
+        A_in = sp.csr_matrix(A)
+    elif matrix_format == 'block':
+        A_in = BlockMatrix([[A[:4,:5], sp.csc_matrix(A[:4,5:])],
+                            [sp.csr_matrix(A[4:,:5]), A[4:,5:]]],
+                           [4, 2], [5, 2])
+    else:
+        A_in = A
+    out_dir = str(tmp_path/'store')
+    write_model(out_dir, {'A': A_in, 'Z': Z}, _labels(ROW_REGIONS),
+                _labels(COL_REGIONS), logger, compression)
+    store = ModelStore(out_dir)
+    assert store.tables == ['A', 'Z']
+    assert store.shape == A.shape
+    assert store.regions == ['NL', 'DE', 'GLO']
+    np.testing.assert_array_equal(store.row_labels.to_array(),
+                                  _labels(ROW_REGIONS).to_array())
+    np.testing.assert_array_equal(store.col_labels.to_array(),
+                                  _labels(COL_REGIONS).to_array())
+    np.testing.assert_array_equal(store.toarray('A'), A)
+    assert store.toarray('Z').dtype == np.float32
+    np.testing.assert_array_equal(store.toarray('Z'), Z)
+    np.testing.assert_array_equal(store.block('A').toarray(), A)
+    for region in store.regions:
+        cols = store.col_index(region)
+        assert all(COL_REGIONS[c] == region for c in cols)
+        column_block = store.column_block('A', region)
+        assert sp.isspmatrix_csc(column_block)
+        np.testing.assert_array_equal(column_block.toarray(), A[:, cols])
+        rows = store.row_index(region)
+        np.testing.assert_array_equal(store.row_block('A', region).toarray(),
+                                      A[rows])
+    rows, cols = store.row_index(['DE']), store.col_index(['NL', 'GLO'])
+    np.testing.assert_array_equal(store.block('A', ['DE'], ['NL', 'GLO'],
+                                              'dense'), A[np.ix_(rows, cols)])
+
+
+def test_empty_blocks_are_not_written(tables, logger, tmp_path):
+    A, Z = tables
+    out_dir = str(tmp_path/'store')
+    write_model(out_dir, {'A': A}, _labels(ROW_REGIONS),
+                _labels(COL_REGIONS), logger)
+    with open(os.path.join(out_dir, 'index.json')) as f:
+        blocks = json.load(f)['tables']['A']['blocks']
+    assert [row[2] for row in blocks] == [None]*3
+
+
+def test_write_model_errors(tables, logger, tmp_path):
+    A, Z = tables
+    with pytest.raises(ValueError):
+        write_model(str(tmp_path), {'A': A}, _labels(ROW_REGIONS),
+                    _labels(COL_REGIONS), logger, 'gzip')
+    with pytest.raises(ValueError):
+        write_model(str(tmp_path), {'A': A[:,1:]}, _labels(ROW_REGIONS),
+                    _labels(COL_REGIONS), logger)
@@ -0,0 +1,87 @@
+import csv
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from block_matrix import BlockMatrix
+from label_index import LabelTable
+from mojo_logger import StageProfiler, describe
+
+FIELDS = ['stage', 'wall_time', 'cpu_time', 'rss_mb', 'rss_delta_mb',
+          'peak_rss_mb', 'maxrss_growth_mb', 'traced_delta_mb',
+          'traced_peak_mb', 'outputs']
+
+
+@pytest.fixture
+def no_tracing_after():
+    """Stops the tracemalloc started by a StageProfiler, which slows down
+    the later tests."""
+    tracing = tracemalloc.is_tracing()
+    yield
+    if not tracing:
+        tracemalloc.stop()
+
+
+def _allocate(n_bytes):
+    a = np.ones(n_bytes//8)
+    time.sleep(0.05) #long enough to be sampled
+    return float(a.sum())
+
+
+def test_describe():
+    dense = np.zeros((3, 4), dtype=np.float32)
+    dense[0, 1] = 1
+    csr = sp.random(5, 6, density=0.5, format='csr', random_state=0)
+    block = BlockMatrix([[dense, None], [None, csr]], [3, 5], [4, 6])
+    labels = LabelTable.from_array([['NL', 'a', 'b', 'c', 'd']])
+    descriptions = describe((dense, {'csr': csr, 'name': 'not an array'},
+                             [block, labels]))
+    assert descriptions == [
+        {'type': 'ndarray', 'shape': [3, 4], 'dtype': 'float32',
+         'nbytes': 48},
+        {'type': 'csr_matrix', 'shape': [5, 6], 'dtype': 'float64',
+         'nnz': 15},
+        {'type': 'BlockMatrix', 'shape': [8, 10], 'nnz': 16},
+        {'type': 'LabelTable', 'length': 1}]
+
+
+def test_write(tmp_path, logger, no_tracing_after):
+    profiler = StageProfiler(str(tmp_path), logger)
+    with profiler.stage('first') as record:
+        profiler.add_outputs(record, (np.zeros(10), sp.identity(3)))
+    profiler.profile('second')(np.ones)(5)
+    p2f_json, p2f_csv = profiler.write()
+    with open(p2f_json) as f:
+        stages = json.load(f)['stages']
+    assert [s['stage'] for s in stages] == ['first', 'second']
+    for s in stages:
+        assert set(s) == set(FIELDS)
+        assert s['wall_time'] >= 0 and s['cpu_time'] >= 0
+    assert stages[0]['outputs'][1] == {'type': 'dia_matrix', 'shape': [3, 3],
+                                       'dtype': 'float64', 'nnz': 3}
+    assert stages[1]['outputs'] == [{'type': 'ndarray', 'shape': [5],
+                                     'dtype': 'float64', 'nbytes': 40}]
+    with open(p2f_csv) as f:
+        rows = list(csv.DictReader(f))
+    assert set(rows[0]) == set(FIELDS)
+    assert json.loads(rows[1]['outputs']) == stages[1]['outputs']
+    assert float(rows[0]['wall_time']) == stages[0]['wall_time']
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'),
+                    reason='needs /proc to sample the resident memory')
+def test_peak_rss_per_stage(tmp_path):
+    profiler = StageProfiler(str(tmp_path), trace_memory=False)
+    with profiler.stage('large'):
+        _allocate(200*10**6)
+    with profiler.stage('small'):
+        _allocate(10**6)
+    large, small = profiler.records
+    assert large['peak_rss_mb'] - large['rss_mb'] > 150
+    #the process peak (ru_maxrss) would be the same for both stages
+    assert large['peak_rss_mb'] - small['peak_rss_mb'] > 150
+    assert small['peak_rss_mb'] >= small['rss_mb']
+    assert small['maxrss_growth_mb'] < 50
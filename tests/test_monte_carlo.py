@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+import aggregation as agg
+import monte_carlo
+import sparse_utils
+import system_model
+from leontief import LeontiefSolver
+from monte_carlo import OnlineStatistics, P2Quantile
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def samples():
+    """5000 samples of arrays of 3 elements with different distributions."""
+    rng = np.random.default_rng(0)
+    return np.stack([rng.normal(1, 2, 5000), rng.lognormal(0, 0.5, 5000),
+                     rng.uniform(-1, 1, 5000)], axis=1)
+
+
+def _assert_close_quantile(estimate, samples, p):
+    """The P2 estimate is within a small part of the standard deviation of
+    every element of the exact quantile."""
+    error = np.abs(estimate - np.quantile(samples, p, axis=0))
+    assert np.all(error <= 0.05*samples.std(axis=0))
+
+
+@pytest.mark.parametrize('p', [0.05, 0.5, 0.95])
+def test_p2_quantile(samples, p):
+    quantile = P2Quantile(p, samples.shape[1])
+    for x in samples:
+        quantile.add(x)
+    _assert_close_quantile(quantile.value(), samples, p)
+
+
+def test_p2_quantile_few_samples(samples):
+    quantile = P2Quantile(0.5, samples.shape[1])
+    for x in samples[:3]:
+        quantile.add(x)
+    np.testing.assert_allclose(quantile.value(),
+                               np.quantile(samples[:3], 0.5, axis=0))
+
+
+def test_online_statistics(samples):
+    statistics = OnlineStatistics(quantiles=(0.1, 0.5))
+    shaped = samples.reshape(-1, 1, 3)
+    for x in shaped:
+        statistics.add(x)
+    result = statistics.result()
+    assert set(result) == {'mean', 'std', 'min', 'max', 'q0.1', 'q0.5'}
+    for value in result.values():
+        assert value.shape == (1, 3)
+    np.testing.assert_allclose(result['mean'], shaped.mean(axis=0),
+                               rtol=1e-10)
+    np.testing.assert_allclose(result['std'], shaped.std(axis=0, ddof=1),
+                               rtol=1e-10)
+    np.testing.assert_array_equal(result['min'], shaped.min(axis=0))
+    np.testing.assert_array_equal(result['max'], shaped.max(axis=0))
+    for p in (0.1, 0.5):
+        _assert_close_quantile(result['q{:g}'.format(p)], shaped, p)
+
+
+def test_online_statistics_one_sample():
+    statistics = OnlineStatistics()
+    statistics.add(np.array([1.0, 2.0]))
+    result = statistics.result()
+    np.testing.assert_array_equal(result['std'], [0, 0])
+    np.testing.assert_array_equal(result['q0.5'], [1.0, 2.0])
+
+
+@pytest.fixture
+def model_pipeline(model_config, logger, tmp_path):
+    """Returns a function making a pipeline of the system model on the
+    synthetic data for the model_options given as keyword arguments; with
+    update_grid_mix the ENTSO-E grid mix is used."""
+    def make_pipeline(update_grid_mix=False, **model_options):
+        config = model_config(**model_options)
+        config.set('entsoe_data', 'update_grid_mix', str(update_grid_mix))
+        return Pipeline(system_model.model_stages(str(tmp_path)), config,
+                        logger)
+    return make_pipeline
+
+
+def _options(config, **options):
+    return dict(monte_carlo.get_options(config), **options)
+
+
+def _intensities(n):
+    return np.random.default_rng(5).random((n, 2))
+
+
+def _direct_multipliers(A, intensities, logger):
+    return LeontiefSolver(A, logger).solve_transposed(intensities)
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr'])
+def test_perturb_calorific_values(model_pipeline, logger, matrix_format):
+    pipeline = model_pipeline(matrix_format=matrix_format)
+    exio_v, exio_u = pipeline.run('sut')
+    aggregation_matrix = pipeline.run('aggregation_matrix')[0]
+    gas_rows = monte_carlo.calorific_rows((exio_v, exio_u),
+                                          aggregation_matrix)
+    perturbed = monte_carlo.perturb_calorific_values(
+                pipeline.run('aggregate'), gas_rows, aggregation_matrix,
+                np.random.default_rng(3), 0.1)
+    #the same draws, aggregated again with the perturbed values
+    values = aggregation_matrix.override_values*monte_carlo.\
+             lognormal_factors(np.random.default_rng(3), 0.1,
+                               aggregation_matrix.override_values.shape)
+    expected = agg.aggregate(exio_v, exio_u, agg.BlockAggregationMatrix(
+                             aggregation_matrix.block,
+                             aggregation_matrix.N_reg,
+                             aggregation_matrix.override_rows,
+                             aggregation_matrix.override_cols, values),
+                             logger)
+    for table, expected_table in zip(perturbed, expected):
+        assert sparse_utils.get_format(table) == matrix_format
+        np.testing.assert_allclose(sparse_utils.as_format(table, 'dense'),
+                                   sparse_utils.as_format(expected_table,
+                                                          'dense'),
+                                   rtol=1e-12, atol=1e-12)
+
+
+def test_sample_warm_start(model_pipeline, logger, tmp_path):
+    pipeline = model_pipeline()
+    options = _options(pipeline.config, perturb=['sut'], tol=1e-12)
+    base = monte_carlo.base_outputs(pipeline, options['perturb'])
+    base['intensities'] = _intensities(base['iot'][1].shape[0])
+    model = monte_carlo.SampleModel(base, pipeline.config, logger,
+                                    str(tmp_path), options)
+    multipliers = model.sample(np.random.default_rng(7))
+    #the A of the same sample, solved directly
+    sample = Pipeline(system_model.model_stages(str(tmp_path)),
+                      pipeline.config, logger)
+    sample.results['aggregate'] = monte_carlo.perturb_sut(
+                   base['aggregate'], np.random.default_rng(7),
+                   options['sut_sigma'])
+    Z, A = sample.run('iot')
+    np.testing.assert_allclose(multipliers, _direct_multipliers(
+                               A, base['intensities'], logger), rtol=1e-8)
+    assert model.n_unconverged == 0
+    assert not np.allclose(multipliers, model.base_multipliers)
+
+
+def test_sample_grid_mix(model_pipeline, logger, tmp_path):
+    pipeline = model_pipeline(update_grid_mix=True)
+    options = _options(pipeline.config, perturb=['entsoe'],
+                       entsoe_concentration=10)
+    base = monte_carlo.base_outputs(pipeline, options['perturb'])
+    assert 'aggregate' not in base #no stage is rerun
+    base['intensities'] = _intensities(base['iot'][1].shape[0])
+    model = monte_carlo.SampleModel(base, pipeline.config, logger,
+                                    str(tmp_path), options)
+    multipliers = model.sample(np.random.default_rng(8))
+    #the model rebuilt with the same grid mix, solved directly
+    sample = Pipeline(system_model.model_stages(str(tmp_path)),
+                      pipeline.config, logger)
+    sample.results['entsoe_mix'] = monte_carlo.perturb_grid_mix(
+                      base['entsoe_mix'], np.random.default_rng(8),
+                      options['entsoe_concentration'])
+    Z, A = sample.run('iot')
+    np.testing.assert_allclose(multipliers, _direct_multipliers(
+                               A, base['intensities'], logger), rtol=1e-8)
+    assert not np.allclose(multipliers, model.base_multipliers)
+
+
+def test_independent_of_processes(model_pipeline, logger, tmp_path):
+    pipeline = model_pipeline(update_grid_mix=True)
+    n = pipeline.run('iot')[1].shape[0]
+    results = []
+    for processes in (1, 2):
+        options = _options(pipeline.config, n_samples=5, chunk_size=2,
+                           processes=processes, quantiles=[0.5])
+        results.append(monte_carlo.monte_carlo(pipeline, pipeline.config,
+                       logger, str(tmp_path), str(tmp_path/'mc'),
+                       _intensities(n), np.ones((n, 1)), options))
+    for name in ('multipliers', 'footprints'):
+        first, second = (r[name].result() for r in results)
+        assert results[0][name].count == 5
+        for key in first:
+            np.testing.assert_allclose(second[key], first[key], rtol=1e-10)
+        assert first['std'].max() > 0 #the samples differ
@@ -0,0 +1,157 @@
+import configparser
+import logging
+import os
+import pytest
+import pipeline
+import sparse_utils
+import system_model
+from pipeline import Pipeline, Stage, StageCache
+
+CALLS = [] #names of the toy stages that were run
+FAIL = set() #names of the toy stages that raise
+
+
+def _stage_func(config, logger):
+    return 1
+
+
+@pytest.fixture
+def iot_pipeline():
+    config = configparser.ConfigParser()
+    stage = Stage('iot', _stage_func, code=[system_model.make_IOT])
+    return Pipeline([stage], config, logging.getLogger(__name__))
+
+
+def test_code_closure_follows_module_attributes():
+    closure = pipeline.code_closure([system_model.make_IOT])
+    for helper in (sparse_utils.minus_offdiagonal, sparse_utils.diagonal,
+                   sparse_utils.scale_columns):
+        assert helper in closure
+
+
+def test_key_changes_with_helper_code(iot_pipeline, monkeypatch):
+    key = iot_pipeline.key('iot')
+    monkeypatch.setattr(sparse_utils.scale_columns, '__code__',
+                        (lambda M, s: M).__code__)
+    assert Pipeline(list(iot_pipeline.stages.values()), iot_pipeline.config,
+                    iot_pipeline.logger).key('iot') != key
+
+
+def _run_toy(name, value):
+    CALLS.append(name)
+    if name in FAIL:
+        raise RuntimeError('{} interrupted'.format(name))
+    return value
+
+
+def _data(config, logger):
+    p2f = os.path.join(config.get('toy', 'ddir'), config.get('toy', 'data'))
+    with open(p2f) as f:
+        return _run_toy('data', float(f.read()))
+
+
+def _scale(config, logger):
+    return _run_toy('scale', config.getfloat('toy', 'scale'))
+
+
+def _product(config, logger, data, scale):
+    return _run_toy('product', data*scale)
+
+
+def _report(config, logger, product):
+    return _run_toy('report', 'product {}'.format(product))
+
+
+@pytest.fixture
+def toy(tmp_path):
+    """Returns a function making a pipeline of toy stages
+    data (file) -> product <- scale (config), product -> report with the
+    stage cache in tmp_path, and the config."""
+    del CALLS[:]
+    FAIL.clear()
+    (tmp_path/'data.txt').write_text('3')
+    config = configparser.ConfigParser()
+    config.read_dict({'toy': {'ddir': str(tmp_path), 'data': 'data.txt',
+                              'scale': '2'}})
+    stages = [Stage('data', _data, files=[('toy', 'data')],
+                    config_keys=[('toy', 'data')]),
+              Stage('scale', _scale, config_keys=[('toy', 'scale')]),
+              Stage('product', _product, inputs=['data', 'scale']),
+              Stage('report', _report, inputs=['product'])]
+    cache = StageCache(str(tmp_path/'cache'))
+    def make_pipeline():
+        return Pipeline(stages, config, logging.getLogger(__name__), cache)
+    return make_pipeline, config
+
+
+def test_change_reruns_downstream_stages(toy, tmp_path):
+    make_pipeline, config = toy
+    assert make_pipeline().run('report') == 'product 6.0'
+    assert CALLS == ['data', 'scale', 'product', 'report']
+    del CALLS[:]
+    assert make_pipeline().run('report') == 'product 6.0'
+    assert CALLS == []
+    config.set('toy', 'scale', '4')
+    assert make_pipeline().downstream(['scale']) == {'scale', 'product',
+                                                     'report'}
+    assert make_pipeline().run('report') == 'product 12.0'
+    assert CALLS == ['scale', 'product', 'report']
+    del CALLS[:]
+    (tmp_path/'data.txt').write_text('10')
+    assert make_pipeline().run('report') == 'product 40.0'
+    assert CALLS == ['data', 'product', 'report']
+
+
+def test_interrupted_run_resumes(toy):
+    make_pipeline, config = toy
+    FAIL.add('product')
+    with pytest.raises(RuntimeError):
+        make_pipeline().run('report')
+    assert CALLS == ['data', 'scale', 'product']
+    del CALLS[:]
+    FAIL.clear()
+    assert make_pipeline().run('report') == 'product 6.0'
+    assert CALLS == ['product', 'report']
+
+
+def _fill_cache(cache, names):
+    """Stores an output for every name, the first least recently used, and
+    returns the size of one output."""
+    for t, name in enumerate(names):
+        cache.store(name, b'x'*1000)
+        os.utime(cache.path(name), (1000 + t, 1000 + t))
+    return os.path.getsize(cache.path(names[0]))
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = StageCache(str(tmp_path))
+    size = _fill_cache(cache, ['a', 'b', 'c'])
+    cache.load('a') #now the most recently used
+    cache.max_size = 2.5*size
+    cache.store('d', b'x'*1000)
+    assert [n for n in 'abcd' if cache.has(n)] == ['a', 'd']
+
+
+def test_evict_keeps_stored_key(tmp_path):
+    cache = StageCache(str(tmp_path))
+    size = _fill_cache(cache, ['a', 'b'])
+    cache.max_size = size/2
+    cache.store('c', b'x'*1000)
+    assert [n for n in 'abc' if cache.has(n)] == ['c']
+    assert cache.evict(keep=cache.path('c')) == []
+    assert cache.has('c')
+
+
+def test_aggregation_report_on_cache_hit(model_config, logger, tmp_path,
+                                         caplog):
+    log_dir = str(tmp_path/'log')
+    os.makedirs(log_dir)
+    config = model_config(stage_cache_dir=str(tmp_path/'cache'))
+    system_model.system_model(config, logger, log_dir)
+    assert os.path.exists(os.path.join(log_dir, 'report.csv'))
+    config.set('project_info', 'aggregation_report_file', 'r2.csv')
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        system_model.system_model(config, logger, log_dir)
+    assert 'Loading stage iot from cache' in caplog.text
+    assert os.path.exists(os.path.join(log_dir, 'r2.csv'))
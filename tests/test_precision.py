@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import precision
+import system_model
+from pipeline import Pipeline
+
+
+def _iot(config, logger, log_dir):
+    return Pipeline(system_model.model_stages(log_dir), config,
+                    logger).run('iot')
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr'])
+def test_float32_model(model_config, logger, tmp_path, matrix_format):
+    Z, A = _iot(model_config(dtype='float32', matrix_format=matrix_format),
+                logger, str(tmp_path))
+    for table in (Z, A):
+        #the main block is stored in float32, the market blocks in float64
+        assert table.block(0,0).dtype == np.float32
+        for i, j in ((0,1), (0,2), (1,0), (2,0)):
+            assert table.block(i,j).dtype == np.float64
+    Z_ref, A_ref = _iot(model_config(matrix_format=matrix_format), logger,
+                        str(tmp_path))
+    records = precision.drift_report({'Z': Z, 'A': A},
+                                     {'Z': Z_ref, 'A': A_ref}, 'float32')
+    assert set(records[0]) == set(precision.DRIFT_FIELDS)
+    totals = [r for r in records if r['block'] == 'all']
+    assert [r['table'] for r in totals] == ['Z', 'A']
+    assert all(r['max_rel_error'] > 0 for r in totals)
+    for record in records:
+        assert record['max_rel_error'] < 1e-6
+        assert record['rel_frobenius_error'] < 1e-6
+
+
+def test_no_drift(model_config, logger, tmp_path):
+    Z, A = _iot(model_config(), logger, str(tmp_path))
+    records = precision.drift_report({'A': A}, {'A': A}, 'float64')
+    assert all(r['max_abs_error'] == 0 and r['max_col_sum_error'] == 0
+               for r in records)
+    p2f = precision.write_drift_report(records, str(tmp_path/'drift.csv'))
+    with open(p2f) as f:
+        assert len(f.readlines()) == len(records) + 1
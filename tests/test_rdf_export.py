@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import rdf_export
+import rdf_import
+from label_index import LabelTable
+from model_store import write_model
+
+#rows: the products of two regions, columns: their activities and a market
+ROWS = [['AU', 'Paddy rice', 'p01.a', 'C_PARI', 'tonnes'],
+        ['AU', 'Electricity', 'p40.11', 'C_POWC', 'TJ'],
+        ['NL', 'Paddy rice', 'p01.a', 'C_PARI', 'tonnes'],
+        ['NL', 'Electricity', 'p40.11', 'C_POWC', 'TJ']]
+COLS = ROWS + [['GLO', 'Market for "slag"', 'M_slag', 'M_slag', 'tonnes']]
+#an ontology that does not end with #
+OPTIONS = {'ontology': 'http://ontology.bonsai.uno/core/',
+           'version': 'test'}
+
+
+@pytest.fixture
+def A():
+    A = np.zeros((len(ROWS), len(COLS)))
+    A[[0, 1, 3, 1, 2], [0, 0, 1, 3, 4]] = [0.5, 1e-7, -0.25, 2.0, 1/3]
+    return A
+
+
+def _labels():
+    return LabelTable.from_array(ROWS), LabelTable.from_array(COLS)
+
+
+def _read_A(p2fs, vocabulary):
+    """Returns A of the direct requirements in the exported files."""
+    row_labels, col_labels = _labels()
+    row_activities, flow_objects, col_activities = rdf_export.label_iris(
+                                   row_labels, col_labels, vocabulary)
+    t = vocabulary.terms
+    coefficients = {}
+    for p2f in p2fs:
+        for s, p, o in rdf_import.iter_triples(p2f):
+            coefficients.setdefault(s, {})[p[1:-1]] = o
+    A = np.zeros((len(ROWS), len(COLS)))
+    for s, triples in coefficients.items():
+        assert triples[t['type']] == '<{}>'.format(t['coefficient_class'])
+        assert triples[t['value']].endswith('^^<{}>'.format(t['double']))
+        j = list(col_activities).index(triples[t['input_of']])
+        i = list(row_activities).index(triples[t['output_of']])
+        assert triples[t['flow_object']] == flow_objects[i]
+        assert s == '<{}{}_{}>'.format(vocabulary.coefficient, i, j)
+        A[i, j] = rdf_import._literal_value(triples[t['value']])
+    return A
+
+
+def _check_labels(p2f, vocabulary):
+    t = vocabulary.terms
+    triples = list(rdf_import.iter_triples(p2f))
+    types = [o for s, p, o in triples if p == '<{}>'.format(t['type'])]
+    assert types.count('<{}>'.format(t['activity_class'])) == len(COLS)
+    assert types.count('<{}>'.format(t['market_class'])) == 1
+    #one flow object per product code
+    assert types.count('<{}>'.format(t['flow_object_class'])) == 2
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('rdf_format', ['nt', 'ttl'])
+@pytest.mark.parametrize('options', [None, OPTIONS])
+def test_export_A(A, logger, tmp_path, rdf_format, compress, options):
+    vocabulary = rdf_export.Vocabulary(options)
+    row_labels, col_labels = _labels()
+    p2fs = rdf_export.export_A(sp.csc_matrix(A), row_labels, col_labels,
+                               str(tmp_path), logger, rdf_format, compress,
+                               vocabulary, chunk_columns=2)
+    assert [os.path.basename(p) for p in p2fs] ==\
+           ['labels.nt' + '.gz'*compress,
+            'A.{}{}'.format(rdf_format, '.gz'*compress)]
+    _check_labels(p2fs[0], vocabulary)
+    np.testing.assert_array_equal(_read_A(p2fs[1:], vocabulary), A)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+@pytest.mark.parametrize('rdf_format', ['nt', 'ttl'])
+def test_export_model_store(A, logger, tmp_path, rdf_format, processes):
+    row_labels, col_labels = _labels()
+    store_dir = str(tmp_path/'store')
+    write_model(store_dir, {'A': A}, row_labels, col_labels, logger)
+    p2fs = rdf_export.export_model_store(store_dir, str(tmp_path/'rdf'),
+                                         logger, rdf_format, True, OPTIONS,
+                                         processes, chunk_columns=1)
+    #one shard per column region
+    assert sorted(os.path.basename(p) for p in p2fs[1:]) ==\
+           ['A_{}.{}.gz'.format(r, rdf_format) for r in ('AU', 'GLO', 'NL')]
+    vocabulary = rdf_export.Vocabulary(OPTIONS)
+    _check_labels(p2fs[0], vocabulary)
+    np.testing.assert_array_equal(_read_A(p2fs[1:], vocabulary), A)
+
+
+def test_turtle_terms():
+    vocabulary = rdf_export.Vocabulary(OPTIONS)
+    assert vocabulary.turtle_term('input_of') == 'bont:isInputOf'
+    assert rdf_export.turtle_prefixes(vocabulary).startswith(
+           '@prefix bont: <{}> .'.format(OPTIONS['ontology']))
+    vocabulary = rdf_export.Vocabulary({'input_of': 'is/input'})
+    assert vocabulary.turtle_term('input_of') == '<{}is/input>'.format(
+                                        rdf_export.VOCABULARY['ontology'])
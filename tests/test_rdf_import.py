@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+import rdf_export
+import rdf_import
+
+COUNTRIES = ['AU', 'NL']
+PRODUCTS = ['C_A', 'C_B']
+ACTIVITIES = ['A_X', 'A_Y']
+BASE = 'http://rdf.bonsai.uno/'
+ONTOLOGY = rdf_export.VOCABULARY['ontology']
+DOUBLE = '<{}double>'.format(rdf_export.XSD)
+
+#flows before the activities they use, the flow f5 and the activity act2
+#split over the dump and a flow of an unknown product (C_Z)
+TRIPLES = [
+    ('flow/f1', 'a', 'Flow'),
+    ('flow/f1', 'hasFlowObject', 'flowobject/C_A'),
+    ('flow/f1', 'isOutputOf', 'activity/act1'),
+    ('flow/f1', 'value', 2.0),
+    ('flow/f5', 'hasFlowObject', 'flowobject/C_B'),
+    ('flow/f5', 'isOutputOf', 'activity/act2'),
+    ('flow/f2', 'hasFlowObject', 'flowobject/C_B'),
+    ('flow/f2', 'isInputOf', 'activity/act2'),
+    ('flow/f2', 'hasLocation', 'location/AU'),
+    ('flow/f2', 'value', 3.0),
+    ('flow/f3', 'hasFlowObject', 'flowobject/C_A'),
+    ('flow/f3', 'isInputOf', 'activity/act2'),
+    ('flow/f3', 'value', 1.5),
+    ('flow/f4', 'hasFlowObject', 'flowobject/C_B'),
+    ('flow/f4', 'isInputOf', 'activity/act1'),
+    ('flow/f4', 'isOutputOf', 'activity/act2'),
+    ('flow/f4', 'value', 4.0),
+    ('flow/f6', 'hasFlowObject', 'flowobject/C_Z'),
+    ('flow/f6', 'isOutputOf', 'activity/act1'),
+    ('flow/f6', 'value', 7.0),
+    ('activity/act2', 'hasActivityType', 'activitytype/A_Y'),
+    ('flow/f5', 'value', 5.0),
+    ('flow/f7', 'hasFlowObject', 'flowobject/C_A'),
+    ('flow/f7', 'isOutputOf', 'activity/act1'),
+    ('flow/f7', 'value', 1.0),
+    ('activity/act1', 'hasActivityType', 'activitytype/A_X'),
+    ('activity/act1', 'hasLocation', 'location/AU'),
+    ('activity/act2', 'hasLocation', 'location/NL'),
+    ]
+
+#the same triples in Turtle, with prefixed names, ; and , lists, a and
+#numbers
+TURTLE = '''\
+@prefix b: <{ontology}> .
+@prefix rdf: <{rdf}> .
+@prefix xsd: <{xsd}> .
+PREFIX f: <{base}flow/>
+PREFIX act: <{base}activity/>
+@prefix fo: <{base}flowobject/> .
+@prefix loc: <{base}location/> .
+
+# flows
+f:f1 a b:Flow ;
+    b:hasFlowObject fo:C_A ;
+    b:isOutputOf act:act1 ;
+    rdf:value "2.0"^^xsd:double .
+f:f5 b:hasFlowObject fo:C_B ; b:isOutputOf act:act2 .
+f:f2 b:hasFlowObject fo:C_B ; b:isInputOf act:act2 ;
+    b:hasLocation loc:AU ; rdf:value 3.0 .
+f:f3 b:hasFlowObject fo:C_A ; b:isInputOf act:act2 ; rdf:value 1.5e0 .
+f:f4 b:hasFlowObject fo:C_B ;
+    b:isInputOf act:act1 ;
+    b:isOutputOf act:act2 ;
+    rdf:value "4.0"^^<{xsd}double> .
+f:f6 b:hasFlowObject fo:C_Z ; b:isOutputOf act:act1 ; rdf:value 7 .
+act:act2 b:hasActivityType <{base}activitytype/A_Y> .
+f:f5 rdf:value 5.0.
+f:f7 b:hasFlowObject fo:C_A ; b:isOutputOf act:act1 ; rdf:value 1.0 .
+act:act1 b:hasActivityType <{base}activitytype/A_X> ;
+    b:hasLocation loc:AU .
+act:act2 b:hasLocation loc:NL .
+'''.format(ontology=ONTOLOGY, rdf=rdf_export.RDF, xsd=rdf_export.XSD,
+           base=BASE)
+
+
+def _term(term):
+    if isinstance(term, float):
+        return '"{}"^^{}'.format(term, DOUBLE)
+    if term == 'a':
+        return '<{}type>'.format(rdf_export.RDF)
+    if term == 'value':
+        return '<{}value>'.format(rdf_export.RDF)
+    if '/' not in term:
+        return '<{}{}>'.format(ONTOLOGY, term)
+    return '<{}{}>'.format(BASE, term)
+
+
+def _ntriples(triples):
+    return ''.join('{} {} {} .\n'.format(*(_term(t) for t in triple))
+                   for triple in triples)
+
+
+def _expected():
+    V, U = np.zeros((4, 4)), np.zeros((4, 4))
+    V[0,0] = 2.0 + 1.0 #f1 and f7, product C_A of AU by A_X in AU
+    V[3,3] = 5.0 #f5, C_B of NL by A_Y in NL
+    U[1,3] = 3.0 #f2, C_B from AU (flow location) used by A_Y in NL
+    U[2,3] = 1.5 #f3, C_A from NL (the using activity) used by A_Y in NL
+    U[3,0] = 4.0 #f4, C_B from NL (the supplying activity) used by A_X
+    return V, U
+
+
+def _read_sut(path, logger, buffer_size):
+    V, U = rdf_import.read_sut(str(path), COUNTRIES, PRODUCTS, ACTIVITIES,
+                               logger, buffer_size=buffer_size)
+    return V.toarray(), U.toarray()
+
+
+@pytest.mark.parametrize('buffer_size', [2, 1000000])
+@pytest.mark.parametrize('rdf_format', ['nt', 'ttl'])
+def test_read_sut(tmp_path, logger, caplog, rdf_format, buffer_size):
+    p2f = tmp_path/('dump.' + rdf_format)
+    p2f.write_text(_ntriples(TRIPLES) if rdf_format == 'nt' else TURTLE)
+    V, U = _read_sut(p2f, logger, buffer_size)
+    V_expected, U_expected = _expected()
+    np.testing.assert_array_equal(V, V_expected)
+    np.testing.assert_array_equal(U, U_expected)
+    assert 'Skipped 1 flows' in caplog.text #f6
+
+
+def test_read_sut_directory(tmp_path, logger):
+    #the activities are only defined in the last file of the dump
+    (tmp_path/'1_flows.nt').write_text(_ntriples(TRIPLES[:25]))
+    (tmp_path/'2_activities.nt').write_text(_ntriples(TRIPLES[25:]))
+    (tmp_path/'readme.txt').write_text('not part of the dump')
+    V, U = _read_sut(tmp_path, logger, 2)
+    V_expected, U_expected = _expected()
+    np.testing.assert_array_equal(V, V_expected)
+    np.testing.assert_array_equal(U, U_expected)
+
+
+def test_turtle_terms():
+    lines = ['@prefix xsd: <{}> .\n'.format(rdf_export.XSD),
+             '@prefix ex: <http://example.org/> .\n',
+             'ex:s ex:p "1.5"^^xsd:double , "x"@en , 2 , -3.5 .\n']
+    assert [o for s, p, o in rdf_import.iter_turtle(lines)] ==\
+           ['"1.5"^^{}'.format(DOUBLE), '"x"@en',
+            '"2"^^<{}integer>'.format(rdf_export.XSD),
+            '"-3.5"^^<{}decimal>'.format(rdf_export.XSD)]
+    line = '<http://example.org/s> <http://example.org/p> "1.5"^^{} .\n'
+    assert list(rdf_import.iter_ntriples([line.format(DOUBLE)])) ==\
+           [('<http://example.org/s>', '<http://example.org/p>',
+             '"1.5"^^{}'.format(DOUBLE))]
+
+
+@pytest.mark.parametrize('line', ['ex:s ex:p """multi\n',
+                                  'ex:s ex:p [ ex:q 1 ] .\n',
+                                  'other:s ex:p 1 .\n'])
+def test_unsupported_turtle(line):
+    lines = ['@prefix ex: <http://example.org/> .\n', line]
+    with pytest.raises(ValueError):
+        list(rdf_import.iter_turtle(lines))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import sparse_utils
+
+N = 8
+
+
+def _tables(seed):
+    rng = np.random.default_rng(seed)
+    U = rng.random((N, N))*(rng.random((N, N)) < 0.4)
+    V = rng.random((N, N))*(rng.random((N, N)) < 0.3)
+    V[np.arange(N), np.arange(N)] = rng.random(N) + 1
+    V[2,2] = 0 #a zero on the diagonal
+    return U, V
+
+
+def _as_format(a, matrix_format):
+    return a if matrix_format == 'dense' else\
+           sp.csr_matrix(a).asformat(matrix_format)
+
+
+@pytest.mark.parametrize('v_format', ['dense', 'csr', 'csc'])
+@pytest.mark.parametrize('u_format', ['dense', 'csr', 'csc'])
+def test_minus_offdiagonal(u_format, v_format):
+    U, V = _tables(0)
+    z = sparse_utils.minus_offdiagonal(_as_format(U, u_format),
+                                       _as_format(V, v_format))
+    if 'dense' in (u_format, v_format):
+        assert isinstance(z, np.ndarray)
+    else:
+        assert z.format == u_format
+        z = z.toarray()
+    np.testing.assert_allclose(z, U - V + np.diag(np.diag(V)), rtol=1e-14)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr', 'csc'])
+@pytest.mark.parametrize('inplace', [False, True])
+def test_scale_columns(matrix_format, dtype, inplace):
+    U, V = _tables(1)
+    factors = np.diag(V).copy()
+    factors[factors == 0] = 1
+    a = _as_format((U - V + np.diag(np.diag(V))).astype(dtype),
+                   matrix_format)
+    original = a.copy()
+    scaled = sparse_utils.scale_columns(a, factors, inplace=inplace)
+    assert (scaled is a) == inplace
+    assert scaled.dtype == dtype
+    if not inplace:
+        np.testing.assert_array_equal(sparse_utils.as_format(a, 'dense'),
+                                      sparse_utils.as_format(original,
+                                                             'dense'))
+    np.testing.assert_allclose(sparse_utils.as_format(scaled, 'dense'),
+                               sparse_utils.as_format(original, 'dense') /
+                               factors, rtol=1e-6 if dtype == np.float32
+                               else 1e-14)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import system_model
+
+
+@pytest.fixture
+def in_memory_model(model_config, logger, tmp_path):
+    return system_model.system_model(model_config(), logger, str(tmp_path))
+
+
+#1 kB streams the table one region at a time, 1 GB all regions at once
+@pytest.mark.parametrize('memory_budget', ['1e-6', '1'])
+def test_streamed_model_matches_in_memory(in_memory_model, model_config,
+                                          logger, tmp_path, memory_budget):
+    Z, A, row_labels, col_labels = in_memory_model
+    Z_s, A_s, row_labels_s, col_labels_s = system_model.system_model(
+             model_config(memory_budget=memory_budget), logger, str(tmp_path))
+    np.testing.assert_allclose(Z_s.toarray(), Z.toarray(), rtol=1e-10,
+                               atol=1e-12)
+    np.testing.assert_allclose(A_s.toarray(), A.toarray(), rtol=1e-10,
+                               atol=1e-12)
+    np.testing.assert_array_equal(row_labels_s.to_array(),
+                                  row_labels.to_array())
+    np.testing.assert_array_equal(col_labels_s.to_array(),
+                                  col_labels.to_array())
+    assert isinstance(Z_s.block(0, 0), np.memmap)
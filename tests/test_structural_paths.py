@@ -0,0 +1,84 @@
+import itertools
+import numpy as np
+import pytest
+from leontief import LeontiefSolver
+from structural_paths import StructuralPathAnalysis
+
+N = 5
+MAX_DEPTH = 3
+
+
+@pytest.fixture
+def system():
+    """Small non negative A (for which the bound of the search is exact),
+    intensities f and final demand y."""
+    rng = np.random.default_rng(0)
+    A = rng.random((N, N)) * (rng.random((N, N)) < 0.6) * 0.3
+    f = rng.random(N)
+    f[1] = 0
+    y = np.zeros(N)
+    y[[0, 3]] = [1.0, 2.0]
+    return A, f, y
+
+
+def _all_paths(A, f, y, max_depth):
+    """All paths up to max_depth with their contribution, enumerated by
+    brute force."""
+    paths = {}
+    for depth in range(max_depth+1):
+        for path in itertools.product(range(N), repeat=depth+1):
+            value = y[path[0]]*f[path[-1]]
+            for downstream, upstream in zip(path, path[1:]):
+                value *= A[upstream, downstream]
+            if value != 0:
+                paths[path] = value
+    return paths
+
+
+def test_footprint(system, logger):
+    A, f, y = system
+    spa = StructuralPathAnalysis(A, f, logger)
+    expected = f @ np.linalg.solve(np.identity(N) - A, y)
+    assert spa.footprint(y) == pytest.approx(expected, rel=1e-10)
+    spa = StructuralPathAnalysis(A, f, logger, LeontiefSolver(A, logger))
+    assert spa.footprint(y) == pytest.approx(expected, rel=1e-10)
+
+
+def test_all_paths(system, logger):
+    A, f, y = system
+    expected = _all_paths(A, f, y, MAX_DEPTH)
+    paths = StructuralPathAnalysis(A, f, logger).paths(
+                    y, n_paths=N**(MAX_DEPTH+1), threshold=0,
+                    max_depth=MAX_DEPTH)
+    found = {path: value for value, path in paths if value != 0}
+    assert found.keys() == expected.keys()
+    for path, value in expected.items():
+        assert found[path] == pytest.approx(value, rel=1e-12)
+    contributions = [abs(value) for value, path in paths]
+    assert contributions == sorted(contributions, reverse=True)
+
+
+def test_best_paths(system, logger):
+    A, f, y = system
+    expected = sorted(_all_paths(A, f, y, MAX_DEPTH).items(),
+                      key=lambda p: -abs(p[1]))[:10]
+    paths = StructuralPathAnalysis(A, f, logger).paths(
+                    y, n_paths=10, threshold=0, max_depth=MAX_DEPTH)
+    assert [path for value, path in paths] ==\
+           [path for path, value in expected]
+    np.testing.assert_allclose([value for value, path in paths],
+                               [value for path, value in expected],
+                               rtol=1e-12)
+
+
+def test_threshold(system, logger):
+    A, f, y = system
+    spa = StructuralPathAnalysis(A, f, logger)
+    threshold = 0.01
+    min_value = threshold*spa.footprint(y)
+    expected = {path for path, value in
+                _all_paths(A, f, y, MAX_DEPTH).items()
+                if abs(value) >= min_value}
+    paths = spa.paths(y, n_paths=N**(MAX_DEPTH+1), threshold=threshold,
+                      max_depth=MAX_DEPTH)
+    assert {path for value, path in paths} == expected
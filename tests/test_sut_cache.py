@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import sut_cache
+
+
+def _write_table(values, p2f):
+    """Writes values with two level labels, like the supply and use
+    tables."""
+    n_rows, n_cols = values.shape
+    index = pd.MultiIndex.from_arrays([['r']*n_rows,
+                                       [str(i) for i in range(n_rows)]])
+    columns = pd.MultiIndex.from_arrays([['r']*n_cols,
+                                         [str(i) for i in range(n_cols)]])
+    pd.DataFrame(values, index=index, columns=columns).to_csv(p2f)
+
+
+@pytest.fixture
+def source(tmp_path):
+    p2f = str(tmp_path/'table.csv')
+    _write_table(np.arange(6.).reshape(2, 3), p2f)
+    return p2f
+
+
+class CountingReader(object):
+    """read_table for cached_table that counts its calls."""
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def __call__(self, p2f):
+        self.n_calls += 1
+        return pd.read_csv(p2f, header=[0,1], index_col=[0,1])
+
+
+def _set_mtime(p2f, delta):
+    stat = os.stat(p2f)
+    os.utime(p2f, (stat.st_atime, stat.st_mtime + delta))
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr'])
+def test_cache_is_reused(source, tmp_path, logger, matrix_format):
+    reader = CountingReader()
+    cache_dir = str(tmp_path/'cache')
+    first = sut_cache.cached_table(source, cache_dir, reader, logger,
+                                   matrix_format)
+    second = sut_cache.cached_table(source, cache_dir, reader, logger,
+                                    matrix_format)
+    assert reader.n_calls == 1
+    if matrix_format == 'dense':
+        assert isinstance(second, np.memmap)
+    else:
+        first, second = first.toarray(), second.toarray()
+    np.testing.assert_array_equal(first, second)
+
+
+def test_size_change_invalidates(source, tmp_path, logger):
+    reader = CountingReader()
+    cache_dir = str(tmp_path/'cache')
+    sut_cache.cached_table(source, cache_dir, reader, logger)
+    _write_table(np.arange(9.).reshape(3, 3), source)
+    table = sut_cache.cached_table(source, cache_dir, reader, logger)
+    assert reader.n_calls == 2
+    assert table.shape == (3, 3)
+
+
+def test_mtime_change_with_new_content_invalidates(source, tmp_path, logger):
+    reader = CountingReader()
+    cache_dir = str(tmp_path/'cache')
+    sut_cache.cached_table(source, cache_dir, reader, logger)
+    size = os.path.getsize(source)
+    _write_table(np.arange(6.).reshape(2, 3)[::-1], source)
+    assert os.path.getsize(source) == size
+    _set_mtime(source, 10)
+    table = sut_cache.cached_table(source, cache_dir, reader, logger)
+    assert reader.n_calls == 2
+    np.testing.assert_array_equal(table, np.arange(6.).reshape(2, 3)[::-1])
+
+
+def test_touch_keeps_cache(source, tmp_path, logger):
+    reader = CountingReader()
+    cache_dir = str(tmp_path/'cache')
+    sut_cache.cached_table(source, cache_dir, reader, logger)
+    _set_mtime(source, 10)
+    assert sut_cache.is_valid(source, cache_dir, 'dense', logger)
+    sut_cache.cached_table(source, cache_dir, reader, logger)
+    assert reader.n_calls == 1
+
+
+def test_formats_are_cached_separately(source, tmp_path, logger):
+    reader = CountingReader()
+    cache_dir = str(tmp_path/'cache')
+    sut_cache.cached_table(source, cache_dir, reader, logger, 'dense')
+    assert not sut_cache.is_valid(source, cache_dir, 'csr', logger)
+    sut_cache.cached_table(source, cache_dir, reader, logger, 'csr')
+    assert sut_cache.is_valid(source, cache_dir, 'dense', logger)
+    assert sut_cache.is_valid(source, cache_dir, 'csr', logger)
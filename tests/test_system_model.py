@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import system_model
+from synthetic import make_synthetic
+
+
+def _aggregated_supply(data):
+    """The supply table of the synthetic data aggregated to the sectors
+    (N_reg*N_sec x N_reg*N_sec) by the aggregation matrix."""
+    N_reg = len(data['regions'])
+    aggregation = sp.csr_matrix(data['aggregation'].values)
+    return (sp.kron(sp.identity(N_reg), aggregation.T) @ data['V']).tocsr()
+
+
+@pytest.mark.parametrize('matrix_format', ['dense', 'csr'])
+@pytest.mark.parametrize('n_byproducts', [1, 4])
+def test_exclusive_byproducts(logger, matrix_format, n_byproducts):
+    data = make_synthetic(N_reg=4, density=0.001, secondary_density=0.005,
+                          n_byproducts=n_byproducts, seed=2)
+    v = _aggregated_supply(data)
+    if matrix_format == 'dense':
+        v = v.toarray()
+    rows = system_model.get_exclusive_byproducts(v, logger)
+    #in two of the four regions
+    assert len(rows) == 2*n_byproducts
+    np.testing.assert_array_equal(rows, np.sort(data['excl_byproducts']))
+    #supplied, but the activity of which they are the principal product has
+    #no output
+    v = sp.csr_matrix(v)
+    assert np.all(v[rows].sum(axis=1) > 0)
+    assert np.all(v[:, rows].sum(axis=0) == 0)
+
+
+def test_no_exclusive_byproducts(logger):
+    v = sp.random(6, 6, density=0.3, format='csr', random_state=0) +\
+        sp.identity(6, format='csr')
+    assert len(system_model.get_exclusive_byproducts(v, logger)) == 0